@@ -10,17 +10,23 @@ __all__ = ['mul']
 
 
 @typ.overload
-def mul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+def mul(a: np.ndarray, b: np.ndarray, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
     ...
 
 
 @typ.overload
-def mul(a: u.Quantity, b: u.Quantity) -> u.Quantity:
+def mul(a: u.Quantity, b: u.Quantity, out: typ.Optional[u.Quantity] = None) -> u.Quantity:
     ...
 
 
-def mul(a, b):
-    a = np.expand_dims(a, ~0)
-    b = np.swapaxes(b, ~0, ~1)
-    b = np.expand_dims(b, ~2)
-    return np.sum(a * b, axis=~1)
+def mul(a, b, out=None):
+    """
+    Multiply each matrix in `a` by the transpose of the corresponding matrix in `b`, broadcasting over all but the last
+    two axes.
+
+    :param a: Stack of matrices with shape :code:`(..., n, m)`.
+    :param b: Stack of matrices with shape :code:`(..., k, m)`.
+    :param out: Optional array with shape :code:`(..., n, k)` to store the result in.
+    :return: The product of `a` and the transpose of `b`.
+    """
+    return np.matmul(a, np.swapaxes(b, ~0, ~1), out=out)
@@ -1,3 +1,4 @@
+import typing as typ
 import dataclasses
 import numpy as np
 
@@ -17,6 +18,14 @@ class Broadcastable:
     def config_broadcast(self):
         return np.broadcast()
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        """
+        Names of the fields whose arrays have configuration axes, the fields included in :attr:`config_broadcast`.
+        Used by :func:`kgpy.optics.system.configurations.index_object` to select a subset of the configurations.
+        """
+        return []
+
     @property
     def shape(self):
         return self.config_broadcast.shape
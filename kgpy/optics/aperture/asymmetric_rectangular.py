@@ -26,6 +26,10 @@ class AsymmetricRectangular(Polygon):
             self.width_y_pos,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['width_x_neg', 'width_x_pos', 'width_y_neg', 'width_y_pos']
+
     @property
     def vertices(self) -> u.Quantity:
         v_x = np.stack([self.width_x_pos, self.width_x_neg, self.width_x_neg, self.width_x_pos])
@@ -23,6 +23,10 @@ class Circular(decenterable.Decenterable, obscurable.Obscurable, Aperture):
             self.radius,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['radius']
+
     @property
     def min(self) -> u.Quantity:
         return -self.max
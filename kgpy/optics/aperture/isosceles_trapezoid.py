@@ -31,3 +31,7 @@ class IsoscelesTrapezoid(Polygon):
             self.outer_radius,
             self.wedge_half_angle,
         )
+
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['inner_radius', 'outer_radius', 'wedge_half_angle']
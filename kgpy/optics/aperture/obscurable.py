@@ -1,3 +1,4 @@
+import typing as typ
 import dataclasses
 import numpy as np
 import kgpy.mixin
@@ -16,3 +17,7 @@ class Obscurable(kgpy.mixin.Broadcastable):
             super().config_broadcast,
             self.is_obscuration,
         )
+
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['is_obscuration']
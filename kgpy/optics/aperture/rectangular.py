@@ -31,6 +31,10 @@ class Rectangular(polygon.Polygon):
             self.half_width_y,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['half_width_x', 'half_width_y']
+
     def is_unvignetted(self, points: u.Quantity) -> np.ndarray:
         x = points[kgpy.vector.x]
         y = points[kgpy.vector.y]
@@ -26,6 +26,10 @@ class RegularPolygon(Polygon):
             self.radius,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['radius']
+
     @property
     def vertices(self) -> u.Quantity:
         angles = np.linspace(self.offset_angle, 360 * u.deg + self.offset_angle, self.num_sides, endpoint=False)
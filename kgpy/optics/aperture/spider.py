@@ -24,6 +24,10 @@ class Spider(decenterable.Decenterable, Aperture):
             self.num_arms,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['arm_half_width', 'num_arms']
+
     @property
     def wire(self) -> u.Quantity:
         a = np.linspace(0 * u.deg, 360 * u.deg, self.num_arms, endpoint=False)
@@ -3,3 +3,4 @@ from .decenter import Decenter
 from .translate import Translate
 from .tilt_decenter import TiltDecenter
 from .transform import Transform
+from .affine import Affine
@@ -0,0 +1,100 @@
+import dataclasses
+import typing as typ
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from .. import unitless
+from . import TiltDecenter
+
+__all__ = ['Affine']
+
+
+@dataclasses.dataclass
+class Affine:
+    """
+    A :class:`kgpy.optics.coordinate.TiltDecenter` evaluated once into a rotation matrix and a translation vector, so
+    that applying it does not recompute any trigonometric functions or allocate new transforms.
+    The transform and its inverse are both precomputed, since :meth:`__invert__` is called every time rays are
+    propagated through a surface.
+    """
+
+    rotation: np.ndarray                # Rotation matrix, with the configuration axes first.
+    translation: u.Quantity             # Translation vector, with the configuration axes first.
+    rotation_inverse: np.ndarray        # Rotation matrix of the transform computed by :code:`~transform`.
+    translation_inverse: u.Quantity     # Translation vector of the transform computed by :code:`~transform`.
+
+    @staticmethod
+    def _evaluate(transform: TiltDecenter) -> typ.Tuple[np.ndarray, u.Quantity]:
+        unit = u.mm
+        translation = transform(kgpy.vector.from_components() << unit)
+        columns = [transform(kgpy.vector.from_components(*np.eye(3)[i]) << unit) - translation for i in range(3)]
+        rotation = np.stack(np.broadcast_arrays(*columns, subok=True), axis=~0) / unit
+        return rotation.to_value(u.dimensionless_unscaled), translation
+
+    @classmethod
+    def from_tilt_decenter(cls, transform: TiltDecenter) -> 'Affine':
+        """
+        Evaluate a transform and its inverse.
+
+        :param transform: The transform to evaluate.
+        :return: An equivalent transform, whose inverse is equivalent to :code:`~transform`.
+        """
+        return cls(*cls._evaluate(transform), *cls._evaluate(~transform))
+
+    @classmethod
+    def from_thickness(cls, thickness: u.Quantity) -> 'Affine':
+        """
+        Transform equivalent to subtracting a scalar thickness from the :math:`z` component, like a surface does after
+        it has propagated the rays.
+        """
+        translation = -thickness * kgpy.vector.z_hat
+        return cls(np.identity(3), translation, np.identity(3), -translation)
+
+    @property
+    def is_identity(self) -> bool:
+        """
+        :code:`True` if this transform does not change any vector, to within the rounding error left over from
+        composing a transform with its inverse.
+        """
+        if not np.allclose(self.rotation, np.identity(3), rtol=0, atol=1e-12):
+            return False
+        zero = unitless.like(0 * u.mm, self.translation)
+        tolerance = unitless.like(1 * u.pm, self.translation)
+        return bool(np.allclose(self.translation, zero, rtol=0, atol=tolerance))
+
+    def __matmul__(self, other: 'Affine') -> 'Affine':
+        """
+        Composite transform that applies `other` and then this transform.
+        Its inverse applies the inverse of this transform and then the inverse of `other`.
+        """
+        return type(self)(
+            rotation=self.rotation @ other.rotation,
+            translation=kgpy.vector.matmul(self.rotation, other.translation) + self.translation,
+            rotation_inverse=other.rotation_inverse @ self.rotation_inverse,
+            translation_inverse=(
+                kgpy.vector.matmul(other.rotation_inverse, self.translation_inverse) + other.translation_inverse
+            ),
+        )
+
+    def __invert__(self) -> 'Affine':
+        return type(self)(self.rotation_inverse, self.translation_inverse, self.rotation, self.translation)
+
+    def __call__(
+            self,
+            value: u.Quantity,
+            tilt: bool = True,
+            decenter: bool = True,
+            num_extra_dims: int = 0,
+    ) -> u.Quantity:
+        if decenter and not tilt:
+            raise ValueError('The translation of an affine transform cannot be applied without its rotation')
+        if tilt:
+            sh = list(self.rotation.shape)
+            sh[~1:~1] = [1] * num_extra_dims
+            value = kgpy.vector.matmul(self.rotation.reshape(sh), value)
+        else:
+            value = value.copy()
+        if decenter:
+            translation = self.translation
+            value = value + translation.reshape(translation.shape[:~0] + (1, ) * num_extra_dims + (3, ))
+        return value
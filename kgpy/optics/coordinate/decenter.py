@@ -1,3 +1,4 @@
+import typing as typ
 import dataclasses
 import numpy as np
 from astropy import units as u
@@ -24,6 +25,10 @@ class Decenter(kgpy.mixin.Broadcastable):
             self.y,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['x', 'y']
+
     def __invert__(self):
         return type(self)(
             -self.x,
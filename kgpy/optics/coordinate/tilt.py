@@ -30,6 +30,10 @@ class Tilt(kgpy.mixin.Broadcastable):
             self.z,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['x', 'y', 'z']
+
     def __eq__(self, other: 'Tilt'):
         out = True
         out &= np.array(self.x == other.x).all()
@@ -1,3 +1,4 @@
+import typing as typ
 import dataclasses
 import numpy as np
 from astropy import units as u
@@ -22,6 +23,10 @@ class Translate(Decenter):
             self.z,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['z']
+
     def __invert__(self):
         return type(self)(
             -self.x,
@@ -1,3 +1,4 @@
+import copy
 import dataclasses
 import typing as typ
 import numpy as np
@@ -7,7 +8,7 @@ import astropy.units as u
 import astropy.visualization
 import kgpy.vector
 from kgpy.vector import x, y, z, ix, iy, iz
-from . import coordinate
+from . import coordinate, unitless
 
 __all__ = ['Rays']
 
@@ -56,6 +57,28 @@ class VAxis(Axis, CAxis):
     pass
 
 
+class LazyField:
+    """
+    Default value of an optional field of :class:`Rays` which is not allocated until the first time it is read.
+    Since this is a non-data descriptor, once the value is stored in the instance it is found without calling the
+    descriptor.
+    """
+
+    def __init__(self, factory: typ.Callable[['Rays'], np.ndarray]):
+        self.factory = factory
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return None
+        value = self.factory(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
 @dataclasses.dataclass
 class Rays:
 
@@ -65,30 +88,77 @@ class Rays:
     wavelength: u.Quantity
     position: u.Quantity
     direction: u.Quantity
-    polarization: u.Quantity = None
-    surface_normal: u.Quantity = None
+    polarization: u.Quantity = LazyField(lambda self: self._unit_vector_z())
+    surface_normal: u.Quantity = LazyField(lambda self: self._unit_vector_z())
     propagation_signum: float = 1
-    index_of_refraction: u.Quantity = None
+    index_of_refraction: u.Quantity = LazyField(
+        lambda self: unitless.like(np.ones(self.scalar_grid_shape) << u.dimensionless_unscaled, self.position)
+    )
+    optical_path_length: u.Quantity = LazyField(
+        lambda self: unitless.like(np.zeros(self.scalar_grid_shape) << u.mm, self.position)
+    )
     field_mask: np.ndarray = None
-    vignetted_mask: np.ndarray = None
-    error_mask: np.ndarray = None
+    vignetted_mask: np.ndarray = LazyField(lambda self: np.ones(self.grid_shape, dtype=np.bool))
+    error_mask: np.ndarray = LazyField(lambda self: np.ones(self.grid_shape, dtype=np.bool))
+    weight: np.ndarray = LazyField(lambda self: np.ones(self.grid_shape))
+    position_jacobian: typ.Optional[u.Quantity] = None
+    direction_jacobian: typ.Optional[u.Quantity] = None
     input_grids: typ.List[typ.Optional[u.Quantity]] = dataclasses.field(
         default_factory=lambda: [None, None, None, None, None],
     )
 
+    _vector_fields = [
+        'wavelength', 'position', 'direction', 'polarization', 'surface_normal', 'index_of_refraction',
+        'optical_path_length',
+    ]
+    _mask_fields = ['field_mask', 'vignetted_mask', 'error_mask']
+    _scalar_fields = ['weight']
+    _jacobian_fields = ['position_jacobian', 'direction_jacobian']
+
     def __post_init__(self):
-        if self.polarization is None:
-            self.polarization = np.zeros(self.vector_grid_shape) << u.dimensionless_unscaled
-            self.polarization[z] = 1
-        if self.surface_normal is None:
-            self.surface_normal = np.zeros(self.vector_grid_shape) << u.dimensionless_unscaled
-            self.surface_normal[z] = 1
-        if self.index_of_refraction is None:
-            self.index_of_refraction = np.ones(self.scalar_grid_shape) << u.dimensionless_unscaled
-        if self.vignetted_mask is None:
-            self.vignetted_mask = np.ones(self.grid_shape, dtype=np.bool)
-        if self.error_mask is None:
-            self.error_mask = np.ones(self.grid_shape, dtype=np.bool)
+        for name, value in list(vars(self).items()):
+            if value is None and isinstance(vars(type(self)).get(name), LazyField):
+                del self.__dict__[name]
+
+    def _unit_vector_z(self) -> u.Quantity:
+        a = np.zeros(self.vector_grid_shape) << u.dimensionless_unscaled
+        a[z] = 1
+        return unitless.like(a, self.position)
+
+    def is_allocated(self, name: str) -> bool:
+        """
+        Check whether a field has been set, or allocated by reading it, without allocating it.
+
+        :param name: Name of the field.
+        :return: :code:`False` if the field has a lazy default that has not been allocated, or if it is :code:`None`.
+        """
+        return vars(self).get(name) is not None
+
+    @property
+    def is_differential(self) -> bool:
+        """
+        :code:`True` if the derivatives of the rays with respect to their launch position are being traced, see
+        :meth:`init_jacobians`.
+        """
+        return self.position_jacobian is not None
+
+    def init_jacobians(self) -> 'Rays':
+        """
+        Start a differential raytrace.
+        The surfaces propagate :attr:`position_jacobian` and :attr:`direction_jacobian`, the derivatives of the
+        position and direction of each ray with respect to the :math:`x` and :math:`y` components of its current
+        position, alongside the rays themselves.
+        Both Jacobians have a trailing axis of length 3 for the vector components, followed by an axis of length 2 for
+        the two launch coordinates.
+
+        :return: This object, for chaining.
+        """
+        jacobian = np.zeros(self.vector_grid_shape + (2, ))
+        jacobian[..., ix, 0] = 1
+        jacobian[..., iy, 1] = 1
+        self.position_jacobian = unitless.like(jacobian << u.dimensionless_unscaled, self.position)
+        self.direction_jacobian = unitless.like(np.zeros_like(jacobian) << (1 / u.mm), self.position)
+        return self
 
     @classmethod
     def from_field_angles(
@@ -101,10 +171,44 @@ class Rays:
             pupil_grid_x: typ.Optional[u.Quantity] = None,
             pupil_grid_y: typ.Optional[u.Quantity] = None,
     ) -> 'Rays':
+        return cls.from_field_samples(
+            wavelength_grid=wavelength_grid,
+            position=position,
+            field_x=np.expand_dims(field_grid_x, ~0),
+            field_y=np.expand_dims(field_grid_y, ~1),
+            field_mask_func=field_mask_func,
+            input_grids=[wavelength_grid, field_grid_x, field_grid_y, pupil_grid_x, pupil_grid_y],
+        )
+
+    @classmethod
+    def from_field_samples(
+            cls,
+            wavelength_grid: u.Quantity,
+            position: u.Quantity,
+            field_x: u.Quantity,
+            field_y: u.Quantity,
+            field_mask_func: typ.Optional[typ.Callable[[u.Quantity, u.Quantity], np.ndarray]] = None,
+            input_grids: typ.Optional[typ.List[typ.Optional[u.Quantity]]] = None,
+    ) -> 'Rays':
+        """
+        Generalization of :meth:`from_field_angles` to field positions that do not lie on a rectangular grid, such as
+        the samples of a :class:`kgpy.optics.system.sampling.Sampler`.
+
+        :param wavelength_grid: Wavelength of each sample along the wavelength axis.
+        :param position: Starting position of each ray.
+        :param field_x: Field angle of each sample in the :math:`x` direction, an array whose last two axes are the
+            field :math:`x` and field :math:`y` axes of the grid.
+        :param field_y: Field angle of each sample in the :math:`y` direction, with the same layout as `field_x`.
+        :param field_mask_func: Function of the field angles which is :code:`True` for the rays that should be traced.
+        :param input_grids: One-dimensional grid of each axis, used to label plots, or :code:`None` for the axes that
+            are not sampled on a rectangular grid.
+        """
+        if input_grids is None:
+            input_grids = [wavelength_grid, None, None, None, None]
 
         wavelength = np.expand_dims(wavelength_grid, cls.vaxis.perp_axes(cls.vaxis.wavelength))
-        field_x = np.expand_dims(field_grid_x, cls.vaxis.perp_axes(cls.vaxis.field_x))
-        field_y = np.expand_dims(field_grid_y, cls.vaxis.perp_axes(cls.vaxis.field_y))
+        field_x = np.expand_dims(field_x, (~5, ~2, ~1, ~0))
+        field_y = np.expand_dims(field_y, (~5, ~2, ~1, ~0))
 
         wavelength, field_x, field_y = np.broadcast_arrays(wavelength, field_x, field_y, subok=True)
 
@@ -113,7 +217,7 @@ class Rays:
         direction = np.zeros(position.shape)
         direction[z] = 1
         direction = kgpy.vector.rotate_x(direction, field_y[..., 0])
-        direction = kgpy.vector.rotate_y(direction, field_x[..., 0])
+        direction = kgpy.vector.rotate_y(direction, field_x[..., 0]) << u.dimensionless_unscaled
 
         mask = field_mask_func(np.arcsin(direction[x]) << u.rad, np.arcsin(direction[y]) << u.rad)
 
@@ -122,23 +226,27 @@ class Rays:
             position=position,
             direction=direction,
             field_mask=mask,
-            input_grids=[wavelength_grid, field_grid_x, field_grid_y, pupil_grid_x, pupil_grid_y],
+            input_grids=input_grids,
         )
 
     def tilt_decenter(self, transform: coordinate.TiltDecenter) -> 'Rays':
-        return type(self)(
-            wavelength=self.wavelength.copy(),
-            position=transform(self.position, num_extra_dims=5),
-            direction=transform(self.direction, decenter=False, num_extra_dims=5),
-            polarization=self.polarization.copy(),
-            surface_normal=transform(self.surface_normal, decenter=False, num_extra_dims=5),
-            propagation_signum=self.propagation_signum,
-            index_of_refraction=self.index_of_refraction.copy(),
-            field_mask=self.field_mask.copy(),
-            vignetted_mask=self.vignetted_mask.copy(),
-            error_mask=self.error_mask.copy(),
-            input_grids=self.input_grids.copy(),
-        )
+        """
+        Transform the rays into a new coordinate system.
+        Only the position, direction and surface normal are recomputed, the other fields share their storage with
+        this object, so the result is intended to replace this object rather than to be used alongside it.
+        """
+        other = copy.copy(self)
+        other.position = transform(self.position, num_extra_dims=5)
+        other.direction = transform(self.direction, decenter=False, num_extra_dims=5)
+        if self.is_allocated('surface_normal'):
+            other.surface_normal = transform(self.surface_normal, decenter=False, num_extra_dims=5)
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                value = np.swapaxes(getattr(self, name), ~1, ~0)
+                value = transform(value, decenter=False, num_extra_dims=6)
+                setattr(other, name, np.swapaxes(value, ~1, ~0))
+        other.input_grids = self.input_grids.copy()
+        return other
 
     @property
     def grid_shape(self) -> typ.Tuple[int, ...]:
@@ -169,30 +277,268 @@ class Rays:
         return self.vignetted_mask & self.error_mask & self.field_mask
 
     def copy(self) -> 'Rays':
-        return Rays(
-            wavelength=self.wavelength.copy(),
-            position=self.position.copy(),
-            direction=self.direction.copy(),
-            surface_normal=self.surface_normal.copy(),
-            polarization=self.polarization.copy(),
-            propagation_signum=self.propagation_signum,
-            index_of_refraction=self.index_of_refraction.copy(),
-            input_grids=self.input_grids.copy(),
-            field_mask=self.field_mask.copy(),
-            vignetted_mask=self.vignetted_mask.copy(),
-            error_mask=self.error_mask.copy(),
-        )
+        """
+        Snapshot of the rays that is independent of any later in-place updates to this object.
+        Fields that have not been allocated are not allocated in the copy either.
+        """
+        other = copy.copy(self)
+        for name in self._vector_fields + self._mask_fields + self._scalar_fields + self._jacobian_fields:
+            if self.is_allocated(name):
+                setattr(other, name, getattr(self, name).copy())
+        other.input_grids = self.input_grids.copy()
+        return other
+
+    def grid_slice(self, index: typ.Tuple[slice, ...]) -> 'Rays':
+        """
+        Select a block of the ray grid.
+        Every array is broadcast against the full grid before it is sliced, so the result is a set of views into this
+        object.
+
+        :param index: A slice along each of the wavelength, field x, field y, pupil x and pupil y axes.
+        :return: The rays within the block.
+        """
+        grid_shape = self.grid_shape
+        kwargs = dict(propagation_signum=self.propagation_signum)
+        for name in self._vector_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                value = np.broadcast_to(value, grid_shape + value.shape[~0:], subok=True)
+                kwargs[name] = value[(..., ) + index + (slice(None), )]
+        for name in self._mask_fields + self._scalar_fields:
+            if self.is_allocated(name):
+                kwargs[name] = np.broadcast_to(getattr(self, name), grid_shape)[(..., ) + index]
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                value = np.broadcast_to(value, grid_shape + value.shape[~1:], subok=True)
+                kwargs[name] = value[(..., ) + index + (slice(None), slice(None))]
+        kwargs['input_grids'] = [g if g is None else g[..., i] for g, i in zip(self.input_grids, index)]
+        return type(self)(**kwargs)
+
+    def config_slice(self, index: typ.Tuple[typ.Union[int, slice], ...]) -> 'Rays':
+        """
+        Select a subset of the configurations.
+        Every array is broadcast against the full grid before it is indexed, so the result is a set of views into this
+        object.
+
+        :param index: An integer or a slice along each configuration axis of :attr:`grid_shape`.
+        :return: The rays of the selected configurations.
+        """
+        grid_shape = self.grid_shape
+        kwargs = dict(propagation_signum=self.propagation_signum, input_grids=self.input_grids.copy())
+        for name in self._vector_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                kwargs[name] = np.broadcast_to(value, grid_shape + value.shape[~0:], subok=True)[index]
+        for name in self._mask_fields + self._scalar_fields:
+            if self.is_allocated(name):
+                kwargs[name] = np.broadcast_to(getattr(self, name), grid_shape)[index]
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                kwargs[name] = np.broadcast_to(value, grid_shape + value.shape[~1:], subok=True)[index]
+        return type(self)(**kwargs)
+
+    def grid_empty(self, grid_shape: typ.Tuple[int, ...]) -> 'Rays':
+        """
+        Allocate uninitialized rays with the same type and units as this object, but with a different grid shape.
+        Used with :meth:`grid_assign` to assemble a grid of rays from independently traced blocks.
+
+        :param grid_shape: Shape of the new ray grid, including any configuration axes.
+        :return: A new set of rays.
+        """
+        kwargs = dict(propagation_signum=self.propagation_signum, input_grids=self.input_grids.copy())
+        for name in self._vector_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                kwargs[name] = np.empty_like(value, shape=grid_shape + value.shape[~0:])
+        for name in self._mask_fields:
+            kwargs[name] = np.empty(grid_shape, dtype=np.bool)
+        for name in self._scalar_fields:
+            if self.is_allocated(name):
+                kwargs[name] = np.empty(grid_shape, dtype=getattr(self, name).dtype)
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                value = getattr(self, name)
+                kwargs[name] = np.empty_like(value, shape=grid_shape + value.shape[~1:])
+        return type(self)(**kwargs)
+
+    def grid_assign(self, index: typ.Tuple[slice, ...], rays: 'Rays') -> typ.NoReturn:
+        """
+        Copy a block of rays into this object.
+
+        :param index: A slice along each of the wavelength, field x, field y, pupil x and pupil y axes, optionally
+            preceded by an index of the configuration axes.
+        :param rays: Rays to copy into the block.
+        """
+        for name in self._vector_fields:
+            if rays.is_allocated(name):
+                getattr(self, name)[(..., ) + index + (slice(None), )] = getattr(rays, name)
+        for name in self._mask_fields:
+            getattr(self, name)[(..., ) + index] = getattr(rays, name)
+        for name in self._scalar_fields:
+            if self.is_allocated(name):
+                getattr(self, name)[(..., ) + index] = getattr(rays, name)
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                getattr(self, name)[(..., ) + index + (slice(None), slice(None))] = getattr(rays, name)
+
+    def grid_compact(self) -> typ.Tuple['Rays', np.ndarray]:
+        """
+        Gather the unmasked rays into a dense grid, so that the surfaces after this point only trace the rays that are
+        still alive.
+        The wavelength, field and pupil axes are collapsed into the last axis of the result, whose length is the
+        largest number of unmasked rays in any configuration.
+        Configurations with fewer unmasked rays are padded with masked ones.
+
+        :return: The compacted rays, and the index of each compacted ray within the flattened wavelength, field and
+            pupil axes of this object, or -1 for padding, to be passed to :meth:`grid_uncompact`.
+        """
+        grid_shape = self.grid_shape
+        shape = grid_shape[:~(self.axis.ndim - 1)]
+        mask = np.broadcast_to(self.mask, grid_shape).reshape(shape + (-1, ))
+        num = max(int(np.max(np.count_nonzero(mask, axis=~0), initial=0)), 1)
+        order = np.argsort(~mask, axis=~0, kind='stable')[..., :num]
+        index = np.where(np.take_along_axis(mask, order, axis=~0), order, -1)
+
+        compact_shape = shape + (1, ) * (self.axis.ndim - 1) + (num, )
+        grid_index = tuple(np.indices(order.shape, sparse=True)[:len(shape)])
+        grid_index += np.unravel_index(order, grid_shape[len(shape):])
+
+        def gather(value: np.ndarray, num_trailing: int) -> np.ndarray:
+            trailing = value.shape[value.ndim - num_trailing:]
+            value = np.broadcast_to(value, grid_shape + trailing, subok=True)
+            return value[grid_index].reshape(compact_shape + trailing)
+
+        kwargs = dict(propagation_signum=self.propagation_signum, input_grids=self.input_grids.copy())
+        for name in self._vector_fields:
+            if self.is_allocated(name):
+                kwargs[name] = gather(getattr(self, name), 1)
+        for name in self._mask_fields + self._scalar_fields:
+            if self.is_allocated(name):
+                kwargs[name] = gather(getattr(self, name), 0)
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                kwargs[name] = gather(getattr(self, name), 2)
+        return type(self)(**kwargs), index
+
+    def grid_uncompact(self, index: np.ndarray, rays: 'Rays') -> 'Rays':
+        """
+        Inverse of :meth:`grid_compact`, scatter these compacted rays back into the full grid.
+        The rays that were masked when the grid was compacted keep their wavelength, weight and the masks they had in
+        `rays`, and the rest of their fields are set to NaN.
+
+        :param index: Index returned by :meth:`grid_compact`.
+        :param rays: The rays that were compacted.
+        :return: A new set of rays with the grid shape of `rays`, broadcast against any configuration axes that were
+            added to these rays after they were compacted.
+        """
+        shape = np.broadcast(np.empty(self.shape), np.empty(rays.shape)).shape
+        grid_shape = shape + rays.grid_shape[len(rays.shape):]
+        num = index.shape[~0]
+        index = np.broadcast_to(index, shape + (num, ))
+        is_valid = index >= 0
+        grid_index = tuple(np.indices(index.shape, sparse=True)[:len(shape)])
+        grid_index += np.unravel_index(np.where(is_valid, index, 0), grid_shape[len(shape):])
+        grid_index = tuple(np.broadcast_to(i, index.shape)[is_valid] for i in grid_index)
+        destination = np.ravel_multi_index(grid_index, grid_shape)
+        source = np.flatnonzero(is_valid)
+
+        def scatter(value: np.ndarray, background: np.ndarray, num_trailing: int) -> np.ndarray:
+            trailing = value.shape[value.ndim - num_trailing:]
+            value = np.broadcast_to(value, shape + (1, ) * (self.axis.ndim - 1) + (num, ) + trailing, subok=True)
+            if background is None:
+                result = np.empty_like(value, shape=grid_shape + trailing)
+                result[...] = np.nan
+            else:
+                result = np.broadcast_to(background, grid_shape + trailing, subok=True).copy()
+            result.reshape((-1, ) + trailing)[destination] = value.reshape((-1, ) + trailing)[source]
+            return result
+
+        kwargs = dict(propagation_signum=self.propagation_signum, input_grids=rays.input_grids.copy())
+        for name in self._vector_fields:
+            if self.is_allocated(name):
+                background = rays.wavelength if name == 'wavelength' else None
+                kwargs[name] = scatter(getattr(self, name), background, 1)
+        for name in self._mask_fields + self._scalar_fields:
+            kwargs[name] = scatter(getattr(self, name), getattr(rays, name), 0)
+        for name in self._jacobian_fields:
+            if self.is_allocated(name):
+                kwargs[name] = scatter(getattr(self, name), None, 2)
+        return type(self)(**kwargs)
+
+    def to_arrays(self) -> typ.Dict[str, np.ndarray]:
+        """
+        Plain arrays representing every allocated field, suitable for :func:`numpy.savez`.
+        The unit of each quantity is stored as a string array under the name of the field followed by ``.unit``.
+        """
+        arrays = dict(propagation_signum=np.array(self.propagation_signum))
+
+        def add(name: str, value: typ.Union[np.ndarray, u.Quantity]):
+            if isinstance(value, u.Quantity):
+                arrays[name + '.unit'] = np.array(value.unit.to_string())
+                value = value.value
+            arrays[name] = np.asarray(value)
+
+        for name in self._vector_fields + self._mask_fields + self._scalar_fields + self._jacobian_fields:
+            if self.is_allocated(name):
+                add(name, getattr(self, name))
+        for i, grid in enumerate(self.input_grids):
+            if grid is not None:
+                add('input_grids.' + str(i), grid)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: typ.Dict[str, np.ndarray]) -> 'Rays':
+        """
+        Inverse of :meth:`to_arrays`.
+        """
+        def get(name: str) -> typ.Union[np.ndarray, u.Quantity]:
+            value = arrays[name]
+            if name + '.unit' in arrays:
+                value = value << u.Unit(str(arrays[name + '.unit']))
+            return value
+
+        kwargs = dict(propagation_signum=arrays['propagation_signum'].item())
+        for name in cls._vector_fields + cls._mask_fields + cls._scalar_fields + cls._jacobian_fields:
+            if name in arrays:
+                kwargs[name] = get(name)
+        kwargs['input_grids'] = [None] * cls.axis.ndim
+        for i in range(cls.axis.ndim):
+            name = 'input_grids.' + str(i)
+            if name in arrays:
+                kwargs['input_grids'][i] = get(name)
+        return cls(**kwargs)
 
     def pupil_hist2d(
             self,
             bins: typ.Union[int, typ.Tuple[int, int]] = 10,
-            limits: typ.Optional[typ.Tuple[typ.Tuple[int, int], typ.Tuple[int, int]]] = None,
+            limits: typ.Optional[typ.Union[typ.Tuple[typ.Tuple[int, int], typ.Tuple[int, int]], np.ndarray]] = None,
             use_vignetted: bool = False,
             relative_to_centroid: typ.Tuple[bool, bool] = (False, False),
+            per_cell_limits: bool = False,
     ) -> typ.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Weighted 2D histogram of the positions of the rays over the pupil axes, for every configuration, wavelength
+        and field angle.
+        Every histogram is computed in a single pass, by converting the position of each ray into the flat index of
+        its bin and accumulating the weights with :func:`numpy.bincount`.
+        Rays are binned like :func:`numpy.histogram2d`, the last bin along each axis includes its upper edge.
+
+        :param bins: Number of bins along the :math:`x` and :math:`y` axes.
+        :param limits: Lower and upper limits of the :math:`x` and :math:`y` axes in units of :attr:`position`,
+            either shared by every histogram, or an array of shape `(..., 2, 2)` with the limits of each histogram.
+            If :code:`None`, the limits are the extent of the unmasked rays.
+        :param use_vignetted: Include the vignetted rays.
+        :param relative_to_centroid: Measure the position of the rays along each axis from their centroid.
+        :param per_cell_limits: If `limits` is :code:`None`, use the extent of the unmasked rays of each histogram
+            instead of the extent of every unmasked ray.
+        :return: The histograms and the edges of their bins along the :math:`x` and :math:`y` axes.
+        """
 
         if isinstance(bins, int):
             bins = (bins, bins)
+        num_x, num_y = bins
 
         if not use_vignetted:
             mask = self.mask
@@ -205,31 +551,57 @@ class Rays:
         if relative_to_centroid[kgpy.vector.iy]:
             position[y] -= np.mean(position[y].value, axis=self.axis.pupil_y, keepdims=True) << position.unit
 
-        if limits is None:
-            px = position[x][mask]
-            py = position[y][mask]
-            limits = (
-                (px.min().value, px.max().value),
-                (py.min().value, py.max().value),
-            )
+        px = np.broadcast_to(position[x].value, self.grid_shape)
+        py = np.broadcast_to(position[y].value, self.grid_shape)
+        mask = np.broadcast_to(mask, self.grid_shape)
+        weights = mask * self.weight
+
+        base_shape = self.grid_shape[:self.axis.pupil_x]
+        pupil_axes = self.axis.pupil_x, self.axis.pupil_y
 
-        base_shape = self.shape + self.grid_shape[self.axis.wavelength:self.axis.field_y + 1]
-        hist = np.empty(base_shape + tuple(bins))
-        edges_x = np.empty(base_shape + (bins[kgpy.vector.ix] + 1,))
-        edges_y = np.empty(base_shape + (bins[kgpy.vector.iy] + 1,))
-
-        for c, p_c in enumerate(position):
-            for w, p_cw in enumerate(p_c):
-                for i, p_cwi in enumerate(p_cw):
-                    for j, p_cwij in enumerate(p_cwi):
-                        cwij = c, w, i, j
-                        hist[cwij], edges_x[cwij], edges_y[cwij] = np.histogram2d(
-                            x=p_cwij[x].flatten().value,
-                            y=p_cwij[y].flatten().value,
-                            bins=bins,
-                            weights=mask[cwij].flatten(),
-                            range=limits,
-                        )
+        if limits is None:
+            def extent(a: np.ndarray) -> np.ndarray:
+                axis = pupil_axes if per_cell_limits else None
+                return np.stack([
+                    np.min(a, axis=axis, where=mask, initial=np.inf),
+                    np.max(a, axis=axis, where=mask, initial=-np.inf),
+                ], axis=~0)
+            limits = np.stack([extent(px), extent(py)], axis=~1)
+
+        limits = np.broadcast_to(np.asarray(limits, dtype=float), base_shape + (2, 2)).copy()
+        is_degenerate = limits[..., 0] == limits[..., 1]
+        limits[..., 0] = np.where(is_degenerate, limits[..., 0] - 0.5, limits[..., 0])
+        limits[..., 1] = np.where(is_degenerate, limits[..., 1] + 0.5, limits[..., 1])
+
+        edges_x = np.linspace(limits[..., ix, 0], limits[..., ix, 1], num_x + 1, axis=~0)
+        edges_y = np.linspace(limits[..., iy, 0], limits[..., iy, 1], num_y + 1, axis=~0)
+
+        def bin_index(p: np.ndarray, edges: np.ndarray, num: int) -> typ.Tuple[np.ndarray, np.ndarray]:
+            start, stop = edges[..., 0, np.newaxis, np.newaxis], edges[..., ~0, np.newaxis, np.newaxis]
+            with np.errstate(invalid='ignore'):
+                t = (p - start) / (stop - start) * num
+                is_inside = (t >= 0) & (t <= num)
+            index = np.minimum(np.floor(np.where(is_inside, t, 0)).astype(int), num - 1)
+            # Correct for round-off, so the rays on the edge of a bin are binned the same way as numpy.histogram2d.
+            index_flat = index.reshape(base_shape + (-1, ))
+            lower = np.take_along_axis(edges, index_flat, axis=~0).reshape(index.shape)
+            upper = np.take_along_axis(edges, index_flat + 1, axis=~0).reshape(index.shape)
+            index = index - (p < lower) + ((p >= upper) & (index < num - 1))
+            return index, is_inside
+
+        index_x, is_inside_x = bin_index(px, edges_x, num_x)
+        index_y, is_inside_y = bin_index(py, edges_y, num_y)
+        is_inside = is_inside_x & is_inside_y
+
+        num_cells = int(np.prod(base_shape))
+        cell = np.arange(num_cells).reshape(base_shape)[..., np.newaxis, np.newaxis]
+        index = (cell * num_x + index_x) * num_y + index_y
+        hist = np.bincount(
+            index[is_inside],
+            weights=np.broadcast_to(weights, index.shape)[is_inside],
+            minlength=num_cells * num_x * num_y,
+        )
+        hist = hist.reshape(base_shape + (num_x, num_y))
 
         unit = self.position.unit
         return hist, edges_x << unit, edges_y << unit
@@ -329,7 +701,8 @@ class Rays:
                     norm=norm,
                 )
                 if i == 0:
-                    axs_ij.set_xlabel('{0.value:0.2f} {0.unit:latex}'.format(field_x[j]))
+                    if field_x is not None:
+                        axs_ij.set_xlabel('{0.value:0.2f} {0.unit:latex}'.format(field_x[j]))
                     axs_ij.xaxis.set_label_position('top')
                 elif i == len(axs) - 1:
                     axs_ij.set_xlabel(edges_x.unit)
@@ -337,7 +710,8 @@ class Rays:
                 if j == 0:
                     axs_ij.set_ylabel(edges_y.unit)
                 elif j == len(axs_i) - 1:
-                    axs_ij.set_ylabel('{0.value:0.2f} {0.unit:latex}'.format(field_y[i]))
+                    if field_y is not None:
+                        axs_ij.set_ylabel('{0.value:0.2f} {0.unit:latex}'.format(field_y[i]))
                     axs_ij.yaxis.set_label_position('right')
 
         wavl_str = np.unique(self.wavelength[config_index, wavlen_index]).squeeze()
@@ -45,7 +45,6 @@ class CoordinateBreak(surface.Surface):
             rays = rays.tilt_decenter(~self.transform)
 
         if not is_final_surface:
-            rays = rays.copy()
             rays.position[z] -= self.thickness
 
         return rays
@@ -4,7 +4,7 @@ import numpy as np
 import astropy.units as u
 import kgpy.vector
 from kgpy.vector import x, y, z
-from .. import Rays, material, aperture
+from .. import Rays, unitless, material, aperture
 from . import Standard
 
 __all__ = ['DiffractionGrating']
@@ -40,46 +40,85 @@ class DiffractionGrating(Standard[MaterialT, ApertureT]):
             self.groove_density,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['diffraction_order', 'groove_density']
+
     def groove_normal(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
-        return u.Quantity([0 << 1 / u.mm, self.groove_density, 0 << 1 / u.mm])
+        return kgpy.vector.from_components(ay=self.groove_density)
+
+    def groove_phase(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
+        """
+        Number of grooves between the vertex and each point on the surface, the potential whose gradient is
+        :meth:`groove_normal`.
+        Used to add the phase imparted by the grating to :attr:`kgpy.optics.Rays.optical_path_length`.
+        """
+        return self.groove_density * sy
+
+    def groove_normal_jacobian(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
+        """
+        Derivative of :meth:`groove_normal` with respect to the :math:`x` and :math:`y` coordinates, with the same
+        layout as :meth:`normal_jacobian`.
+        """
+        unit_length = unitless.like(1 * u.mm, sx)
+        return np.zeros((3, 2)) * (self.groove_density / unit_length)[..., np.newaxis, np.newaxis]
 
     def propagate_rays(self, rays: Rays, is_first_surface: bool = False, is_final_surface: bool = False, ) -> Rays:
 
         if not is_first_surface:
             if self.transform_before is not None:
                 rays = rays.tilt_decenter(~self.transform_before)
+            position_incident = rays.position
             rays.position = self.calc_intercept(rays)
+            rays.error_mask = rays.error_mask & np.isfinite(rays.position).all(~0)
 
             n1 = rays.index_of_refraction
+            if rays.is_allocated('optical_path_length'):
+                path = kgpy.vector.dot(rays.position - position_incident, rays.direction)
+                phase = self.groove_phase(rays.position[x], rays.position[y])[..., np.newaxis]
+                path = n1 * path + self.diffraction_order * rays.wavelength * phase
+                rays.optical_path_length = rays.optical_path_length + path
+
             if self.material is not None:
                 n2 = self.material.index_of_refraction(rays.wavelength, rays.polarization)
                 p = rays.propagation_signum * self.material.propagation_signum
             else:
                 n2 = 1 << u.dimensionless_unscaled
                 p = rays.propagation_signum
+            n2 = unitless.like(n2, rays.wavelength)
 
             a = n1 * rays.direction / n2
             a += self.diffraction_order * rays.wavelength * self.groove_normal(rays.position[x], rays.position[y])
             r = kgpy.vector.length(a)
-            a = kgpy.vector.normalize(a)
+            a = kgpy.vector.normalize(a, out=a)
 
             n = self.normal(rays.position[x], rays.position[y])
-            c = -kgpy.vector.dot(a, n)
-
-            # p = -self.material.propagation_signum
-
-            b = r * a + (r * c - p * np.sqrt(1 - np.square(r) * (1 - np.square(c)))) * n
-
-            rays.direction = kgpy.vector.normalize(b)
+            if rays.is_differential:
+                rays.position_jacobian = self.intercept_jacobian(rays, position_incident, n)
+                groove_jacobian = np.matmul(
+                    self.groove_normal_jacobian(rays.position[x], rays.position[y]),
+                    rays.position_jacobian[..., :kgpy.vector.iz, :],
+                )
+                order = self.diffraction_order * rays.wavelength
+                incident_jacobian = (n1 / n2)[..., np.newaxis] * rays.direction_jacobian
+                incident_jacobian = incident_jacobian + order[..., np.newaxis] * groove_jacobian
+                rays.direction_jacobian = self.refract_jacobian(
+                    direction=a,
+                    normal=n,
+                    index_ratio=r,
+                    propagation_signum=p,
+                    incident_jacobian=incident_jacobian,
+                    normal_jacobian=self._normal_jacobian_launch(rays),
+                )
+            rays.direction = self.refract(a, n, r, p)
             rays.surface_normal = n
             if self.aperture is not None:
                 if self.aperture.is_active:
-                    rays.vignetted_mask &= self.aperture.is_unvignetted(rays.position)
+                    rays.vignetted_mask = rays.vignetted_mask & self.aperture.is_unvignetted(rays.position)
             rays.index_of_refraction[...] = n2
             rays.propagation_signum = p
 
         if not is_final_surface:
-            rays = rays.copy()
             rays.position[z] -= self.thickness
             if self.transform_after is not None:
                 rays = rays.tilt_decenter(~self.transform_after)
@@ -45,3 +45,7 @@ class EllipticalGrating1(DiffractionGrating):
             self.alpha,
             self.beta,
         )
+
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['a', 'b', 'c', 'alpha', 'beta']
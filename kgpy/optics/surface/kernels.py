@@ -0,0 +1,180 @@
+"""
+Fused per-ray kernels for the sag, normal and refraction of the built-in surfaces.
+
+If `numba <https://numba.pydata.org/>`_ is installed, each kernel is compiled to a ufunc that computes its result in a
+single pass over the rays, otherwise the surfaces fall back to their NumPy implementations.
+The kernels only accept plain float64 arrays, so they are used by the unit-free raytrace (see
+:attr:`kgpy.optics.System.unitless_raytrace`), while :class:`astropy.units.Quantity` inputs always use NumPy.
+"""
+
+import os
+import numpy as np
+import astropy.units as u
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+__all__ = ['enabled', 'cache', 'is_enabled']
+
+enabled = numba is not None     # Set to False to force the NumPy implementations, for benchmarking or debugging.
+
+# Caching the compiled kernels writes files next to this module, so it is only done if the installation is known to be
+# writable, see also the `NUMBA_CACHE_DIR` environment variable of numba.
+cache = 'KGPY_NUMBA_CACHE' in os.environ
+
+
+def is_enabled(*arrays: np.ndarray) -> bool:
+    """
+    Check whether the compiled kernels can be used on the given arrays.
+
+    :param arrays: Every array that would be passed to a kernel.
+    :return: :code:`True` if numba is available, :data:`enabled` is set, and none of `arrays` have units.
+    """
+    return enabled and numba is not None and not any(isinstance(a, u.Quantity) for a in arrays)
+
+
+if numba is not None:
+
+    _jit_options = dict(nopython=True, cache=cache)
+
+    # Only used to give the gufuncs below, which return vectors, the length of their output axis.
+    _components = np.empty(3)
+
+    @numba.vectorize(['float64(float64, float64, float64, float64, float64)'], **_jit_options)
+    def standard_sag(x, y, curvature, conic, radius):
+        r2 = x * x + y * y
+        if r2 >= radius * radius:
+            return 0.
+        return curvature * r2 / (1 + np.sqrt(1 - (1 + conic) * curvature * curvature * r2))
+
+    @numba.guvectorize(
+        ['void(float64, float64, float64, float64, float64, float64[:], float64[:])'],
+        '(),(),(),(),(),(n)->(n)',
+        **_jit_options,
+    )
+    def _standard_normal(x, y, curvature, conic, radius, components, out):
+        r2 = x * x + y * y
+        if r2 >= radius * radius:
+            dzdx = 0.
+            dzdy = 0.
+        else:
+            g = np.sqrt(1 - (1 + conic) * curvature * curvature * r2)
+            dzdx = curvature * x / g
+            dzdy = curvature * y / g
+        norm = np.sqrt(dzdx * dzdx + dzdy * dzdy + 1)
+        out[0] = dzdx / norm
+        out[1] = dzdy / norm
+        out[2] = -1 / norm
+
+    def standard_normal(x, y, curvature, conic, radius):
+        return _standard_normal(x, y, curvature, conic, radius, _components)
+
+    @numba.vectorize(['float64(float64, float64, float64, float64, float64)'], **_jit_options)
+    def toroidal_sag(x, y, curvature, conic, radius_of_rotation):
+        if abs(x) > radius_of_rotation:
+            return 0.
+        y2 = y * y
+        zy = curvature * y2 / (1 + np.sqrt(1 - (1 + conic) * curvature * curvature * y2))
+        return radius_of_rotation - np.sqrt(np.square(radius_of_rotation - zy) - x * x)
+
+    @numba.guvectorize(
+        ['void(float64, float64, float64, float64, float64, float64[:], float64[:])'],
+        '(),(),(),(),(),(n)->(n)',
+        **_jit_options,
+    )
+    def _toroidal_normal(x, y, curvature, conic, radius_of_rotation, components, out):
+        if abs(x) > radius_of_rotation:
+            dzdx = 0.
+            dzdy = 0.
+        else:
+            y2 = y * y
+            g = np.sqrt(1 - (1 + conic) * curvature * curvature * y2)
+            zy = curvature * y2 / (1 + g)
+            f = np.sqrt(np.square(radius_of_rotation - zy) - x * x)
+            dzdx = x / f
+            dzdy = (radius_of_rotation - zy) * (curvature * y / g) / f
+        norm = np.sqrt(dzdx * dzdx + dzdy * dzdy + 1)
+        out[0] = dzdx / norm
+        out[1] = dzdy / norm
+        out[2] = -1 / norm
+
+    def toroidal_normal(x, y, curvature, conic, radius_of_rotation):
+        return _toroidal_normal(x, y, curvature, conic, radius_of_rotation, _components)
+
+    @numba.vectorize(['float64(float64, float64, float64, float64, float64)'], **_jit_options)
+    def vls_groove_density(x, groove_density, coeff_linear, coeff_quadratic, coeff_cubic):
+        x2 = x * x
+        return groove_density + coeff_linear * x + coeff_quadratic * x2 + coeff_cubic * x * x2
+
+    @numba.guvectorize(
+        ['void(float64[:], float64[:], float64, float64, float64[:])'],
+        '(n),(n),(),()->(n)',
+        **_jit_options,
+    )
+    def refract(direction, normal, index_ratio, propagation_signum, out):
+        """
+        Vector form of Snell's law, followed by normalization of the result.
+
+        :param direction: Unit vector of each incident ray.
+        :param normal: Unit normal vector of the surface at each ray.
+        :param index_ratio: Ratio of the incident and transmitted indices of refraction.
+        :param propagation_signum: :code:`-1` for reflection and :code:`1` for refraction.
+        """
+        c = -(direction[0] * normal[0] + direction[1] * normal[1] + direction[2] * normal[2])
+        r = index_ratio
+        f = r * c - propagation_signum * np.sqrt(1 - r * r * (1 - c * c))
+        b0 = r * direction[0] + f * normal[0]
+        b1 = r * direction[1] + f * normal[1]
+        b2 = r * direction[2] + f * normal[2]
+        norm = np.sqrt(b0 * b0 + b1 * b1 + b2 * b2)
+        out[0] = b0 / norm
+        out[1] = b1 / norm
+        out[2] = b2 / norm
+
+    @numba.guvectorize(
+        ['void(float64[:], float64[:], float64, float64, float64[:, :], float64[:, :], float64[:, :])'],
+        '(n),(n),(),(),(n,m),(n,m)->(n,m)',
+        **_jit_options,
+    )
+    def refract_jacobian(direction, normal, index_ratio, propagation_signum, incident_jacobian, normal_jacobian, out):
+        """
+        Derivative of :func:`refract` with respect to the launch position of each ray, see
+        :meth:`kgpy.optics.surface.Standard.refract_jacobian`.
+        """
+        a = direction
+        n = normal
+        r = index_ratio
+        p = propagation_signum
+        c = -(a[0] * n[0] + a[1] * n[1] + a[2] * n[2])
+        s = np.sqrt(1 - r * r * (1 - c * c))
+        f = r * c - p * s
+        b0 = r * a[0] + f * n[0]
+        b1 = r * a[1] + f * n[1]
+        b2 = r * a[2] + f * n[2]
+        norm = np.sqrt(b0 * b0 + b1 * b1 + b2 * b2)
+        b0 /= norm
+        b1 /= norm
+        b2 /= norm
+        for j in range(out.shape[1]):
+            da0 = incident_jacobian[0, j]
+            da1 = incident_jacobian[1, j]
+            da2 = incident_jacobian[2, j]
+            dr = a[0] * da0 + a[1] * da1 + a[2] * da2
+            da0 = (da0 - a[0] * dr) / r
+            da1 = (da1 - a[1] * dr) / r
+            da2 = (da2 - a[2] * dr) / r
+            dn0 = normal_jacobian[0, j]
+            dn1 = normal_jacobian[1, j]
+            dn2 = normal_jacobian[2, j]
+            dc = -(n[0] * da0 + n[1] * da1 + n[2] * da2) - (a[0] * dn0 + a[1] * dn1 + a[2] * dn2)
+            ds = (r * r * c * dc - r * dr * (1 - c * c)) / s
+            df = dr * c + r * dc - p * ds
+            db0 = dr * a[0] + r * da0 + df * n[0] + f * dn0
+            db1 = dr * a[1] + r * da1 + df * n[1] + f * dn1
+            db2 = dr * a[2] + r * da2 + df * n[2] + f * dn2
+            bdb = b0 * db0 + b1 * db1 + b2 * db2
+            out[0, j] = (db0 - b0 * bdb) / norm
+            out[1, j] = (db1 - b1 * bdb) / norm
+            out[2, j] = (db2 - b2 * bdb) / norm
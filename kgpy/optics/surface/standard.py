@@ -7,8 +7,8 @@ import kgpy.optics.material.no_material
 import kgpy.vector
 from kgpy.vector import x, y, z
 import kgpy.optics
-from .. import Rays, coordinate, material as material_, aperture as aperture_
-from . import Surface
+from .. import Rays, coordinate, unitless, material as material_, aperture as aperture_
+from . import Surface, kernels
 
 __all__ = ['Standard']
 
@@ -64,6 +64,10 @@ class Standard(
             out = np.broadcast(out, self.aperture.config_broadcast)
         return out
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['radius', 'conic']
+
     @property
     def is_plane(self):
         return np.isinf(self.radius)
@@ -93,6 +97,8 @@ class Standard(
         return np.where(np.isinf(self.radius), 0, 1 / self.radius)
 
     def sag(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        if kernels.is_enabled(ax, ay, self.radius):
+            return kernels.standard_sag(ax, ay, self.curvature, self.conic, self.radius)
         r2 = np.square(ax) + np.square(ay)
         c = self.curvature
         sz = c * r2 / (1 + np.sqrt(1 - (1 + self.conic) * np.square(c) * r2))
@@ -101,6 +107,8 @@ class Standard(
         return sz
 
     def normal(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        if kernels.is_enabled(ax, ay, self.radius):
+            return kernels.standard_normal(ax, ay, self.curvature, self.conic, self.radius)
         x2 = np.square(ax)
         y2 = np.square(ay)
         c = self.curvature
@@ -111,35 +119,187 @@ class Standard(
         mask = (x2 + y2) >= np.square(self.radius)
         dzdx[mask] = 0
         dzdy[mask] = 0
-        n = kgpy.vector.normalize(kgpy.vector.from_components(dzdx, dzdy, -1 * u.dimensionless_unscaled))
+        dzdz = unitless.like(-1 * u.dimensionless_unscaled, dzdx)
+        n = kgpy.vector.normalize(kgpy.vector.from_components(dzdx, dzdy, dzdz))
         return n
 
-    def propagate_rays(self, rays: Rays, is_first_surface: bool = False, is_final_surface: bool = False, ) -> Rays:
+    def normal_jacobian(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        x2 = np.square(ax)
+        y2 = np.square(ay)
+        c = self.curvature
+        k1c3 = (1 + self.conic) * c * np.square(c)
+        g = np.sqrt(1 - (1 + self.conic) * np.square(c) * (x2 + y2))
+        g3 = g * np.square(g)
+        dzdx = c * ax / g
+        dzdy = c * ay / g
+        dzdxdx = c / g + k1c3 * x2 / g3
+        dzdxdy = k1c3 * ax * ay / g3
+        dzdydy = c / g + k1c3 * y2 / g3
+        mask = (x2 + y2) >= np.square(self.radius)
+        for a in [dzdx, dzdy, dzdxdx, dzdxdy, dzdydy]:
+            a[mask] = 0
+        dzdz = unitless.like(-1 * u.dimensionless_unscaled, dzdx)
+        gradient = kgpy.vector.from_components(dzdx, dzdy, dzdz)
+        gradient_jacobian = np.stack([
+            kgpy.vector.from_components(dzdxdx, dzdxdy),
+            kgpy.vector.from_components(dzdxdy, dzdydy),
+        ], axis=~0)
+        norm = kgpy.vector.length(gradient)
+        n = gradient / norm
+        dn = gradient_jacobian - n[..., np.newaxis] * _dot_jacobian(n, gradient_jacobian)
+        return dn / norm[..., np.newaxis]
+
+    def calc_intercept(self, rays: Rays, **kwargs) -> u.Quantity:
+        """
+        Closed-form intersection of each ray with this conic surface.
+        The parametric equation of the ray is substituted into the implicit equation of the surface,
+        :math:`c (x^2 + y^2 + (1 + k) z^2) - 2 z = 0`, and the root of the resulting quadratic on the branch through
+        the vertex is selected.
+        Rays that miss the conic, or hit it outside of the region where :meth:`sag` is clamped to zero, are intercepted
+        with the plane :math:`z = 0` instead.
+
+        :param rays: Rays expressed in the local coordinates of this surface.
+        :param kwargs: Unused, accepted for compatibility with the iterative :meth:`Surface.calc_intercept`.
+        :return: Position of each ray on this surface.
+        """
+        p, d = rays.position, rays.direction
+        c = self.curvature
+        k1 = 1 + self.conic
+
+        qa = c * (np.square(d[x]) + np.square(d[y]) + k1 * np.square(d[z]))
+        qb = c * (p[x] * d[x] + p[y] * d[y] + k1 * p[z] * d[z]) - d[z]
+        qc = c * (np.square(p[x]) + np.square(p[y]) + k1 * np.square(p[z])) - 2 * p[z]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            discriminant = np.square(qb) - qa * qc
+            qb_signum = np.where(qb < 0, -1, 1)
+            q = -(qb + qb_signum * np.sqrt(discriminant))
+            t = qc / q
+            # The root closest to the current position can be on the far branch of the conic, where
+            # (1 + k) c z > 1, in which case the other root is the one on the branch through the vertex.
+            is_far_branch = k1 * c * (p[z] + d[z] * t) > 1
+            t = np.where(is_far_branch, q / qa, t)
+            t_plane = -p[z] / d[z]
+            r2 = np.square(p[x] + d[x] * t) + np.square(p[y] + d[y] * t)
+            is_plane = ~(discriminant >= 0) | (r2 >= np.square(self.radius))
+        t = np.where(is_plane, t_plane, t)
 
-        rays = rays.copy()
+        return p + d * t[..., np.newaxis]
+
+    @staticmethod
+    def refract(direction: u.Quantity, normal: u.Quantity, index_ratio: u.Quantity, propagation_signum: float):
+        """
+        Vector form of Snell's law.
+
+        :param direction: Unit vector of each incident ray.
+        :param normal: Unit normal vector of the surface at each ray.
+        :param index_ratio: Ratio of the incident and transmitted indices of refraction, with a trailing axis of length
+            one.
+        :param propagation_signum: :code:`-1` for reflection and :code:`1` for refraction.
+        :return: Unit vector of each transmitted ray.
+        """
+        if kernels.is_enabled(direction, normal, index_ratio):
+            return kernels.refract(direction, normal, index_ratio[..., 0], propagation_signum)
+        r = index_ratio
+        c = -kgpy.vector.dot(direction, normal)
+        b = r * direction + (r * c - propagation_signum * np.sqrt(1 - np.square(r) * (1 - np.square(c)))) * normal
+        return kgpy.vector.normalize(b, out=b)
+
+    @staticmethod
+    def intercept_jacobian(rays: Rays, position_incident: u.Quantity, normal: u.Quantity) -> u.Quantity:
+        """
+        Derivative of the position of each ray on the surface with respect to its launch position, found by
+        differentiating the constraint that the intercept lies on the surface.
+
+        :param rays: Rays after :meth:`calc_intercept`, with the Jacobians of the incident rays.
+        :param position_incident: Position of each ray before :meth:`calc_intercept`.
+        :param normal: Normal vector of the surface at the intercept.
+        :return: The new value of :attr:`kgpy.optics.Rays.position_jacobian`.
+        """
+        d = rays.direction
+        t = kgpy.vector.dot(rays.position - position_incident, d)
+        jacobian = rays.position_jacobian + t[..., np.newaxis] * rays.direction_jacobian
+        dt = -_dot_jacobian(normal, jacobian) / kgpy.vector.dot(normal, d)[..., np.newaxis]
+        return jacobian + d[..., np.newaxis] * dt
+
+    @staticmethod
+    def refract_jacobian(
+            direction: u.Quantity,
+            normal: u.Quantity,
+            index_ratio: u.Quantity,
+            propagation_signum: float,
+            incident_jacobian: u.Quantity,
+            normal_jacobian: u.Quantity,
+    ) -> u.Quantity:
+        """
+        Derivative of :meth:`refract` with respect to the launch position of each ray.
+
+        :param direction: Unit vector of each incident ray.
+        :param normal: Unit normal vector of the surface at each ray.
+        :param index_ratio: Ratio of the incident and transmitted indices of refraction, with a trailing axis of length
+            one.
+        :param propagation_signum: :code:`-1` for reflection and :code:`1` for refraction.
+        :param incident_jacobian: Derivative of the product of `index_ratio` and `direction`.
+        :param normal_jacobian: Derivative of `normal`.
+        :return: Derivative of the unit vector of each transmitted ray.
+        """
+        if kernels.is_enabled(direction, normal, index_ratio, incident_jacobian, normal_jacobian):
+            return kernels.refract_jacobian(
+                direction, normal, index_ratio[..., 0], propagation_signum, incident_jacobian, normal_jacobian,
+            )
+        a, n, r = direction, normal, index_ratio[..., np.newaxis]
+        dr = _dot_jacobian(a, incident_jacobian)
+        da = (incident_jacobian - a[..., np.newaxis] * dr) / r
+        c = -kgpy.vector.dot(a, n)[..., np.newaxis]
+        dc = -_dot_jacobian(n, da) - _dot_jacobian(a, normal_jacobian)
+        s = np.sqrt(1 - np.square(r) * (1 - np.square(c)))
+        ds = (np.square(r) * c * dc - r * dr * (1 - np.square(c))) / s
+        f = r * c - propagation_signum * s
+        df = dr * c + r * dc - propagation_signum * ds
+        b = r * a[..., np.newaxis] + f * n[..., np.newaxis]
+        db = dr * a[..., np.newaxis] + r * da + df * n[..., np.newaxis] + f * normal_jacobian
+        b = b[..., 0]
+        norm = kgpy.vector.length(b)
+        b_hat = b / norm
+        return (db - b_hat[..., np.newaxis] * _dot_jacobian(b_hat, db)) / norm[..., np.newaxis]
+
+    def propagate_rays(self, rays: Rays, is_first_surface: bool = False, is_final_surface: bool = False, ) -> Rays:
 
         if not is_first_surface:
             if self.transform_before is not None:
                 rays = rays.tilt_decenter(~self.transform_before)
+            position_incident = rays.position
             rays.position = self.calc_intercept(rays)
+            rays.error_mask = rays.error_mask & np.isfinite(rays.position).all(~0)
 
             n1 = rays.index_of_refraction
+            if rays.is_allocated('optical_path_length'):
+                path = kgpy.vector.dot(rays.position - position_incident, rays.direction)
+                rays.optical_path_length = rays.optical_path_length + n1 * path
+
             if self.material is not None:
                 n2 = self.material.index_of_refraction(rays.wavelength, rays.polarization)
                 p = rays.propagation_signum * self.material.propagation_signum
             else:
                 n2 = 1 << u.dimensionless_unscaled
                 p = rays.propagation_signum
+            n2 = unitless.like(n2, rays.wavelength)
 
             a = rays.direction
             r = n1 / n2
 
             n = self.normal(rays.position[x], rays.position[y])
-            c = -kgpy.vector.dot(a, n)
-
-            b = r * a + (r * c - p * np.sqrt(1 - np.square(r) * (1 - np.square(c)))) * n
-
-            rays.direction = kgpy.vector.normalize(b)
+            if rays.is_differential:
+                rays.position_jacobian = self.intercept_jacobian(rays, position_incident, n)
+                rays.direction_jacobian = self.refract_jacobian(
+                    direction=a,
+                    normal=n,
+                    index_ratio=r,
+                    propagation_signum=p,
+                    incident_jacobian=r[..., np.newaxis] * rays.direction_jacobian,
+                    normal_jacobian=self._normal_jacobian_launch(rays),
+                )
+            rays.direction = self.refract(a, n, r, p)
             rays.surface_normal = n
             if self.aperture is not None:
                 if self.aperture.is_active:
@@ -154,6 +314,13 @@ class Standard(
 
         return rays
 
+    def _normal_jacobian_launch(self, rays: Rays) -> u.Quantity:
+        """
+        Derivative of the surface normal at each ray with respect to the launch position of the ray.
+        """
+        position = rays.position
+        return np.matmul(self.normal_jacobian(position[x], position[y]), rays.position_jacobian[..., :kgpy.vector.iz, :])
+
     def apply_pre_transforms(self, value: u.Quantity, num_extra_dims: int = 0) -> u.Quantity:
         if self.transform_before is not None:
             value = self.transform_before(value, num_extra_dims=num_extra_dims)
@@ -175,3 +342,10 @@ class Standard(
             self.aperture.plot_2d(ax, components, system, self)
         if self.material is not None:
             self.material.plot_2d(ax, components, system, self)
+
+
+def _dot_jacobian(a: u.Quantity, jacobian: u.Quantity) -> u.Quantity:
+    """
+    Dot product of a vector with each column of a Jacobian, keeping the component axis.
+    """
+    return np.einsum('...i,...ij->...j', a, jacobian)[..., np.newaxis, :]
@@ -1,4 +1,5 @@
 import abc
+import copy
 import dataclasses
 import typing as typ
 import warnings
@@ -8,7 +9,7 @@ import astropy.units as u
 import kgpy.mixin
 import kgpy.vector
 import kgpy.optics
-from .. import Rays, zemax_compatible
+from .. import Rays, zemax_compatible, unitless
 
 __all__ = ['Surface']
 
@@ -48,6 +49,9 @@ class Surface(
             self.is_active,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['thickness', 'is_active']
 
     def index(self, surfaces: typ.Iterable['Surface']) -> int:
         for s, surf in enumerate(surfaces):
@@ -71,6 +75,24 @@ class Surface(
     def normal(self, x: u.Quantity, y: u.Quantity) -> u.Quantity:
         pass
 
+    def normal_jacobian(self, x: u.Quantity, y: u.Quantity) -> u.Quantity:
+        """
+        Derivative of :meth:`normal` with respect to the :math:`x` and :math:`y` coordinates, used to propagate the
+        Jacobians of differential rays (see :meth:`kgpy.optics.Rays.init_jacobians`).
+        This default implementation uses central differences, subclasses override it with a closed form where one is
+        available.
+
+        :param x: :math:`x` coordinate of each point on the surface.
+        :param y: :math:`y` coordinate of each point on the surface.
+        :return: Array with a trailing axis of length 3 for the components of the normal vector, followed by an axis of
+            length 2 for the derivatives with respect to :math:`x` and :math:`y`.
+        """
+        h = unitless.like(1 * u.um, x)
+        dndx = (self.normal(x + h, y) - self.normal(x - h, y)) / (2 * h)
+        dndy = (self.normal(x, y + h) - self.normal(x, y - h)) / (2 * h)
+        dndx, dndy = np.broadcast_arrays(dndx, dndy, subok=True)
+        return np.stack([dndx, dndy], axis=~0)
+
     @abc.abstractmethod
     def propagate_rays(
             self,
@@ -78,6 +100,13 @@ class Surface(
             is_first_surface: bool = False,
             is_final_surface: bool = False,
     ) -> Rays:
+        """
+        Refract or reflect the rays at this surface and transfer them to the coordinate system of the next surface.
+        The arrays of `rays` are updated in place wherever possible, so callers that need to keep the incident rays
+        should pass a snapshot from :meth:`kgpy.optics.Rays.copy`.
+        The optical path from the previous surface is added to :attr:`kgpy.optics.Rays.optical_path_length` only if
+        that field has been allocated, so the cost is only paid by callers that need it.
+        """
         pass
 
     def calc_intercept(
@@ -87,50 +116,90 @@ class Surface(
             max_error: u.Quantity = .1 << u.nm,
             max_iterations: int = 100,
     ) -> u.Quantity:
-
-        intercept = rays.position.copy()
+        """
+        Find the intersection of each ray with this surface using the secant method.
+        Rays are removed from the working set as soon as they converge, so later iterations only operate on the rays
+        that still need them.
+        Rays that do not converge within `max_iterations`, or that become undefined, are not intercepted and their
+        position is set to NaN, so that the caller can record them in :attr:`Rays.error_mask`.
+
+        :param rays: Rays expressed in the local coordinates of this surface.
+        :param step_size: Distance along each ray of the two initial guesses.
+        :param max_error: A ray is converged once its distance from the surface along the z axis is less than this
+            value.
+        :param max_iterations: Maximum number of secant iterations.
+        :return: Position of each ray on this surface.
+        """
+
+        step_size = unitless.like(step_size, rays.position)
+        max_error = unitless.like(max_error, rays.position)
 
         t0 = -step_size
         t1 = step_size
 
-        t0 = np.broadcast_to(t0, rays.wavelength.shape, subok=True)
-        t1 = np.broadcast_to(t1, rays.wavelength.shape, subok=True)
+        a0 = rays.position + rays.direction * t0
+        a1 = rays.position + rays.direction * t1
+        f0 = a0[kgpy.vector.z] - self.sag(a0[kgpy.vector.x], a0[kgpy.vector.y])
+        f1 = a1[kgpy.vector.z] - self.sag(a1[kgpy.vector.x], a1[kgpy.vector.y])
+
+        shape = np.broadcast(rays.position[kgpy.vector.x], rays.direction[kgpy.vector.x], f0, f1).shape
+        vshape = shape + (3, )
+        position = np.broadcast_to(rays.position, vshape, subok=True).reshape(-1, 3)
+        direction = np.broadcast_to(rays.direction, vshape, subok=True).reshape(-1, 3)
+        t0 = np.broadcast_to(t0, shape, subok=True).flatten()
+        t1 = np.broadcast_to(t1, shape, subok=True).flatten()
+        f0 = np.broadcast_to(f0, shape, subok=True).flatten()
+        f1 = np.broadcast_to(f1, shape, subok=True).flatten()
+        surf_flat = self._broadcast_parameters(shape)
+
+        t = t1.copy()
+        is_converged = np.zeros(t.shape, dtype=np.bool)
+        index = np.arange(t.size)
 
         i = 0
         while True:
 
-            if i > max_iterations:
-                # warnings.warn('Number of iterations exceeded')
-                # break
-                raise ValueError('Number of iterations exceeded')
-
-            a0 = intercept + rays.direction * t0
-            a1 = intercept + rays.direction * t1
-            f0 = a0[kgpy.vector.z] - self.sag(a0[kgpy.vector.x], a0[kgpy.vector.y])
-            f1 = a1[kgpy.vector.z] - self.sag(a1[kgpy.vector.x], a1[kgpy.vector.y])
+            is_converged_active = np.abs(f1) < max_error
+            is_converged[index[is_converged_active]] = True
+            t[index] = t1
 
-            current_error = np.nanmax(np.abs(f1))
-            if current_error < max_error:
+            is_active = ~is_converged_active & np.isfinite(f1)
+            if i >= max_iterations or not is_active.any():
                 break
 
-            f0 = np.expand_dims(f0, ~0)
-            f1 = np.expand_dims(f1, ~0)
+            index = index[is_active]
+            t0, t1, f0, f1 = t0[is_active], t1[is_active], f0[is_active], f1[is_active]
+            surf = surf_flat._broadcast_parameters(t.shape, index)
 
             m = (f1 - f0) == 0
-
             t2 = (t0 * f1 - t1 * f0) / (f1 - f0)
-            t1 = np.broadcast_to(t1, t2.shape, subok=True)
-            t2[m] = t1[m]
+            t2 = np.where(m, t1, t2)
 
-            t0 = t1
+            t0, f0 = t1, f1
             t1 = t2
 
+            a1 = position[index] + direction[index] * t1[..., np.newaxis]
+            f1 = a1[kgpy.vector.z] - surf.sag(a1[kgpy.vector.x], a1[kgpy.vector.y])
+
             i += 1
 
-        t = t1
-        intercept = intercept + rays.direction * t
+        intercept = position + direction * t[..., np.newaxis]
+        intercept[~is_converged] = np.nan
 
-        return intercept
+        return intercept.reshape(vshape)
+
+    def _broadcast_parameters(self, shape: typ.Tuple[int, ...], index: typ.Any = ...) -> 'Surface':
+        """
+        Copy of this surface where every array-valued parameter has been broadcast to `shape`, flattened and indexed
+        by `index`, so that methods like :meth:`sag` can be evaluated elementwise on a flattened subset of the rays.
+        """
+        other = copy.copy(self)
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, np.ndarray) and value.ndim > 0:
+                value = np.broadcast_to(value, shape, subok=True).reshape(-1)[index]
+                setattr(other, field.name, value)
+        return other
 
     @abc.abstractmethod
     def apply_pre_transforms(self, x: u.Quantity, num_extra_dims: int = 0) -> u.Quantity:
@@ -148,21 +217,13 @@ class Surface(
     ):
 
         if system is not None:
-            surfaces = list(system)     # type: typ.List['Surface']
-            index = surfaces.index(self)
-            # for s, surf in enumerate(surfaces):
-            #     if surf is self:
-            #         index = s
-            #         break
-            surfaces = surfaces[:index]
-            surfaces.reverse()
-    
-            x = self.apply_pre_transforms(x, num_extra_dims)
-    
-            for surf in surfaces:
-                x = surf.apply_pre_transforms(x, num_extra_dims)
-                x = surf.apply_post_transforms(x, num_extra_dims)
-    
+            rotation, translation = system.global_transforms[id(self)]
+            sh = list(rotation.shape)
+            sh[~1:~1] = [1] * num_extra_dims
+            rotation = rotation.reshape(sh)
+            translation = translation.reshape(translation.shape[:~0] + (1, ) * num_extra_dims + (3, ))
+            x = kgpy.vector.matmul(rotation, x) + translation
+
         return x
 
     def plot_2d(
@@ -0,0 +1,109 @@
+import os
+import timeit
+import typing as typ
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from kgpy.optics import unitless
+from . import kernels, Standard, Toroidal, VariableLineSpaceGrating
+
+pytest.importorskip('numba')
+
+num_rays = 10000
+num_rays_benchmark = 1000000
+
+surfaces = [
+    Standard(radius=500 * u.mm, conic=-0.5),
+    Standard(radius=-500 * u.mm),
+    Standard(),
+    Toroidal(radius=500 * u.mm, radius_of_rotation=400 * u.mm),
+    VariableLineSpaceGrating(
+        radius=500 * u.mm,
+        groove_density=1 / u.um,
+        coeff_linear=1 / u.mm ** 2,
+        coeff_quadratic=2 / u.mm ** 3,
+        coeff_cubic=3 / u.mm ** 4,
+    ),
+]
+
+
+@pytest.fixture
+def position() -> np.ndarray:
+    return unitless.to_value(np.random.uniform(-600, 600, (num_rays, 3)) << u.mm)
+
+
+@pytest.fixture
+def direction() -> np.ndarray:
+    return kgpy.vector.normalize(np.random.uniform(-0.1, 0.1, (num_rays, 3)) + kgpy.vector.z_hat)
+
+
+def compare(monkeypatch, func: typ.Callable[[], np.ndarray]) -> typ.Tuple[np.ndarray, np.ndarray]:
+    result = func()
+    monkeypatch.setattr(kernels, 'enabled', False)
+    expected = func()
+    monkeypatch.setattr(kernels, 'enabled', True)
+    return result, expected
+
+
+@pytest.mark.parametrize('surface', surfaces)
+def test_sag(monkeypatch, surface: Standard, position: np.ndarray):
+    surface = unitless.to_value(surface)
+    result, expected = compare(monkeypatch, lambda: surface.sag(position[..., 0], position[..., 1]))
+    assert np.allclose(result, expected, rtol=1e-14, atol=0, equal_nan=True)
+
+
+@pytest.mark.parametrize('surface', surfaces)
+def test_normal(monkeypatch, surface: Standard, position: np.ndarray):
+    surface = unitless.to_value(surface)
+    result, expected = compare(monkeypatch, lambda: surface.normal(position[..., 0], position[..., 1]))
+    assert np.allclose(result, expected, rtol=1e-14, atol=1e-15, equal_nan=True)
+
+
+def test_groove_normal(monkeypatch, position: np.ndarray):
+    surface = unitless.to_value(surfaces[~0])
+    result, expected = compare(monkeypatch, lambda: surface.groove_normal(position[..., 0], position[..., 1]))
+    assert np.allclose(result, expected, rtol=1e-14, atol=0)
+
+
+@pytest.mark.parametrize('propagation_signum', [-1, 1])
+def test_refract(monkeypatch, direction: np.ndarray, propagation_signum: float):
+    normal = kgpy.vector.normalize(direction + np.random.uniform(-0.2, 0.2, direction.shape))
+    index_ratio = np.random.uniform(0.9, 1.1, direction.shape[:~0] + (1, ))
+    result, expected = compare(monkeypatch, lambda: Standard.refract(direction, -normal, index_ratio, propagation_signum))
+    assert np.allclose(result, expected, rtol=0, atol=1e-14, equal_nan=True)
+
+
+@pytest.mark.parametrize('propagation_signum', [-1, 1])
+def test_refract_jacobian(monkeypatch, direction: np.ndarray, propagation_signum: float):
+    normal = kgpy.vector.normalize(direction + np.random.uniform(-0.2, 0.2, direction.shape))
+    index_ratio = np.random.uniform(0.9, 1.1, direction.shape[:~0] + (1, ))
+    incident_jacobian = np.random.uniform(-1, 1, direction.shape + (2, ))
+    normal_jacobian = np.random.uniform(-1, 1, direction.shape + (2, ))
+    result, expected = compare(monkeypatch, lambda: Standard.refract_jacobian(
+        direction, -normal, index_ratio, propagation_signum, incident_jacobian, normal_jacobian,
+    ))
+    assert np.allclose(result, expected, rtol=1e-10, atol=1e-10, equal_nan=True)
+
+
+@pytest.mark.skipif('KGPY_BENCHMARK' not in os.environ, reason='Benchmark, set KGPY_BENCHMARK to run')
+def test_benchmark(monkeypatch):
+    surface = unitless.to_value(surfaces[0])
+    position = unitless.to_value(np.random.uniform(-600, 600, (num_rays_benchmark, 3)) << u.mm)
+    direction = kgpy.vector.normalize(np.random.uniform(-0.1, 0.1, (num_rays_benchmark, 3)) + kgpy.vector.z_hat)
+    px, py = position[..., 0], position[..., 1]
+    normal = surface.normal(px, py)
+    index_ratio = np.ones(direction.shape[:~0] + (1, ))
+    operations = {
+        'sag': lambda: surface.sag(px, py),
+        'normal': lambda: surface.normal(px, py),
+        'refract': lambda: surface.refract(direction, normal, index_ratio, -1),
+    }
+    print()
+    for name, func in operations.items():
+        timings = []
+        for enabled in [False, True]:
+            monkeypatch.setattr(kernels, 'enabled', enabled)
+            timings.append(min(timeit.repeat(func, number=3, repeat=3)) / 3)
+        throughput = [num_rays_benchmark / t for t in timings]
+        print(name, ': numpy', throughput[0], 'rays/s, numba', throughput[1], 'rays/s, speedup:', timings[0] / timings[1])
@@ -0,0 +1,74 @@
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from kgpy.optics import Rays, unitless
+from . import Surface, Standard, Toroidal
+
+
+@pytest.fixture
+def rays() -> Rays:
+    position = kgpy.vector.from_components(
+        ax=np.linspace(-40, 40, 5)[:, np.newaxis] * u.mm,
+        ay=np.linspace(-40, 40, 5) * u.mm,
+        az=100 * u.mm,
+    )
+    return Rays.from_field_angles(
+        wavelength_grid=[100] * u.nm,
+        position=position,
+        field_grid_x=np.linspace(-1, 1, 3) * u.deg,
+        field_grid_y=np.linspace(-1, 1, 3) * u.deg,
+        field_mask_func=lambda fx, fy: np.ones(np.broadcast(fx, fy).shape, dtype=np.bool),
+    )
+
+
+class TestStandard:
+
+    @pytest.mark.parametrize(
+        argnames='radius, conic',
+        argvalues=[
+            (np.inf * u.mm, 0),
+            (500 * u.mm, 0),
+            (-500 * u.mm, 0),
+            (500 * u.mm, -1),
+            (-500 * u.mm, -2),
+            (500 * u.mm, -0.5),
+            (500 * u.mm, 0.5),
+        ]
+    )
+    def test_calc_intercept(self, rays: Rays, radius: u.Quantity, conic: float):
+        surf = Standard(radius=radius, conic=conic)
+        intercept = surf.calc_intercept(rays)
+        intercept_secant = Surface.calc_intercept(surf, rays)
+        assert np.allclose(intercept, intercept_secant, rtol=0, atol=.1 * u.nm)
+        assert np.allclose(intercept[kgpy.vector.z], surf.sag(intercept[kgpy.vector.x], intercept[kgpy.vector.y]))
+
+        intercept_unitless = unitless.to_value(surf).calc_intercept(unitless.to_value(rays))
+        intercept_unitless = unitless.to_quantity(intercept_unitless, intercept)
+        assert np.allclose(intercept_unitless, intercept, rtol=0, atol=1 * u.pm)
+
+    @pytest.mark.parametrize('radius', [500 * u.mm, 550 * u.mm])
+    def test_calc_intercept_reversed(self, rays: Rays, radius: u.Quantity):
+        rays.position[kgpy.vector.z] = 900 * u.mm
+        rays.direction = -rays.direction
+        surf = Standard(radius=radius)
+        intercept = surf.calc_intercept(rays)
+        intercept_secant = Surface.calc_intercept(surf, rays)
+        assert np.allclose(intercept, intercept_secant, rtol=0, atol=.1 * u.nm)
+
+
+class TestToroidal:
+
+    def test_calc_intercept(self, rays: Rays):
+        surf = Toroidal(radius=500 * u.mm, radius_of_rotation=400 * u.mm)
+        intercept = surf.calc_intercept(rays)
+        assert np.allclose(intercept[kgpy.vector.z], surf.sag(intercept[kgpy.vector.x], intercept[kgpy.vector.y]))
+
+    def test_calc_intercept_not_converged(self, rays: Rays):
+        surf = Toroidal(radius=500 * u.mm, radius_of_rotation=400 * u.mm)
+        intercept = surf.calc_intercept(rays)
+        intercept_partial = surf.calc_intercept(rays, max_iterations=2)
+        is_converged = np.isfinite(intercept_partial).all(~0)
+        assert is_converged.any()
+        assert not is_converged.all()
+        assert np.allclose(intercept_partial[is_converged], intercept[is_converged], rtol=0, atol=.1 * u.nm)
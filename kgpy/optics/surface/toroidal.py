@@ -3,8 +3,8 @@ import typing as typ
 import numpy as np
 import astropy.units as u
 import kgpy.vector
-from .. import material, aperture
-from . import Standard
+from .. import Rays, unitless, material, aperture
+from . import Surface, Standard, kernels
 
 __all__ = ['Toroidal']
 
@@ -36,6 +36,10 @@ class Toroidal(Standard[MaterialT, ApertureT]):
             self.radius_of_rotation,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['radius_of_rotation']
+
     @property
     def is_plane(self) -> np.ndarray:
         return np.isinf(self.radius) & np.isinf(self.radius_of_rotation)
@@ -44,7 +48,15 @@ class Toroidal(Standard[MaterialT, ApertureT]):
     def is_sphere(self) -> np.ndarray:
         return (self.conic == 0) & (self.radius == self.radius_of_rotation)
 
+    def calc_intercept(self, rays: Rays, **kwargs) -> u.Quantity:
+        return Surface.calc_intercept(self, rays, **kwargs)
+
+    def normal_jacobian(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        return Surface.normal_jacobian(self, ax, ay)
+
     def sag(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        if kernels.is_enabled(ax, ay, self.radius_of_rotation):
+            return kernels.toroidal_sag(ax, ay, self.curvature, self.conic, self.radius_of_rotation)
         x2 = np.square(ax)
         y2 = np.square(ay)
         c = self.curvature
@@ -56,6 +68,8 @@ class Toroidal(Standard[MaterialT, ApertureT]):
         return z
 
     def normal(self, ax: u.Quantity, ay: u.Quantity) -> u.Quantity:
+        if kernels.is_enabled(ax, ay, self.radius_of_rotation):
+            return kernels.toroidal_normal(ax, ay, self.curvature, self.conic, self.radius_of_rotation)
         x2 = np.square(ax)
         y2 = np.square(ay)
         c = self.curvature
@@ -70,4 +84,5 @@ class Toroidal(Standard[MaterialT, ApertureT]):
         mask = np.abs(ax) > r
         dzdx[mask] = 0
         dzdy[mask] = 0
-        return kgpy.vector.normalize(kgpy.vector.from_components(dzdx, dzdy, -1 * u.dimensionless_unscaled))
+        dzdz = unitless.like(-1 * u.dimensionless_unscaled, dzdx)
+        return kgpy.vector.normalize(kgpy.vector.from_components(dzdx, dzdy, dzdz))
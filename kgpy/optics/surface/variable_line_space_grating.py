@@ -4,7 +4,7 @@ import numpy as np
 import astropy.units as u
 import kgpy.vector
 from .. import material, aperture
-from . import DiffractionGrating
+from . import DiffractionGrating, kernels
 
 __all__ = ['VariableLineSpaceGrating']
 
@@ -38,7 +38,16 @@ class VariableLineSpaceGrating(DiffractionGrating[MaterialT, ApertureT]):
             self.coeff_cubic,
         )
 
+    @property
+    def config_fields(self) -> typ.List[str]:
+        return super().config_fields + ['coeff_linear', 'coeff_quadratic', 'coeff_cubic']
+
     def groove_normal(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
+        if kernels.is_enabled(sx, self.groove_density):
+            groove_density = kernels.vls_groove_density(
+                sx, self.groove_density, self.coeff_linear, self.coeff_quadratic, self.coeff_cubic,
+            )
+            return kgpy.vector.from_components(ax=groove_density)
         sx2 = np.square(sx)
         term0 = self.groove_density
         # term0 = 1 / term0
@@ -48,3 +57,16 @@ class VariableLineSpaceGrating(DiffractionGrating[MaterialT, ApertureT]):
         groove_density = term0 + term1 + term2 + term3
         # groove_density = 1 / terms
         return kgpy.vector.from_components(ax=groove_density)
+
+    def groove_phase(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
+        sx2 = np.square(sx)
+        term0 = self.groove_density * sx
+        term1 = self.coeff_linear * sx2 / 2
+        term2 = self.coeff_quadratic * sx * sx2 / 3
+        term3 = self.coeff_cubic * np.square(sx2) / 4
+        return term0 + term1 + term2 + term3
+
+    def groove_normal_jacobian(self, sx: u.Quantity, sy: u.Quantity) -> u.Quantity:
+        dgdx = self.coeff_linear + 2 * self.coeff_quadratic * sx + 3 * self.coeff_cubic * np.square(sx)
+        dgdx = kgpy.vector.from_components(ax=dgdx)
+        return np.stack([dgdx, 0 * dgdx], axis=~0)
@@ -0,0 +1,257 @@
+"""
+Persistent cache of traced rays, keyed by a hash of the contents of the optical system that produced them.
+"""
+
+import dataclasses
+import enum
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import types
+import typing as typ
+import numpy as np
+import astropy.units as u
+from .. import Rays
+
+__all__ = ['fingerprint', 'RayCache']
+
+format_version = 1  # Increment when the layout of the cache files changes, to invalidate existing entries.
+
+
+def fingerprint(obj: typ.Any) -> str:
+    """
+    Content hash of an object, stable across processes and sessions.
+
+    Dataclasses are hashed using their type and the value of each field, except fields declared with
+    :code:`init=False`, which hold derived state or references to a parent object.
+    Quantities are hashed using their unit and the bytes of their value, so two quantities that are equal but expressed
+    in different units have different fingerprints.
+    Functions are hashed using their qualified name, bytecode, default arguments and closure.
+
+    :param obj: Any combination of dataclasses, containers, arrays, quantities, scalars, strings and functions.
+    :return: Hexadecimal SHA-256 digest.
+    :raises TypeError: If `obj` contains an object of any other type.
+    """
+    h = hashlib.sha256()
+    _update(h, obj)
+    return h.hexdigest()
+
+
+def _update(h: 'hashlib._Hash', obj: typ.Any) -> typ.NoReturn:
+
+    def tag(s: str):
+        h.update(s.encode() + b'\0')
+
+    if obj is None:
+        tag('None')
+
+    elif isinstance(obj, (bool, int, float, complex, str)):
+        tag(type(obj).__name__)
+        tag(repr(obj))
+
+    elif isinstance(obj, bytes):
+        tag('bytes')
+        tag(str(len(obj)))
+        h.update(obj)
+
+    elif isinstance(obj, u.UnitBase):
+        tag('Unit')
+        tag(obj.to_string())
+
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        if isinstance(obj, u.Quantity):
+            tag('Quantity')
+            tag(obj.unit.to_string())
+            obj = obj.value
+        a = np.asarray(obj)
+        tag('ndarray')
+        tag(a.dtype.str)
+        tag(repr(a.shape))
+        if a.dtype.hasobject:
+            for item in a.flat:
+                _update(h, item)
+        else:
+            h.update(np.ascontiguousarray(a).tobytes())
+
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        _update(h, type(obj))
+        for field in dataclasses.fields(obj):
+            if field.init:
+                tag(field.name)
+                _update(h, getattr(obj, field.name))
+
+    elif isinstance(obj, (list, tuple)):
+        tag(type(obj).__name__)
+        tag(str(len(obj)))
+        for item in obj:
+            _update(h, item)
+
+    elif isinstance(obj, dict):
+        tag('dict')
+        tag(str(len(obj)))
+        for key, value in sorted((fingerprint(k), v) for k, v in obj.items()):
+            tag(key)
+            _update(h, value)
+
+    elif isinstance(obj, enum.Enum):
+        _update(h, type(obj))
+        tag(obj.name)
+
+    elif isinstance(obj, type):
+        tag('type')
+        tag(obj.__module__ + '.' + obj.__qualname__)
+
+    elif isinstance(obj, types.FunctionType):
+        tag('function')
+        tag(obj.__module__ + '.' + obj.__qualname__)
+        _update(h, obj.__code__)
+        _update(h, obj.__defaults__)
+        _update(h, obj.__kwdefaults__)
+        _update(h, None if obj.__closure__ is None else [cell.cell_contents for cell in obj.__closure__])
+
+    elif isinstance(obj, types.CodeType):
+        tag('code')
+        _update(h, obj.co_code)
+        _update(h, obj.co_consts)
+        _update(h, obj.co_names)
+
+    else:
+        raise TypeError('Cannot fingerprint an object of type ' + repr(type(obj)))
+
+
+@dataclasses.dataclass
+class RayCache:
+    """
+    Directory of traced rays, with one file for each optical system, named after the fingerprint of the system (see
+    :attr:`kgpy.optics.System.fingerprint`).
+
+    Each file is an uncompressed :func:`numpy.savez` archive of the rays at every surface, so it can be loaded without
+    unpickling anything.
+    When the total size of the files exceeds :attr:`max_size`, the least recently used files are deleted.
+    The fingerprint does not include the source code of this package, so call :meth:`clear` after upgrading it.
+    """
+
+    directory: pathlib.Path = dataclasses.field(
+        default_factory=lambda: pathlib.Path.home() / '.cache' / 'kgpy' / 'rays'
+    )
+    max_size: u.Quantity = 1 * u.GB
+
+    suffix = '.npz'
+
+    def path(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.directory) / (key + self.suffix)
+
+    @property
+    def paths(self) -> typ.List[pathlib.Path]:
+        """
+        Every file in the cache, from the least to the most recently used.
+        """
+        directory = pathlib.Path(self.directory)
+        if not directory.is_dir():
+            return []
+        paths = []
+        for path in directory.glob('*' + self.suffix):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                pass
+        return [path for _, path in sorted(paths)]
+
+    @property
+    def size(self) -> u.Quantity:
+        size = 0
+        for path in self.paths:
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size * u.byte
+
+    def __contains__(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def load(self, key: str) -> typ.Optional[typ.List[Rays]]:
+        """
+        Load rays from the cache and mark them as the most recently used.
+
+        :param key: Fingerprint of the system that traced the rays.
+        :return: The rays at each surface of the system, or :code:`None` if they are not in the cache.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                arrays = dict(archive)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        header = json.loads(str(arrays.pop('header')))
+        if header['format_version'] != format_version:
+            return None
+        rays = []
+        for i in range(header['num_surfaces']):
+            prefix = str(i) + '/'
+            rays_arrays = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+            rays.append(Rays.from_arrays(rays_arrays))
+        return rays
+
+    def save(self, key: str, rays: typ.List[Rays]) -> typ.NoReturn:
+        """
+        Store rays in the cache, then delete the least recently used files until the cache is smaller than
+        :attr:`max_size`.
+        The file is written under a temporary name and then renamed, so that other processes sharing the cache never
+        read an incomplete file.
+
+        :param key: Fingerprint of the system that traced the rays.
+        :param rays: The rays at the first one or more surfaces of the system.
+        """
+        header = dict(format_version=format_version, num_surfaces=len(rays))
+        arrays = dict(header=np.array(json.dumps(header)))
+        for i, r in enumerate(rays):
+            for name, value in r.to_arrays().items():
+                arrays[str(i) + '/' + name] = value
+
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, path_tmp = tempfile.mkstemp(suffix=self.suffix + '.tmp', dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(path_tmp, path)
+        except BaseException:
+            os.remove(path_tmp)
+            raise
+
+        self.evict()
+
+    def evict(self) -> typ.NoReturn:
+        """
+        Delete the least recently used files until the cache is smaller than :attr:`max_size`.
+        """
+        paths = self.paths
+        sizes = []
+        for path in paths:
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                sizes.append(0)
+        size = sum(sizes) * u.byte
+        for path, path_size in zip(paths, sizes):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= path_size * u.byte
+
+    def clear(self) -> typ.NoReturn:
+        for path in self.paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,142 @@
+"""
+Selection of a subset of the configurations of an optical system, so that only the selected configurations are traced.
+
+A parameter that varies with the configuration has the configuration axes first, followed by either nothing or the five
+axes of the ray grid, see :class:`kgpy.optics.Rays`.
+Leading configuration axes may be omitted, following the broadcasting rules of :mod:`numpy`.
+Only the fields named by :attr:`kgpy.mixin.Broadcastable.config_fields` are parameters of this kind, other arrays such
+as the vertices of a polygon are never indexed, whatever their shape.
+"""
+
+import copy
+import dataclasses
+import typing as typ
+import numpy as np
+import kgpy.mixin
+
+__all__ = ['Index', 'normalize', 'index_axes', 'index_array', 'index_object', 'shape']
+
+num_grid_axes = 5
+
+Index = typ.Tuple[typ.Union[int, slice], ...]
+
+T = typ.TypeVar('T')
+
+
+def normalize(index: typ.Union[int, slice, Index]) -> Index:
+    """
+    Convert an index into a tuple with an integer or a slice for each configuration axis.
+    """
+    if not isinstance(index, tuple):
+        index = (index, )
+    for i in index:
+        if not isinstance(i, (int, np.integer, slice)):
+            raise TypeError('Configurations can only be selected with integers and slices, not ' + repr(i))
+    return index
+
+
+def index_axes(shape: typ.Tuple[int, ...], index: Index) -> Index:
+    """
+    Index into the trailing configuration axes of an array, which are broadcast against the full set of configuration
+    axes selected by `index`.
+
+    :param shape: Shape of the configuration axes of the array.
+    :param index: Index of each configuration axis of the system.
+    :return: An index that can be applied to the configuration axes of the array.
+    """
+    if len(shape) > len(index):
+        raise ValueError('Array has more configuration axes than the index')
+    index = index[len(index) - len(shape):]
+    return tuple((0 if isinstance(i, (int, np.integer)) else slice(None)) if n == 1 else i for n, i in zip(shape, index))
+
+
+def _num_config_axes(a: np.ndarray) -> int:
+    if a.ndim > num_grid_axes:
+        return a.ndim - num_grid_axes
+    return a.ndim
+
+
+def index_array(a: np.ndarray, index: Index) -> np.ndarray:
+    """
+    Select configurations from a parameter, or return it unchanged if it does not have configuration axes.
+    """
+    num_config_axes = _num_config_axes(a)
+    if num_config_axes == 0 or num_config_axes > len(index):
+        return a
+    return a[index_axes(a.shape[:num_config_axes], index)]
+
+
+def index_object(obj: T, index: Index, memo: typ.Optional[typ.Dict[int, typ.Any]] = None) -> T:
+    """
+    Recursively select configurations from every parameter in an object, like :func:`kgpy.optics.unitless.to_value`.
+
+    Dataclass instances are shallow-copied before their fields are indexed, so `obj` itself is never modified.
+    Only the arrays of the fields in :attr:`kgpy.mixin.Broadcastable.config_fields` are indexed, the other fields are
+    only searched for nested objects.
+    Fields declared with :code:`init=False`, which hold derived state or references to a parent object, are skipped.
+
+    :param obj: A configuration parameter, a dataclass instance, a list or tuple of such, or any other value, which is
+        returned unchanged.
+    :param index: Index of each configuration axis.
+    :param memo: The copy of each dataclass instance that has already been indexed, keyed by the :func:`id` of the
+        original, so that objects referenced more than once are only copied once.
+    :return: A copy of `obj` with the selected configurations.
+    """
+    if memo is None:
+        memo = {}
+    return _index_object(obj, index, memo, is_config=True)
+
+
+def _index_object(obj: T, index: Index, memo: typ.Dict[int, typ.Any], is_config: bool) -> T:
+    if isinstance(obj, np.ndarray):
+        return index_array(obj, index) if is_config and obj.ndim > 0 else obj
+    elif isinstance(obj, list):
+        return [_index_object(v, index, memo, is_config) for v in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_index_object(v, index, memo, is_config) for v in obj)
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        if id(obj) in memo:
+            return memo[id(obj)]
+        new_obj = copy.copy(obj)
+        memo[id(obj)] = new_obj
+        config_fields = obj.config_fields if isinstance(obj, kgpy.mixin.Broadcastable) else []
+        for field in dataclasses.fields(obj):
+            if not field.init:
+                continue
+            value = getattr(obj, field.name)
+            new_value = _index_object(value, index, memo, is_config=field.name in config_fields)
+            if new_value is not value:
+                setattr(new_obj, field.name, new_value)
+        return new_obj
+    else:
+        return obj
+
+
+def shape(obj: typ.Any) -> typ.Tuple[int, ...]:
+    """
+    Broadcast shape of the configuration axes of every parameter in an object, found by the same search as
+    :func:`index_object`.
+
+    :param obj: A configuration parameter, a dataclass instance, a list or tuple of such, or any other value.
+    :return: The shape of the configuration axes of `obj`.
+    """
+    shapes = []
+    _find_shapes(obj, shapes, set(), is_config=True)
+    return np.broadcast_shapes(*shapes)
+
+
+def _find_shapes(obj: typ.Any, shapes: typ.List[typ.Tuple[int, ...]], visited: typ.Set[int], is_config: bool):
+    if isinstance(obj, np.ndarray):
+        if is_config:
+            shapes.append(obj.shape[:_num_config_axes(obj)])
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _find_shapes(v, shapes, visited, is_config)
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        if id(obj) in visited:
+            return
+        visited.add(id(obj))
+        config_fields = obj.config_fields if isinstance(obj, kgpy.mixin.Broadcastable) else []
+        for field in dataclasses.fields(obj):
+            if field.init:
+                _find_shapes(getattr(obj, field.name), shapes, visited, is_config=field.name in config_fields)
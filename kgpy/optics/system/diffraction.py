@@ -0,0 +1,179 @@
+"""
+Diffraction point-spread and modulation transfer functions of an optical system, computed with the fast Fourier
+transform of the wavefront error found from the optical path length of the traced rays.
+"""
+
+import dataclasses
+import typing as typ
+import numpy as np
+import scipy.fft
+import astropy.units as u
+import kgpy.vector
+from kgpy.vector import xy
+from .. import Rays, surface
+from . import sampling
+
+__all__ = ['Wavefront']
+
+
+@dataclasses.dataclass
+class Wavefront:
+    """
+    Wavefront error of every configuration, wavelength and field angle of a system, sampled on the rectangular pupil
+    grid of the rays.
+
+    The optical path of each ray is measured from a plane wavefront in object space to the plane through the reference
+    point that is perpendicular to the ray, which to first order is the distance to the reference sphere.
+    The reference point is the centroid of the unvignetted rays on the final surface, so the piston and tilt of the
+    wavefront are removed.
+
+    The directions of the rays on the final surface are approximated by an affine function of their index on the
+    pupil grid, whose Jacobian scales the coordinates of the Fourier transforms.
+    The point-spread function is evaluated on the plane through the reference point that is perpendicular to the
+    chief ray.
+    """
+
+    opd: u.Quantity                 # Optical path difference of each ray.
+    amplitude: np.ndarray           # Amplitude of each ray, zero for the rays that are masked.
+    wavelength: u.Quantity          # Wavelength of each field point, without the pupil axes.
+    reference: u.Quantity           # Reference point of each field point, without the pupil axes.
+    direction_jacobian: np.ndarray  # Derivative of the direction cosines with respect to the pupil grid indices.
+
+    @classmethod
+    def from_rays(cls, rays: Rays) -> 'Wavefront':
+        """
+        Compute the wavefront from rays traced with :attr:`kgpy.optics.Rays.optical_path_length` allocated.
+
+        :param rays: Rays on the final surface, traced from a rectangular pupil grid.
+        :return: A new wavefront.
+        """
+        pupil_axes = rays.axis.pupil_x, rays.axis.pupil_y
+
+        mask = np.broadcast_to(rays.mask, rays.grid_shape)
+        weight = np.where(mask, np.broadcast_to(rays.weight, rays.grid_shape), 0)
+        position = np.broadcast_to(rays.position, rays.vector_grid_shape, subok=True)
+        direction = np.broadcast_to(rays.direction, rays.vector_grid_shape, subok=True)
+        index = np.broadcast_to(rays.index_of_refraction, rays.scalar_grid_shape, subok=True)[..., 0]
+        path = np.broadcast_to(rays.optical_path_length, rays.scalar_grid_shape, subok=True)[..., 0]
+
+        def mean(a: u.Quantity) -> u.Quantity:
+            w = np.expand_dims(weight, tuple(range(weight.ndim, a.ndim)))
+            axis = tuple(ax - (a.ndim - weight.ndim) for ax in pupil_axes)
+            a = np.where(w > 0, a, 0)
+            return np.sum(w * a, axis=axis, keepdims=True) / np.sum(w, axis=axis, keepdims=True)
+
+        reference = mean(position)
+        opd = path - index * kgpy.vector.dot(direction, position - reference, keepdims=False)
+        opd = opd - mean(opd)
+
+        direction_xy = direction[xy].value
+        is_valid = weight > 0
+        pupil_axes_vector = tuple(ax - 1 for ax in pupil_axes)
+
+        def step(axis: int) -> np.ndarray:
+            num = weight.shape[axis]
+            m = np.take(is_valid, np.arange(1, num), axis=axis) & np.take(is_valid, np.arange(num - 1), axis=axis)
+            m = m[..., np.newaxis]
+            d1 = np.take(direction_xy, np.arange(1, num), axis=axis - 1)
+            d0 = np.take(direction_xy, np.arange(num - 1), axis=axis - 1)
+            return np.sum(np.where(m, d1 - d0, 0), axis=pupil_axes_vector) / np.sum(m, axis=pupil_axes_vector)
+
+        direction_jacobian = np.stack([step(rays.axis.pupil_x), step(rays.axis.pupil_y)], axis=~0)
+
+        return cls(
+            opd=np.where(mask, opd, 0),
+            amplitude=np.sqrt(weight),
+            wavelength=np.broadcast_to(rays.wavelength, rays.scalar_grid_shape, subok=True)[..., 0, 0, 0],
+            reference=reference[..., 0, 0, :],
+            direction_jacobian=direction_jacobian,
+        )
+
+    @classmethod
+    def from_system(
+            cls,
+            system: 'kgpy.optics.System',
+            pupil_samples: typ.Union[int, typ.Tuple[int, int]] = 64,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> 'Wavefront':
+        """
+        Trace a rectangular pupil grid through a system and compute its wavefront.
+
+        :param system: The system to trace, which is not modified.
+        :param pupil_samples: Number of rays across the pupil, along each axis.
+        :param final_surface: Surface to evaluate the wavefront on, the image surface if :code:`None`.
+        :return: A new wavefront.
+        """
+        system = dataclasses.replace(system, pupil_samples=pupil_samples, pupil_sampler=sampling.Grid())
+        rays = system.input_rays.copy()
+        rays.optical_path_length = kgpy.vector.dot(rays.position, rays.direction)
+        rays = system.raytrace_subsystem(rays, final_surface=final_surface)
+        return cls.from_rays(rays)
+
+    @property
+    def rms(self) -> u.Quantity:
+        """
+        Root-mean-square wavefront error of each field point.
+        """
+        weight = np.square(self.amplitude)
+        axis = (~1, ~0)
+        return np.sqrt(np.sum(weight * np.square(self.opd), axis=axis) / np.sum(weight, axis=axis))
+
+    def _fft_shape(self, padding: int) -> typ.Tuple[int, int]:
+        return tuple(scipy.fft.next_fast_len(padding * n) for n in self.opd.shape[~1:])
+
+    def pupil_function(self) -> np.ndarray:
+        """
+        Complex amplitude of the wave on the pupil grid.
+        """
+        phase = 2 * np.pi * (self.opd / self.wavelength[..., np.newaxis, np.newaxis]).to(u.dimensionless_unscaled)
+        return self.amplitude * np.exp(1j * phase.value)
+
+    def psf(self, padding: int = 2, workers: typ.Optional[int] = None) -> typ.Tuple[np.ndarray, u.Quantity]:
+        """
+        Diffraction point-spread function of each field point.
+
+        The pupil function is zero-padded to the next size with small prime factors, so that :mod:`scipy.fft` can use
+        fast, cached transform plans.
+
+        :param padding: Ratio of the size of the transform to the size of the pupil grid along each axis, at least 2
+            to sample the PSF at the Nyquist rate.
+        :param workers: Number of threads used by :func:`scipy.fft.ifft2`.
+        :return: The point-spread function of each field point normalized to a total of one, with the two axes of the
+            transform last, and the position of each of its pixels.
+        """
+        shape = self._fft_shape(padding)
+        field = scipy.fft.ifft2(self.pupil_function(), s=shape, axes=(~1, ~0), workers=workers)
+        psf = scipy.fft.fftshift(np.square(np.abs(field)), axes=(~1, ~0))
+        psf = psf / np.sum(psf, axis=(~1, ~0), keepdims=True)
+
+        freq_x = (np.arange(shape[0]) - shape[0] // 2) / shape[0]
+        freq_y = (np.arange(shape[1]) - shape[1] // 2) / shape[1]
+        freq = kgpy.vector.from_components(freq_x[:, np.newaxis], freq_y, use_z=False)
+        inverse_transpose = np.swapaxes(np.linalg.inv(self.direction_jacobian), ~1, ~0)
+        offset = np.einsum('...ij,pqj->...pqi', inverse_transpose, freq)
+        wavelength = self.wavelength[..., np.newaxis, np.newaxis, np.newaxis]
+        position = self.reference[..., np.newaxis, np.newaxis, :2] + wavelength * offset
+        return psf, position.to(self.reference.unit)
+
+    def mtf(self, padding: int = 2, workers: typ.Optional[int] = None) -> typ.Tuple[np.ndarray, u.Quantity]:
+        """
+        Modulation transfer function of each field point, the magnitude of the autocorrelation of the pupil function.
+
+        :param padding: Ratio of the size of the transform to the size of the pupil grid along each axis, at least 2
+            so that the autocorrelation does not wrap around.
+        :param workers: Number of threads used by :mod:`scipy.fft`.
+        :return: The MTF of each field point normalized to one at zero frequency, with the two axes of the transform
+            last, and the spatial frequency of each of its pixels.
+        """
+        shape = self._fft_shape(padding)
+        field = scipy.fft.ifft2(self.pupil_function(), s=shape, axes=(~1, ~0), workers=workers)
+        otf = scipy.fft.fft2(np.square(np.abs(field)), axes=(~1, ~0), workers=workers)
+        mtf = np.abs(scipy.fft.fftshift(otf, axes=(~1, ~0)))
+        mtf = mtf / mtf[..., shape[0] // 2, shape[1] // 2, np.newaxis, np.newaxis]
+
+        lag_x = np.arange(shape[0]) - shape[0] // 2
+        lag_y = np.arange(shape[1]) - shape[1] // 2
+        lag = kgpy.vector.from_components(lag_x[:, np.newaxis], lag_y, use_z=False)
+        frequency = np.einsum('...ij,pqj->...pqi', self.direction_jacobian, lag)
+        frequency = frequency / self.wavelength[..., np.newaxis, np.newaxis, np.newaxis]
+        return mtf, frequency.to(1 / self.reference.unit)
@@ -0,0 +1,147 @@
+"""
+Compact record of selected fields of the rays at each surface of a system, for plotting the paths of the rays without
+keeping a complete :class:`kgpy.optics.Rays` object for every surface.
+"""
+
+import dataclasses
+import pathlib
+import typing as typ
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from .. import Rays, unitless
+
+__all__ = ['Recorder', 'RayHistory']
+
+
+@dataclasses.dataclass
+class Recorder:
+    """
+    Which fields of the rays are recorded by a :class:`RayHistory`, and how they are stored.
+    """
+
+    fields: typ.Tuple[str, ...] = ('position', )
+    dtype: type = np.float64                        # Use :class:`numpy.float32` to halve the memory of the history.
+    directory: typ.Optional[pathlib.Path] = None    # Store the arrays in memory-mapped `.npy` files in this directory.
+    image_only: bool = False                        # Only record the rays on the image surface.
+
+    supported_fields = ('position', 'direction', 'surface_normal')
+
+    def __post_init__(self):
+        for name in self.fields:
+            if name not in self.supported_fields:
+                raise ValueError('Cannot record ' + repr(name) + ', must be one of ' + repr(self.supported_fields))
+
+    def _empty(self, name: str, shape: typ.Tuple[int, ...], dtype: type, fill_value: typ.Any) -> np.ndarray:
+        if self.directory is None:
+            return np.full(shape, fill_value, dtype=dtype)
+        a = np.lib.format.open_memmap(str(pathlib.Path(self.directory) / (name + '.npy')), 'w+', dtype, shape)
+        a[...] = fill_value
+        return a
+
+    def allocate(self, surface_indices: typ.List[int], grid_shape: typ.Tuple[int, ...], template: Rays) -> 'RayHistory':
+        """
+        Create an empty history, where the fields of the rays are NaN until they are recorded.
+
+        :param surface_indices: Index within the system of each surface to record.
+        :param grid_shape: Shape of the complete grid of rays, including the configuration axes.
+        :param template: Rays with units, which provides the units of each field and the input grids.
+        :return: A new history.
+        """
+        shape = (len(surface_indices), ) + grid_shape
+        units = dict(
+            position=template.position.unit,
+            direction=u.dimensionless_unscaled,
+            surface_normal=u.dimensionless_unscaled,
+        )
+        return RayHistory(
+            surface_indices=list(surface_indices),
+            data={name: self._empty(name, shape + (3, ), self.dtype, np.nan) for name in self.fields},
+            units={name: units[name] for name in self.fields},
+            mask=self._empty('mask', shape, np.bool, False),
+            valid_mask=self._empty('valid_mask', shape, np.bool, False),
+            input_grids=template.input_grids.copy(),
+        )
+
+
+@dataclasses.dataclass
+class RayHistory:
+    """
+    The recorded fields of the rays at each surface, stacked into a single array with a leading axis for the surface.
+    """
+
+    surface_indices: typ.List[int]          # Index within the system of each recorded surface.
+    data: typ.Dict[str, np.ndarray]         # Value of each recorded field, shape `(surface, ..., 3)`.
+    units: typ.Dict[str, u.UnitBase]        # Unit of each recorded field.
+    mask: np.ndarray                        # :attr:`kgpy.optics.Rays.mask` at each recorded surface.
+    valid_mask: np.ndarray                  # Rays that are not masked by an error or the field mask.
+    input_grids: typ.List[typ.Optional[u.Quantity]]
+
+    def index(self, surface_index: int) -> int:
+        """
+        Position of a surface along the first axis of the history.
+
+        :param surface_index: Index of the surface within the system.
+        :raises ValueError: If the surface was not recorded.
+        """
+        if surface_index not in self.surface_indices:
+            raise ValueError('Surface ' + str(surface_index) + ' was not recorded, see Recorder.image_only')
+        return self.surface_indices.index(surface_index)
+
+    def record(self, i: int, rays: Rays, index: typ.Tuple[slice, ...] = ()) -> typ.NoReturn:
+        """
+        Copy the recorded fields of the rays at a surface into the history.
+        Fields that have not been allocated in `rays` are left unchanged.
+
+        :param i: Position of the surface along the first axis of the history.
+        :param rays: Rays at the surface, with units or converted by :func:`kgpy.optics.unitless.to_value`.
+        :param index: Index of `rays` within the trailing axes of the ray grid.
+        """
+        grid_index = (i, ...) + index
+        for name, a in self.data.items():
+            if rays.is_allocated(name):
+                unit = self.units[name]
+                value = getattr(rays, name)
+                if isinstance(value, u.Quantity):
+                    value = value.to_value(unit)
+                else:
+                    value = value * unitless.canonical_unit(unit).to(unit)
+                a[grid_index + (slice(None), )] = value
+        self.mask[grid_index] = rays.mask
+        self.valid_mask[grid_index] = rays.error_mask & rays.field_mask
+
+    def get(self, name: str, surface_index: int) -> u.Quantity:
+        """
+        Recorded value of a field on a surface, as a view into the history.
+
+        :param name: Name of the field, one of :attr:`Recorder.fields`.
+        :param surface_index: Index of the surface within the system.
+        """
+        if name not in self.data:
+            raise ValueError('Field ' + repr(name) + ' was not recorded, see Recorder.fields')
+        return self.data[name][self.index(surface_index)] << self.units[name]
+
+    def rays(self, surface_index: int) -> Rays:
+        """
+        Rays on a surface with only the recorded fields, for plotting with methods such as
+        :meth:`kgpy.optics.Rays.plot_position`.
+
+        :param surface_index: Index of the surface within the system.
+        """
+        i = self.index(surface_index)
+        wavelength = np.expand_dims(self.input_grids[Rays.axis.wavelength], (~4, ~3, ~2, ~1, ~0))
+        if 'direction' in self.data:
+            direction = self.get('direction', surface_index)
+        else:
+            direction = kgpy.vector.from_components(az=1) << u.dimensionless_unscaled
+        rays = Rays(
+            wavelength=wavelength,
+            position=self.get('position', surface_index),
+            direction=direction,
+            vignetted_mask=self.mask[i],
+            field_mask=self.valid_mask[i],
+            input_grids=self.input_grids.copy(),
+        )
+        if 'surface_normal' in self.data:
+            rays.surface_normal = self.get('surface_normal', surface_index)
+        return rays
@@ -0,0 +1,237 @@
+"""
+First-order (paraxial) model of an optical system, evaluated with ray-transfer (ABCD) matrices instead of real rays.
+"""
+
+import copy
+import dataclasses
+import typing as typ
+import numpy as np
+import astropy.units as u
+from kgpy.vector import ix, iy, xy
+from .. import Rays, surface
+
+__all__ = ['Paraxial']
+
+Matrix = typ.Tuple[u.Quantity, u.Quantity, u.Quantity, u.Quantity]
+
+
+@dataclasses.dataclass
+class Paraxial:
+    """
+    Paraxial model of a sequence of surfaces, evaluated independently in the :math:`xz` and :math:`yz` planes.
+
+    Each :class:`kgpy.optics.surface.Standard` surface is reduced to the curvature of its vertex in the two planes,
+    and every other surface to its thickness.
+    The state of a ray is its height :math:`h` and its reduced slope :math:`n u`, where :math:`n` is the index of
+    refraction, negated after each reflection, and :math:`u` is the slope of the ray with respect to the local
+    :math:`z` axis.
+    Tilts, decenters and diffraction are ignored, so for off-axis and grating systems the model is only a first
+    approximation, good enough to seed the real raytrace.
+
+    Rays are launched from the plane :math:`z = 0` of the first surface, in air, which is where
+    :meth:`kgpy.optics.System.input_rays` are defined when the object is at infinity.
+    Every array with a trailing axis of length 2 holds the :math:`x` and :math:`y` planes along that axis.
+    """
+
+    surfaces: typ.List[surface.Surface]
+    stop_surface: surface.Standard
+    wavelength: u.Quantity = 500 * u.nm
+
+    def __post_init__(self):
+        self._incident = {}
+        self._exiting = {}
+        self._index = {}
+
+        one = np.ones(2) << u.dimensionless_unscaled
+        a, b, c, d = one, 0 * one * u.mm, 0 * one / u.mm, one
+        n = 1 * u.dimensionless_unscaled
+        propagation_signum = 1
+        for surf in self.surfaces:
+            self._incident[id(surf)] = a, b, c, d
+            if isinstance(surf, surface.Standard):
+                if surf.material is not None:
+                    n2 = surf.material.index_of_refraction(self.wavelength, None)
+                    propagation_signum = propagation_signum * surf.material.propagation_signum
+                else:
+                    n2 = 1 * u.dimensionless_unscaled
+                n2 = propagation_signum * n2
+                power = (n2 - n) * self.curvature(surf)
+                c, d = c - power * a, d - power * b
+                n = n2
+            self._exiting[id(surf)] = a, b, c, d
+            self._index[id(surf)] = n
+            if np.isfinite(surf.thickness).all():
+                t = surf.thickness[..., np.newaxis] / n
+                a, b = a + t * c, b + t * d
+
+    @classmethod
+    def from_system(
+            cls,
+            system: 'kgpy.optics.System',
+            wavelengths: typ.Optional[u.Quantity] = None,
+    ) -> 'Paraxial':
+        """
+        Paraxial model of every surface of a system after the object surface.
+
+        :param system: The optical system.
+        :param wavelengths: Wavelengths to evaluate the model at, :attr:`kgpy.optics.System.wavelengths` if
+            :code:`None`.
+        """
+        wavelength = system.wavelengths if wavelengths is None else wavelengths
+        if wavelength is not None:
+            wavelength = np.expand_dims(wavelength, Rays.axis.perp_axes(Rays.axis.wavelength))[..., np.newaxis]
+        else:
+            wavelength = cls.wavelength
+        return cls(
+            surfaces=list(system)[1:],
+            stop_surface=system.stop_surface,
+            wavelength=wavelength,
+        )
+
+    @staticmethod
+    def curvature(surf: surface.Standard) -> u.Quantity:
+        """
+        Curvature of the vertex of a surface in the :math:`xz` and :math:`yz` planes, found from the derivative of its
+        normal vector, so that it is defined for every kind of sag surface.
+        """
+        origin = 0 * u.mm
+        normal_jacobian = surf.normal_jacobian(origin, origin)
+        curvature = np.stack([normal_jacobian[..., ix, 0], normal_jacobian[..., iy, 1]], axis=~0)
+        return curvature
+
+    def matrix(self, surf: surface.Surface, exiting: bool = False) -> Matrix:
+        """
+        Elements :math:`A`, :math:`B`, :math:`C` and :math:`D` of the transfer matrix from the launch plane to a surface,
+        so that :math:`h = A h_0 + B u_0` and :math:`n u = C h_0 + D u_0`.
+
+        :param surf: One of :attr:`surfaces`.
+        :param exiting: If :code:`True`, include the refraction or reflection at `surf`.
+        """
+        if exiting:
+            return self._exiting[id(surf)]
+        else:
+            return self._incident[id(surf)]
+
+    def wavelength_slice(self, index: slice) -> 'Paraxial':
+        """
+        Model of a subset of the wavelengths, which reuses the transfer matrices of this model instead of computing them
+        again.
+
+        :param index: Slice along the wavelength axis of the ray grid.
+        """
+        axis = Rays.axis.wavelength - 1     # The arrays have a trailing axis for the x and y planes.
+
+        def take(a: u.Quantity) -> u.Quantity:
+            if np.ndim(a) < -axis or np.shape(a)[axis] == 1:
+                return a
+            return a[(..., index) + (slice(None), ) * (-axis - 1)]
+
+        other = copy.copy(self)
+        other.wavelength = take(self.wavelength)
+        other._incident = {k: tuple(take(m) for m in v) for k, v in self._incident.items()}
+        other._exiting = {k: tuple(take(m) for m in v) for k, v in self._exiting.items()}
+        other._index = {k: take(v) for k, v in self._index.items()}
+        return other
+
+    def index(self, surf: surface.Surface) -> u.Quantity:
+        """
+        Index of refraction after `surf`, negative if the light is propagating in the :math:`-z` direction, with a
+        trailing axis of length one.
+        """
+        return self._index[id(surf)]
+
+    @property
+    def image_surface(self) -> surface.Surface:
+        return self.surfaces[~0]
+
+    def ray_position(self, position: u.Quantity, slope: u.Quantity, surf: surface.Surface) -> u.Quantity:
+        """
+        Paraxial position of rays on a surface.
+
+        :param position: :math:`x` and :math:`y` coordinates of each ray on the launch plane.
+        :param slope: Slope of each ray with respect to the :math:`z` axis on the launch plane.
+        :param surf: One of :attr:`surfaces`.
+        :return: :math:`x` and :math:`y` coordinates of each ray on `surf`.
+        """
+        a, b, c, d = self.matrix(surf)
+        return a * position + b * slope
+
+    def launch_position(self, position: u.Quantity, slope: u.Quantity, surf: surface.Surface) -> u.Quantity:
+        """
+        Inverse of :meth:`ray_position`, the position on the launch plane of rays that reach the given position on a
+        surface.
+        Used as the initial guess for ray aiming.
+        """
+        a, b, c, d = self.matrix(surf)
+        return (position - b * slope) / a
+
+    def chief_ray_position(self, slope: u.Quantity, surf: surface.Surface) -> u.Quantity:
+        """
+        Paraxial position on a surface of the chief ray, the ray through the center of the stop, for each field.
+
+        :param slope: Slope of the chief ray with respect to the :math:`z` axis on the launch plane.
+        :param surf: One of :attr:`surfaces`.
+        """
+        return self.ray_position(self.launch_position(0 * u.mm, slope, self.stop_surface), slope, surf)
+
+    @property
+    def effective_focal_length(self) -> u.Quantity:
+        a, b, c, d = self.matrix(self.image_surface)
+        return -1 / c
+
+    @property
+    def focus_position(self) -> u.Quantity:
+        """
+        Position of the paraxial focus for an object at infinity along the :math:`z` axis of the image surface, zero
+        if the image surface is in focus.
+        """
+        a, b, c, d = self.matrix(self.image_surface)
+        return -self.index(self.surfaces[~1]) * a / c
+
+    @property
+    def plate_scale(self) -> u.Quantity:
+        """
+        Rate of change of the position of the chief ray on the image surface with its slope on the launch plane.
+        """
+        return self.chief_ray_position(1 * u.dimensionless_unscaled, self.image_surface)
+
+    @property
+    def stop_semi_aperture(self) -> u.Quantity:
+        aperture = self.stop_surface.aperture
+        return (aperture.max[xy] - aperture.min[xy]) / 2
+
+    @property
+    def entrance_pupil_position(self) -> u.Quantity:
+        """
+        Position of the entrance pupil along the :math:`z` axis of the launch plane.
+        """
+        a, b, c, d = self.matrix(self.stop_surface)
+        return b / a
+
+    @property
+    def entrance_pupil_semi_aperture(self) -> u.Quantity:
+        a, b, c, d = self.matrix(self.stop_surface)
+        return self.stop_semi_aperture / np.abs(a)
+
+    def _stop_to_image(self) -> Matrix:
+        a0, b0, c0, d0 = self.matrix(self.stop_surface, exiting=True)
+        a1, b1, c1, d1 = self.matrix(self.image_surface)
+        # Every matrix has a unit determinant, so the inverse of the matrix to the stop is its adjugate.
+        return a1 * d0 - b1 * c0, b1 * a0 - a1 * b0, c1 * d0 - d1 * c0, d1 * a0 - c1 * b0
+
+    @property
+    def exit_pupil_position(self) -> u.Quantity:
+        """
+        Position of the exit pupil along the :math:`z` axis of the image surface.
+        """
+        a, b, c, d = self._stop_to_image()
+        return -self.index(self.surfaces[~1]) * b / d
+
+    @property
+    def exit_pupil_semi_aperture(self) -> u.Quantity:
+        a, b, c, d = self._stop_to_image()
+        return self.stop_semi_aperture / np.abs(d)
+
+    @property
+    def pupil_magnification(self) -> u.Quantity:
+        return self.exit_pupil_semi_aperture / self.entrance_pupil_semi_aperture
@@ -0,0 +1,238 @@
+"""
+Immutable snapshots of an optical system that the raytrace kernel executes, so that the per-trace cost of walking the
+surfaces of the system and recomputing their coordinate transforms is paid only once per modification.
+"""
+
+import copy
+import dataclasses
+import typing as typ
+import numpy as np
+import astropy.units as u
+from kgpy.vector import z
+from .. import Rays, unitless, coordinate, surface, material
+
+__all__ = ['Transfer', 'TracePlan']
+
+Kernel = typ.Callable[..., Rays]
+Operation = typ.Union[coordinate.Affine, u.Quantity]
+
+
+def compile_surface(surf: surface.Surface) -> surface.Surface:
+    """
+    Shallow copy of a surface where every :class:`kgpy.optics.coordinate.TiltDecenter` has been replaced with an
+    equivalent :class:`kgpy.optics.coordinate.Affine`.
+    """
+    other = copy.copy(surf)
+    for field in dataclasses.fields(surf):
+        value = getattr(surf, field.name)
+        if isinstance(value, coordinate.TiltDecenter):
+            setattr(other, field.name, coordinate.Affine.from_tilt_decenter(value))
+    return other
+
+
+@dataclasses.dataclass
+class Transfer:
+    """
+    Kernel of a stage that only changes the coordinate system of the rays, without intercepting a surface.
+    Each operation is either a :class:`kgpy.optics.coordinate.Affine` applied with
+    :meth:`kgpy.optics.Rays.tilt_decenter`, or a thickness subtracted from the :math:`z` component of the position.
+    """
+
+    before: typ.List[Operation] = dataclasses.field(default_factory=list)   # Applied when the rays arrive.
+    after: typ.List[Operation] = dataclasses.field(default_factory=list)    # Applied when the rays leave.
+
+    @classmethod
+    def from_surface(cls, surf: surface.Surface) -> 'Transfer':
+        """
+        The coordinate transforms of a compiled surface, without its interaction with the rays.
+        """
+        if isinstance(surf, surface.CoordinateBreak):
+            return cls(before=[~surf.transform], after=[surf.thickness])
+        self = cls(after=[surf.thickness])
+        if getattr(surf, 'transform_before', None) is not None:
+            self.before.append(~surf.transform_before)
+        if getattr(surf, 'transform_after', None) is not None:
+            self.after.append(~surf.transform_after)
+        return self
+
+    @classmethod
+    def fuse(cls, transfers: typ.Sequence['Transfer']) -> 'Transfer':
+        """
+        A single stage equivalent to a sequence of stages, with consecutive transforms composed into one.
+        """
+        operations = []
+        for t in transfers:
+            operations += t.before + t.after
+        return cls(before=cls.simplify(operations))
+
+    @staticmethod
+    def simplify(operations: typ.Sequence[Operation]) -> typ.List[Operation]:
+        """
+        Remove the operations that do nothing, convert the scalar thicknesses into transforms and compose consecutive
+        transforms.
+        Thicknesses that vary with the configuration are kept, since their axes are aligned with the ray grid rather
+        than with the axes of the transforms.
+        """
+        result = []
+        for op in operations:
+            if not isinstance(op, coordinate.Affine):
+                if np.all(op == 0):
+                    continue
+                if np.size(op) == 1:
+                    op = coordinate.Affine.from_thickness(np.reshape(op, ()))
+            if result and isinstance(op, coordinate.Affine) and isinstance(result[~0], coordinate.Affine):
+                result[~0] = op @ result[~0]
+            elif result and not isinstance(op, coordinate.Affine) and not isinstance(result[~0], coordinate.Affine):
+                result[~0] = result[~0] + op
+            else:
+                result.append(op)
+        return [op for op in result if not (isinstance(op, coordinate.Affine) and op.is_identity)]
+
+    @property
+    def is_identity(self) -> bool:
+        return not self.before and not self.after
+
+    @staticmethod
+    def _apply(rays: Rays, operations: typ.List[Operation]) -> Rays:
+        for op in operations:
+            if isinstance(op, coordinate.Affine):
+                rays = rays.tilt_decenter(op)
+            else:
+                rays.position[z] -= op
+        return rays
+
+    def __call__(self, rays: Rays, is_first_surface: bool = False, is_final_surface: bool = False) -> Rays:
+        if not is_first_surface:
+            rays = self._apply(rays, self.before)
+        if not is_final_surface:
+            rays = self._apply(rays, self.after)
+        return rays
+
+
+def is_transfer(surf: surface.Surface) -> bool:
+    """
+    If a surface only changes the coordinate system of the rays, either because it is a
+    :class:`kgpy.optics.surface.CoordinateBreak` or because it is inactive in every configuration.
+    """
+    if isinstance(surf, surface.ObjectSurface):
+        return False
+    return isinstance(surf, surface.CoordinateBreak) or not np.any(surf.is_active)
+
+
+def is_dummy(surf: surface.Surface) -> bool:
+    """
+    If a surface is a plane without a material or an active aperture, which does not change the direction of rays
+    travelling in a medium with an index of refraction of one.
+    """
+    if type(surf) is not surface.Standard:
+        return False
+    if not np.all(surf.is_plane) or surf.material is not None:
+        return False
+    return surf.aperture is None or not surf.aperture.is_active
+
+
+@dataclasses.dataclass(frozen=True)
+class TracePlan:
+    """
+    The surfaces of a system flattened into a sequence of stages, each with a precomputed copy of the surface and the
+    kernel that propagates rays through it.
+    Created by :meth:`kgpy.optics.System.compile`, which caches the plan until :meth:`kgpy.optics.System.update` is
+    called.
+    """
+
+    surfaces: typ.Tuple[surface.Surface, ...]   # The surfaces of the system, in order.
+    stages: typ.Tuple[surface.Surface, ...]     # The compiled copy of each surface that is traced.
+    kernels: typ.Tuple[Kernel, ...]             # The kernel of each stage, see :func:`is_transfer`.
+    is_fusible: typ.Tuple[bool, ...]            # If each stage can be fused with its neighbours, see :meth:`fused`.
+    grid_shape: typ.Tuple[int, ...]             # Shape of the ray grid, without the configuration axes.
+    is_unitless: bool                           # If the stages are expressed in canonical units without units.
+    surface_index: typ.Dict[int, int] = dataclasses.field(repr=False)   # Index of each surface, keyed by :func:`id`.
+    _fused: typ.Dict[typ.Tuple[int, int], typ.Tuple[Kernel, ...]] = dataclasses.field(
+        default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_system(cls, system: 'kgpy.optics.System') -> 'TracePlan':
+        surfaces = tuple(system)
+        stages = [compile_surface(surf) for surf in surfaces]
+        if system.unitless_raytrace:
+            stages = unitless.to_value(stages)
+
+        kernels = []
+        is_fusible = []
+        is_unit_index = True
+        for surf, stage in zip(surfaces, stages):
+            if is_transfer(surf):
+                kernels.append(Transfer.from_surface(stage))
+                is_fusible.append(True)
+            else:
+                kernels.append(stage.propagate_rays)
+                is_fusible.append(is_dummy(surf) and is_unit_index)
+                mat = getattr(surf, 'material', None)
+                is_unit_index = mat is None or isinstance(mat, material.Mirror)
+
+        return cls(
+            surfaces=surfaces,
+            stages=tuple(stages),
+            kernels=tuple(kernels),
+            is_fusible=tuple(is_fusible),
+            grid_shape=system.grid_shape,
+            is_unitless=system.unitless_raytrace,
+            surface_index={id(surf): s for s, surf in enumerate(surfaces)},
+        )
+
+    @staticmethod
+    def _fuse(run: typ.List[Transfer]) -> typ.List[Transfer]:
+        transfer = Transfer.fuse(run)
+        return [] if transfer.is_identity else [transfer]
+
+    def fused(self, start: int, final: int) -> typ.Tuple[Kernel, ...]:
+        """
+        Kernels that trace from one stage to another when the rays at the intermediate stages are not needed.
+        Each run of intermediate stages that only change the coordinate system of the rays, and dummy planes that do
+        not change the rays, is replaced with a single :class:`Transfer`, or removed if the run does nothing.
+        The result is cached.
+
+        :param start: Index of the first stage.
+        :param final: Index of the final stage.
+        """
+        key = start, final
+        if key not in self._fused:
+            kernels = [self.kernels[start]]
+            run = []
+            for s in range(start + 1, final):
+                if self.is_fusible[s]:
+                    kernel = self.kernels[s]
+                    run.append(kernel if isinstance(kernel, Transfer) else Transfer.from_surface(self.stages[s]))
+                    continue
+                kernels += self._fuse(run)
+                run = []
+                kernels.append(self.kernels[s])
+            kernels += self._fuse(run)
+            if final > start:
+                kernels.append(self.kernels[final])
+            self._fused[key] = tuple(kernels)
+        return self._fused[key]
+
+    def __len__(self) -> int:
+        return len(self.surfaces)
+
+    def index(self, surf: surface.Surface) -> int:
+        """
+        Index of a surface of the system in :attr:`stages`.
+        """
+        try:
+            return self.surface_index[id(surf)]
+        except KeyError:
+            raise ValueError('Surface is not part of the compiled system') from None
+
+    def to_value(self, rays: Rays) -> Rays:
+        """
+        Convert rays into the units of :attr:`stages`.
+        """
+        return unitless.to_value(rays) if self.is_unitless else rays
+
+    def to_quantity(self, rays: Rays, template: Rays) -> Rays:
+        """
+        Inverse of :meth:`to_value`, using the units of `template`.
+        """
+        return unitless.to_quantity(rays, template) if self.is_unitless else rays
@@ -0,0 +1,261 @@
+"""
+Reductions of traced rays that can be accumulated one block at a time by :meth:`kgpy.optics.System.raytrace_reduce`.
+"""
+
+import abc
+import dataclasses
+import typing as typ
+import numpy as np
+import scipy.sparse
+import astropy.units as u
+import kgpy.vector
+from kgpy.vector import x, y
+from .. import Rays
+
+__all__ = ['Reducer', 'Centroid', 'Bounds', 'PupilHistogram', 'TransferMatrix']
+
+
+@dataclasses.dataclass
+class Reducer(abc.ABC):
+    use_vignetted: bool = False
+
+    def mask(self, rays: Rays) -> np.ndarray:
+        if self.use_vignetted:
+            mask = rays.error_mask & rays.field_mask
+        else:
+            mask = rays.mask
+        return np.broadcast_to(mask, rays.grid_shape)
+
+    @abc.abstractmethod
+    def reduce(self, rays: Rays, index: typ.Tuple[slice, ...], grid_shape: typ.Tuple[int, ...]) -> typ.NoReturn:
+        """
+        Accumulate a block of rays into this reduction.
+
+        :param rays: The rays in the current block.
+        :param index: Index of the block along the wavelength, field x, field y, pupil x and pupil y axes of the ray
+            grid.
+        :param grid_shape: Shape of the complete ray grid, including any configuration axes.
+        """
+        pass
+
+    @property
+    @abc.abstractmethod
+    def result(self):
+        pass
+
+
+@dataclasses.dataclass
+class Centroid(Reducer):
+    """
+    Mean position of the rays at each configuration, wavelength and field position.
+    """
+
+    def __post_init__(self):
+        self._sum = None
+        self._count = None
+        self._unit = None
+
+    def reduce(self, rays: Rays, index: typ.Tuple[slice, ...], grid_shape: typ.Tuple[int, ...]) -> typ.NoReturn:
+        if self._sum is None:
+            self._sum = np.zeros(grid_shape[:~1] + (3, ))
+            self._count = np.zeros(grid_shape[:~1] + (1, ))
+            self._unit = rays.position.unit
+        mask = self.mask(rays)[..., np.newaxis]
+        position = np.where(mask, rays.position.to_value(self._unit), 0)
+        i = (..., ) + index[:~1] + (slice(None), )
+        self._sum[i] += position.sum(axis=(~2, ~1))
+        self._count[i] += mask.sum(axis=(~2, ~1))
+
+    @property
+    def result(self) -> u.Quantity:
+        with np.errstate(invalid='ignore'):
+            return self._sum / self._count << self._unit
+
+
+@dataclasses.dataclass
+class Bounds(Reducer):
+    """
+    Minimum and maximum position of the rays in each configuration, the footprint of the beam on a surface.
+    """
+
+    def __post_init__(self):
+        self._min = None
+        self._max = None
+        self._unit = None
+
+    def reduce(self, rays: Rays, index: typ.Tuple[slice, ...], grid_shape: typ.Tuple[int, ...]) -> typ.NoReturn:
+        num_grid_axes = len(index)
+        if self._min is None:
+            self._min = np.full(grid_shape[:~(num_grid_axes - 1)] + (3, ), np.inf)
+            self._max = np.full(grid_shape[:~(num_grid_axes - 1)] + (3, ), -np.inf)
+            self._unit = rays.position.unit
+        mask = self.mask(rays)[..., np.newaxis]
+        position = rays.position.to_value(self._unit)
+        axis = tuple(~np.arange(num_grid_axes) - 1)
+        self._min = np.minimum(self._min, np.where(mask, position, np.inf).min(axis=axis))
+        self._max = np.maximum(self._max, np.where(mask, position, -np.inf).max(axis=axis))
+
+    @property
+    def result(self) -> typ.Tuple[u.Quantity, u.Quantity]:
+        return self._min << self._unit, self._max << self._unit
+
+
+@dataclasses.dataclass
+class PupilHistogram(Reducer):
+    """
+    Two-dimensional histogram of the ray positions over the pupil at each configuration, wavelength and field
+    position, the streaming equivalent of :meth:`kgpy.optics.Rays.pupil_hist2d`.
+    Since the bins cannot be adjusted after the first block is seen, the limits of the histogram must be provided.
+    """
+    bins: typ.Union[int, typ.Tuple[int, int]] = 10
+    limits: typ.Tuple[typ.Tuple[u.Quantity, u.Quantity], typ.Tuple[u.Quantity, u.Quantity]] = (
+        (-1 * u.mm, 1 * u.mm),
+        (-1 * u.mm, 1 * u.mm),
+    )
+
+    def __post_init__(self):
+        if isinstance(self.bins, int):
+            self.bins = (self.bins, self.bins)
+        self._hist = None
+        self._unit = None
+
+    def reduce(self, rays: Rays, index: typ.Tuple[slice, ...], grid_shape: typ.Tuple[int, ...]) -> typ.NoReturn:
+        if self._hist is None:
+            self._hist = np.zeros(grid_shape[:~1] + self.bins)
+            self._unit = rays.position.unit
+        limits = tuple((lmin.to_value(self._unit), lmax.to_value(self._unit)) for lmin, lmax in self.limits)
+        hist, _, _ = rays.pupil_hist2d(bins=self.bins, limits=limits, use_vignetted=self.use_vignetted)
+        self._hist[(..., ) + index[:~1] + (slice(None), slice(None))] += hist
+
+    @property
+    def edges_x(self) -> u.Quantity:
+        return np.linspace(*self.limits[kgpy.vector.ix], self.bins[kgpy.vector.ix] + 1)
+
+    @property
+    def edges_y(self) -> u.Quantity:
+        return np.linspace(*self.limits[kgpy.vector.iy], self.bins[kgpy.vector.iy] + 1)
+
+    @property
+    def result(self) -> typ.Tuple[np.ndarray, u.Quantity, u.Quantity]:
+        return self._hist, self.edges_x, self.edges_y
+
+
+@dataclasses.dataclass
+class TransferMatrix(Reducer):
+    """
+    Sparse matrix mapping every wavelength and field position of the ray grid, a voxel of a spectral cube, to the
+    pixels of a detector on the final surface, so that a detector image can be simulated with a single sparse
+    matrix-vector product.
+
+    Each element is the fraction of the light from a voxel that lands on a pixel: the total weight of the rays of the
+    voxel that land on the pixel, divided by the total weight of every ray of the voxel inside the field mask.
+    The rows are ordered by configuration, then pixel :math:`x`, then pixel :math:`y`, and the columns are ordered by
+    wavelength, field :math:`x`, then field :math:`y`, the order of :func:`numpy.ravel` for each set of axes.
+    """
+    bins: typ.Union[int, typ.Tuple[int, int]] = 10
+    limits: typ.Tuple[typ.Tuple[u.Quantity, u.Quantity], typ.Tuple[u.Quantity, u.Quantity]] = (
+        (-1 * u.mm, 1 * u.mm),
+        (-1 * u.mm, 1 * u.mm),
+    )
+
+    def __post_init__(self):
+        if isinstance(self.bins, int):
+            self.bins = (self.bins, self.bins)
+        self._shape = None
+        self._rows = []
+        self._columns = []
+        self._data = []
+        self._total = None
+        self._config_shape = None
+        self._voxel_shape = None
+        self._unit = None
+
+    def reduce(self, rays: Rays, index: typ.Tuple[slice, ...], grid_shape: typ.Tuple[int, ...]) -> typ.NoReturn:
+        num_x, num_y = self.bins
+        num_grid_axes = len(index)
+        if self._shape is None:
+            self._config_shape = grid_shape[:~(num_grid_axes - 1)]
+            self._voxel_shape = grid_shape[~(num_grid_axes - 1):~1]
+            num_pixels = int(np.prod(self._config_shape)) * num_x * num_y
+            self._shape = num_pixels, int(np.prod(self._voxel_shape))
+            self._total = np.zeros(self._config_shape + self._voxel_shape)
+            self._unit = rays.position.unit
+
+        weight = np.broadcast_to(rays.weight, rays.grid_shape)
+        field_mask = np.broadcast_to(rays.field_mask, rays.grid_shape)
+        self._total[(..., ) + index[:~1]] += np.sum(weight * field_mask, axis=(~1, ~0))
+
+        def bin_index(p: u.Quantity, limits: typ.Tuple[u.Quantity, u.Quantity], num: int):
+            p = np.broadcast_to(p.to_value(self._unit), rays.grid_shape)
+            lmin, lmax = (lim.to_value(self._unit) for lim in limits)
+            with np.errstate(invalid='ignore'):
+                t = (p - lmin) / (lmax - lmin) * num
+                is_inside = (t >= 0) & (t <= num)
+            return np.minimum(np.floor(np.where(is_inside, t, 0)).astype(int), num - 1), is_inside
+
+        pixel_x, is_inside_x = bin_index(rays.position[x], self.limits[kgpy.vector.ix], num_x)
+        pixel_y, is_inside_y = bin_index(rays.position[y], self.limits[kgpy.vector.iy], num_y)
+        is_valid = self.mask(rays) & is_inside_x & is_inside_y
+
+        config = np.arange(int(np.prod(self._config_shape))).reshape(self._config_shape)
+        config = np.expand_dims(config, tuple(range(config.ndim, config.ndim + num_grid_axes)))
+        voxel = np.arange(int(np.prod(self._voxel_shape))).reshape(self._voxel_shape)[index[:~1]]
+        voxel = np.expand_dims(voxel, (~1, ~0))
+
+        # The elements of each block are only collected here, the matrix is assembled once by :meth:`_accumulated`.
+        row = (config * num_x + pixel_x) * num_y + pixel_y
+        column = np.broadcast_to(voxel, row.shape)
+        self._rows.append(row[is_valid])
+        self._columns.append(column[is_valid])
+        self._data.append(weight[is_valid])
+
+    def _accumulated(self) -> scipy.sparse.coo_matrix:
+        """
+        Total weight of the rays of each voxel that land on each pixel, assembled from every block seen so far.
+        The collected elements are replaced by the assembled matrix, so it is not assembled again by later calls.
+        """
+        matrix = scipy.sparse.coo_matrix(
+            (np.concatenate(self._data), (np.concatenate(self._rows), np.concatenate(self._columns))),
+            shape=self._shape,
+        )
+        matrix.sum_duplicates()
+        self._rows, self._columns, self._data = [matrix.row], [matrix.col], [matrix.data]
+        return matrix
+
+    @property
+    def edges_x(self) -> u.Quantity:
+        return np.linspace(*self.limits[kgpy.vector.ix], self.bins[kgpy.vector.ix] + 1)
+
+    @property
+    def edges_y(self) -> u.Quantity:
+        return np.linspace(*self.limits[kgpy.vector.iy], self.bins[kgpy.vector.iy] + 1)
+
+    @property
+    def matrix(self) -> scipy.sparse.csr_matrix:
+        matrix = self._accumulated()
+        num_pixels = self.bins[kgpy.vector.ix] * self.bins[kgpy.vector.iy]
+        total = self._total.reshape(-1, matrix.shape[~0])
+        total = total[matrix.row // num_pixels, matrix.col]
+        data = np.divide(matrix.data, total, out=np.zeros_like(matrix.data), where=total > 0)
+        return scipy.sparse.csr_matrix((data, (matrix.row, matrix.col)), shape=matrix.shape)
+
+    @property
+    def result(self) -> typ.Tuple[scipy.sparse.csr_matrix, u.Quantity, u.Quantity]:
+        return self.matrix, self.edges_x, self.edges_y
+
+    def forward(self, cube: np.ndarray, matrix: typ.Optional[scipy.sparse.csr_matrix] = None) -> np.ndarray:
+        """
+        Simulate the detector image of a spectral cube.
+
+        :param cube: Intensity of every voxel, with the wavelength, field :math:`x` and field :math:`y` axes of the ray
+            grid last.
+        :param matrix: The result of :attr:`matrix`, which is recomputed if :code:`None`.
+        :return: The detector image of every configuration, with the configuration axes, then the pixel :math:`x` and
+            pixel :math:`y` axes.
+        """
+        if matrix is None:
+            matrix = self.matrix
+        num_voxel_axes = len(self._voxel_shape)
+        base_shape = cube.shape[:cube.ndim - num_voxel_axes]
+        image = (matrix @ cube.reshape((-1, matrix.shape[~0])).T).T
+        return image.reshape(base_shape + self._config_shape + self.bins)
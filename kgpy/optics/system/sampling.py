@@ -0,0 +1,381 @@
+"""
+Strategies for choosing the field angles and pupil positions of the rays launched by :class:`kgpy.optics.System`.
+"""
+
+import abc
+import dataclasses
+import typing as typ
+import numpy as np
+import astropy.units as u
+import kgpy
+from kgpy.vector import x, y
+from .. import aperture
+
+__all__ = ['Sampler', 'Grid', 'Random', 'Stratified', 'Halton', 'Sobol', 'Points', 'Cells']
+
+
+@dataclasses.dataclass
+class Sampler(abc.ABC):
+    """
+    Distribution of a two-dimensional grid of samples over a rectangle.
+
+    Every sampler fills the same :math:`n_x \\times n_y` grid of rays, so the axes of :class:`kgpy.optics.Rays` are
+    unchanged, but only :class:`Grid` places the samples on a rectangular grid.
+    The others place each sample independently, so the two axes are only indices.
+    """
+
+    conform: bool = False       # Map the samples onto the disk inscribed in a circular aperture.
+
+    num_grid_axes = 2           # Number of trailing axes of the ray grid that the samples depend on.
+
+    @abc.abstractmethod
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        """
+        Samples of the unit square.
+
+        :param num: Number of samples along the :math:`x` and :math:`y` axes of the grid.
+        :return: The :math:`x` and :math:`y` coordinates of each sample, two arrays between zero and one that
+            broadcast to the shape `num`.
+        """
+        pass
+
+    def _expand(self, a: u.Quantity) -> u.Quantity:
+        """
+        Add the trailing grid axes of the samples to a parameter with only configuration axes, such as the bounds of
+        an aperture.
+        """
+        return a[(..., ) + (np.newaxis, ) * self.num_grid_axes]
+
+    @property
+    def is_separable(self) -> bool:
+        """
+        :code:`True` if the :math:`x` coordinate of the samples only depends on the first axis of the grid and the
+        :math:`y` coordinate only on the second axis.
+        """
+        return False
+
+    def sample(self, start: u.Quantity, stop: u.Quantity, num: typ.Tuple[int, int]) -> typ.Tuple[u.Quantity, u.Quantity]:
+        """
+        Samples of the rectangle between two corners.
+
+        :param start: Vector to the lower-left corner of the rectangle.
+        :param stop: Vector to the upper-right corner of the rectangle.
+        :param num: Number of samples along the :math:`x` and :math:`y` axes of the grid.
+        :return: The :math:`x` and :math:`y` coordinates of each sample, with :attr:`num_grid_axes` extra axes after
+            the broadcast shape of `start` and `stop`.
+        """
+        ux, uy = self.unit_square(num)
+        ux, uy = np.broadcast_arrays(ux, uy)
+        start_x, start_y = self._expand(start[x]), self._expand(start[y])
+        stop_x, stop_y = self._expand(stop[x]), self._expand(stop[y])
+        return start_x + ux * (stop_x - start_x), start_y + uy * (stop_y - start_y)
+
+    def sample_aperture(
+            self,
+            aper: aperture.Aperture,
+            num: typ.Tuple[int, int],
+            margin: u.Quantity = 0 * u.mm,
+    ) -> typ.Tuple[u.Quantity, u.Quantity, np.ndarray]:
+        """
+        Samples of the area inside an aperture.
+
+        The samples cover the bounding box of the aperture, shrunk by `margin`, unless :attr:`conform` is set and the
+        aperture is circular, in which case they are mapped onto the disk using the concentric map of Shirley and Chiu,
+        which preserves the relative area of each sample, so no rays are wasted outside the aperture.
+
+        :param aper: The aperture to sample.
+        :param num: Number of samples along the :math:`x` and :math:`y` axes of the grid.
+        :param margin: Distance to keep between the samples and the edge of the aperture.
+        :return: The :math:`x` and :math:`y` coordinates of each sample, and the weight of each sample, its area
+            relative to the area of a sample distributed uniformly over the bounding box.
+        """
+        amin, amax = aper.min, aper.max
+        if self.conform and isinstance(aper, aperture.Circular) and not aper.is_obscuration:
+            ux, uy = self.unit_square(num)
+            ux, uy = np.broadcast_arrays(ux, uy)
+            a, b = 2 * ux - 1, 2 * uy - 1
+            is_x = np.abs(a) > np.abs(b)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r = np.where(is_x, a, b)
+                phi = np.where(is_x, np.pi / 4 * b / a, np.pi / 2 - np.pi / 4 * a / b)
+            phi = np.where(r == 0, 0, phi)
+            radius = self._expand(aper.radius - margin)
+            center = (amin + amax) / 2
+            px = self._expand(center[x]) + radius * r * np.cos(phi)
+            py = self._expand(center[y]) + radius * r * np.sin(phi)
+            weight = np.pi / 4
+        else:
+            px, py = self.sample(amin + margin, amax - margin, num)
+            weight = 1
+        px, py = np.broadcast_arrays(px, py, subok=True)
+        return px, py, np.full(px.shape, weight, dtype=float)
+
+
+@dataclasses.dataclass
+class Grid(Sampler):
+    """
+    Rectangular grid of evenly-spaced samples, including the edges of the rectangle.
+    """
+
+    @property
+    def is_separable(self) -> bool:
+        return not self.conform
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        ux = kgpy.linspace(0, 1, num[0])
+        uy = kgpy.linspace(0, 1, num[1])
+        return ux[:, np.newaxis], uy[np.newaxis, :]
+
+
+@dataclasses.dataclass
+class Random(Sampler):
+    """
+    Independent, uniformly-distributed random samples.
+    """
+
+    seed: typ.Optional[int] = 0
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(self.seed)
+        return rng.random(num), rng.random(num)
+
+
+@dataclasses.dataclass
+class Stratified(Sampler):
+    """
+    One uniformly-distributed random sample inside each cell of a rectangular grid, also known as jittered sampling.
+    """
+
+    seed: typ.Optional[int] = 0
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(self.seed)
+        ix = np.arange(num[0])[:, np.newaxis]
+        iy = np.arange(num[1])[np.newaxis, :]
+        return (ix + rng.random(num)) / num[0], (iy + rng.random(num)) / num[1]
+
+
+def _radical_inverse(index: np.ndarray, base: int) -> np.ndarray:
+    """
+    Reflect the digits of each index in the given base about the radix point.
+    """
+    index = index.copy()
+    result = np.zeros(index.shape)
+    scale = 1 / base
+    while np.any(index > 0):
+        result += (index % base) * scale
+        index //= base
+        scale /= base
+    return result
+
+
+@dataclasses.dataclass
+class Halton(Sampler):
+    """
+    Halton low-discrepancy sequence in bases 2 and 3, filling the grid in row-major order.
+    The first point of the sequence, the corner at the origin, is skipped.
+    """
+
+    seed: typ.Optional[int] = None      # If not :code:`None`, randomize the sequence with a random shift modulo one.
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        index = np.arange(1, num[0] * num[1] + 1)
+        ux = _radical_inverse(index, 2)
+        uy = _radical_inverse(index, 3)
+        if self.seed is not None:
+            shift = np.random.default_rng(self.seed).random(2)
+            ux, uy = (ux + shift[0]) % 1, (uy + shift[1]) % 1
+        return ux.reshape(num), uy.reshape(num)
+
+
+@dataclasses.dataclass
+class Sobol(Sampler):
+    """
+    Two-dimensional Sobol low-discrepancy sequence, filling the grid in row-major order.
+    The best uniformity is reached when the total number of samples is a power of two.
+    """
+
+    seed: typ.Optional[int] = None      # If not :code:`None`, randomize the sequence with a random digital shift.
+
+    num_bits = 32
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        index = np.arange(num[0] * num[1], dtype=np.uint64)
+        bits = np.arange(self.num_bits, dtype=np.uint64)
+
+        # The direction numbers of the first dimension are those of the van der Corput sequence, and those of the
+        # second dimension are generated by the primitive polynomial x + 1.
+        m = np.ones(self.num_bits, dtype=np.uint64)
+        for k in range(1, self.num_bits):
+            m[k] = (m[k - 1] << np.uint64(1)) ^ m[k - 1]
+        shift = np.uint64(self.num_bits - 1) - bits
+        v = np.stack([np.uint64(1) << shift, (m << shift) & np.uint64(2 ** self.num_bits - 1)])
+
+        # Gray-code order, so each point differs from the previous one by a single direction number.
+        gray = index ^ (index >> np.uint64(1))
+        points = np.zeros((2, ) + index.shape, dtype=np.uint64)
+        for b in bits:
+            is_set = ((gray >> b) & np.uint64(1)).astype(bool)
+            points ^= np.where(is_set, v[:, b, np.newaxis], np.uint64(0))
+
+        if self.seed is not None:
+            shift = np.random.default_rng(self.seed).integers(2 ** self.num_bits, size=2, dtype=np.uint64)
+            points = points ^ shift[:, np.newaxis]
+
+        ux, uy = points / 2 ** self.num_bits
+        return ux.reshape(num), uy.reshape(num)
+
+
+@dataclasses.dataclass
+class Points(Sampler):
+    """
+    Explicit samples of the unit square, which may be different for every wavelength and field angle of the ray grid.
+    Used by :meth:`kgpy.optics.System.raytrace_adaptive` to place the refined rays.
+    """
+
+    unit_x: np.ndarray = None       # :math:`x` coordinate of each sample, the last five axes are the ray grid axes.
+    unit_y: np.ndarray = None       # :math:`y` coordinate of each sample, with the same layout as :attr:`unit_x`.
+    weight: np.ndarray = 1          # Weight of each sample relative to a sample of a uniform grid.
+
+    num_grid_axes = 5
+
+    def unit_square(self, num: typ.Tuple[int, int]) -> typ.Tuple[np.ndarray, np.ndarray]:
+        return self.unit_x, self.unit_y
+
+    def sample_aperture(
+            self,
+            aper: aperture.Aperture,
+            num: typ.Tuple[int, int],
+            margin: u.Quantity = 0 * u.mm,
+    ) -> typ.Tuple[u.Quantity, u.Quantity, np.ndarray]:
+        px, py, weight = super().sample_aperture(aper, num, margin)
+        return px, py, weight * self.weight
+
+
+@dataclasses.dataclass
+class Cells:
+    """
+    Collection of rectangular cells of the unit square, stored along the last axis of each array.
+    Every index of the leading axes has its own cells, and the inactive cells only pad the last axis to a common length.
+    """
+
+    x: np.ndarray               # :math:`x` coordinate of the lower-left corner of each cell.
+    y: np.ndarray               # :math:`y` coordinate of the lower-left corner of each cell.
+    width_x: np.ndarray         # Width of each cell in the :math:`x` direction.
+    width_y: np.ndarray         # Width of each cell in the :math:`y` direction.
+    is_active: np.ndarray
+
+    @classmethod
+    def select(
+            cls,
+            x: np.ndarray,
+            y: np.ndarray,
+            width_x: np.ndarray,
+            width_y: np.ndarray,
+            is_selected: np.ndarray,
+    ) -> 'Cells':
+        """
+        Gather the selected cells to the front of the last axis, and drop the trailing cells that are not selected
+        anywhere.
+        """
+        x, y, width_x, width_y, is_selected = np.broadcast_arrays(x, y, width_x, width_y, is_selected)
+        num = np.count_nonzero(is_selected, axis=~0).max(initial=0)
+        order = np.argsort(~is_selected, axis=~0, kind='stable')[..., :num]
+        x, y, width_x, width_y, is_selected = [
+            np.take_along_axis(a, order, axis=~0) for a in (x, y, width_x, width_y, is_selected)
+        ]
+        return cls(x=x, y=y, width_x=width_x, width_y=width_y, is_active=is_selected)
+
+    @classmethod
+    def from_grid(cls, mask: np.ndarray) -> typ.Tuple['Cells', np.ndarray]:
+        """
+        Find the cells of a :class:`Grid` whose corners do not all have the same mask.
+
+        :param mask: Mask of each sample of the grid, the last two axes are the :math:`x` and :math:`y` axes.
+        :return: The cells whose corners disagree, and the area of the unit square represented by each sample,
+            a quarter of each neighbouring cell whose corners agree.
+        """
+        num_x, num_y = mask.shape[~1:]
+        corners = [mask[..., :-1, :-1], mask[..., 1:, :-1], mask[..., :-1, 1:], mask[..., 1:, 1:]]
+        is_edge = (corners[1] != corners[0]) | (corners[2] != corners[0]) | (corners[3] != corners[0])
+
+        width_x, width_y = 1 / (num_x - 1), 1 / (num_y - 1)
+        quarter = np.where(is_edge, 0, width_x * width_y / 4)
+        area = np.zeros(mask.shape)
+        area[..., :-1, :-1] += quarter
+        area[..., 1:, :-1] += quarter
+        area[..., :-1, 1:] += quarter
+        area[..., 1:, 1:] += quarter
+
+        x = np.arange(num_x - 1)[:, np.newaxis] * width_x
+        y = np.arange(num_y - 1)[np.newaxis, :] * width_y
+        x, y, is_edge = np.broadcast_arrays(x, y, is_edge)
+        shape = is_edge.shape[:~1] + (-1, )
+        cells = cls.select(x.reshape(shape), y.reshape(shape), width_x, width_y, is_edge.reshape(shape))
+        return cells, area
+
+    def subdivide(self, num: int) -> typ.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Split each cell into a :math:`n \\times n` grid of subcells.
+
+        :param num: Number of subcells along each side of a cell.
+        :return: The :math:`x` and :math:`y` coordinates of the center of each subcell and its area, or zero for the
+            subcells of inactive cells, with an extra axis of length :math:`n^2` after the cell axis.
+        """
+        t = (np.arange(num) + 0.5) / num
+        ux = self.x[..., np.newaxis, np.newaxis] + self.width_x[..., np.newaxis, np.newaxis] * t[:, np.newaxis]
+        uy = self.y[..., np.newaxis, np.newaxis] + self.width_y[..., np.newaxis, np.newaxis] * t
+        area = np.where(self.is_active, self.width_x * self.width_y / num ** 2, 0)[..., np.newaxis, np.newaxis]
+        ux, uy, area = np.broadcast_arrays(ux, uy, area)
+        shape = self.x.shape + (num * num, )
+        return ux.reshape(shape), uy.reshape(shape), area.reshape(shape)
+
+    def refine(self, mask: np.ndarray, num: int) -> typ.Tuple['Cells', np.ndarray]:
+        """
+        Find the subcells from :meth:`subdivide` whose mask is different from one of their neighbours, including the
+        neighbours in other cells.
+        The unit square is surrounded by vignetted samples, so the edge of the beam is also found where it only grazes
+        the edge of the unit square, since the centers of the subcells along that edge would otherwise all agree.
+
+        :param mask: Mask of the sample at the center of each subcell, in the layout returned by :meth:`subdivide`.
+        :param num: Number of subcells along each side of a cell.
+        :return: The subcells that should be refined, and whether each subcell was selected.
+        """
+        ux, uy, _ = self.subdivide(num)
+        ux, uy, mask, is_active = np.broadcast_arrays(ux, uy, mask, self.is_active[..., np.newaxis])
+        width_x = np.broadcast_to(self.width_x[..., np.newaxis] / num, ux.shape)
+        width_y = np.broadcast_to(self.width_y[..., np.newaxis] / num, uy.shape)
+
+        # Every subcell has the same size, so each one is a sample of a fine grid covering the unit square, and the
+        # neighbours are found by sorting the index of each active subcell within this grid.
+        num_x, num_y = np.rint(1 / width_x).astype(int), np.rint(1 / width_y).astype(int)
+        ix, iy = np.floor(ux / width_x).astype(int), np.floor(uy / width_y).astype(int)
+        shape = (-1, ux.shape[~1] * ux.shape[~0])
+        ix, iy, num_x, num_y, mask, is_active = [a.reshape(shape) for a in (ix, iy, num_x, num_y, mask, is_active)]
+        offset = np.arange(ix.shape[0])[:, np.newaxis] * int((num_x * num_y).max(initial=1))
+        keys = offset + ix * num_y + iy
+        order = np.argsort(keys[is_active], kind='stable')
+        keys_sorted = keys[is_active][order]
+        mask_sorted = mask[is_active][order]
+
+        is_edge = np.zeros(mask.shape, dtype=bool)
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            jx, jy = ix + dx, iy + dy
+            is_outside = (jx < 0) | (jx >= num_x) | (jy < 0) | (jy >= num_y)
+            is_edge |= is_outside & mask
+            if keys_sorted.size > 0:
+                keys_neighbour = offset + jx * num_y + jy
+                i = np.minimum(np.searchsorted(keys_sorted, keys_neighbour), keys_sorted.size - 1)
+                is_sampled = ~is_outside & (keys_sorted[i] == keys_neighbour)
+                is_edge |= is_sampled & (mask_sorted[i] != mask)
+        is_edge = is_edge.reshape(ux.shape) & is_active.reshape(ux.shape)
+
+        shape = is_edge.shape[:~1] + (-1, )
+        cells = type(self).select(
+            x=(ux - width_x / 2).reshape(shape),
+            y=(uy - width_y / 2).reshape(shape),
+            width_x=width_x.reshape(shape),
+            width_y=width_y.reshape(shape),
+            is_selected=is_edge.reshape(shape),
+        )
+        return cells, is_edge
@@ -0,0 +1,258 @@
+"""
+Polynomial models of the mapping from the inputs of a raytrace to the rays on the image surface, for forward models that
+need many more rays than can be traced directly.
+"""
+
+import itertools
+import json
+import os
+import pathlib
+import dataclasses
+import typing as typ
+import numpy as np
+import numpy.polynomial.chebyshev
+import astropy.units as u
+from kgpy.vector import x, y
+from .. import Rays
+
+__all__ = ['Surrogate']
+
+format_version = 1
+
+input_names = ['wavelength', 'field_x', 'field_y', 'pupil_x', 'pupil_y']
+
+
+@dataclasses.dataclass
+class Surrogate:
+    """
+    Chebyshev polynomial model of the position, and optionally the direction, of the rays on the image surface of a
+    system as a function of their wavelength, field angle and position on the stop.
+
+    Each input is scaled to the interval :math:`[-1, 1]` using the range of the rays it was fitted to, and the model is
+    a sum of products of Chebyshev polynomials of the inputs, one for each row of :attr:`exponents`.
+    A separate set of coefficients is fitted to every configuration of the system.
+    """
+
+    exponents: np.ndarray                   # Degree of each input in each term, shape `(num_terms, 5)`.
+    input_min: typ.List[u.Quantity]         # Lower bound of the range of each input.
+    input_max: typ.List[u.Quantity]         # Upper bound of the range of each input.
+    position_coefficients: u.Quantity       # Coefficients of the x and y components, shape `(..., num_terms, 2)`.
+    position_residual_rms: u.Quantity       # RMS of the fit residual of each component.
+    position_residual_max: u.Quantity       # Maximum absolute fit residual of each component.
+    direction_coefficients: typ.Optional[u.Quantity] = None
+    direction_residual_rms: typ.Optional[u.Quantity] = None
+    direction_residual_max: typ.Optional[u.Quantity] = None
+
+    chunk_size = 2 ** 16        # Number of samples evaluated at once, to bound the size of the basis matrix.
+
+    @staticmethod
+    def calc_exponents(degree: int, is_constant: typ.Sequence[bool]) -> np.ndarray:
+        """
+        Exponents of every term with total degree no greater than `degree`, omitting the inputs that are constant.
+        """
+        ranges = [range(1) if c else range(degree + 1) for c in is_constant]
+        exponents = [e for e in itertools.product(*ranges) if sum(e) <= degree]
+        return np.array(exponents, dtype=int).reshape(-1, len(ranges))
+
+    @classmethod
+    def from_system(
+            cls,
+            system: 'kgpy.optics.System',
+            degree: int = 4,
+            include_direction: bool = False,
+    ) -> 'Surrogate':
+        """
+        Fit a model to the unvignetted rays of :attr:`kgpy.optics.System.image_rays`.
+
+        :param system: The system to model, the coarse grid of rays is set by its sampling parameters.
+        :param degree: Maximum total degree of each term.
+        :param include_direction: Also fit the direction of the rays.
+        :return: The fitted model, with the residuals of the fit.
+        """
+        rays = system.image_rays
+        field = system.field_points
+        pupil_x, pupil_y, _ = system.pupil_points(system.stop_surface)
+        inputs = [
+            np.broadcast_to(rays.wavelength, rays.scalar_grid_shape, subok=True)[..., 0],
+            np.expand_dims(field[x], (~4, ~1, ~0)),
+            np.expand_dims(field[y], (~4, ~1, ~0)),
+            np.expand_dims(pupil_x, (~4, ~3, ~2)),
+            np.expand_dims(pupil_y, (~4, ~3, ~2)),
+        ]
+        return cls.from_rays(rays, inputs, degree=degree, include_direction=include_direction)
+
+    @classmethod
+    def from_rays(
+            cls,
+            rays: Rays,
+            inputs: typ.List[u.Quantity],
+            degree: int = 4,
+            include_direction: bool = False,
+    ) -> 'Surrogate':
+        """
+        Fit a model to the unvignetted rays of a grid.
+
+        :param rays: Rays on the image surface.
+        :param inputs: Wavelength, field angles and stop position of each ray, each broadcastable to the grid of
+            `rays`.
+        :param degree: Maximum total degree of each term.
+        :param include_direction: Also fit the direction of the rays.
+        :return: The fitted model, with the residuals of the fit.
+        """
+        grid_shape = rays.grid_shape
+        mask = np.broadcast_to(rays.mask, grid_shape)
+        inputs = [np.broadcast_to(i, grid_shape, subok=True) for i in inputs]
+        input_min = [np.min(i[mask]) for i in inputs]
+        input_max = [np.max(i[mask]) for i in inputs]
+        exponents = cls.calc_exponents(degree, [i_min == i_max for i_min, i_max in zip(input_min, input_max)])
+
+        model = cls(
+            exponents=exponents,
+            input_min=input_min,
+            input_max=input_max,
+            position_coefficients=None,
+            position_residual_rms=None,
+            position_residual_max=None,
+        )
+        basis = model.basis(inputs)
+
+        def fit(target: u.Quantity) -> typ.Tuple[u.Quantity, u.Quantity, u.Quantity]:
+            target = np.broadcast_to(target, grid_shape + target.shape[~0:], subok=True)
+            unit = target.unit
+            config_shape = grid_shape[:~(rays.axis.ndim - 1)]
+            coefficients = np.zeros(config_shape + (len(exponents), target.shape[~0]))
+            residual_rms = np.zeros(config_shape + target.shape[~0:])
+            residual_max = np.zeros(config_shape + target.shape[~0:])
+            for c in np.ndindex(*config_shape):
+                m = mask[c]
+                a = basis[c][m]
+                b = target[c][m].to_value(unit)
+                coefficients[c] = np.linalg.lstsq(a, b, rcond=None)[0]
+                residual = b - a @ coefficients[c]
+                residual_rms[c] = np.sqrt(np.mean(np.square(residual), axis=0))
+                residual_max[c] = np.max(np.abs(residual), axis=0, initial=0)
+            return coefficients << unit, residual_rms << unit, residual_max << unit
+
+        model.position_coefficients, model.position_residual_rms, model.position_residual_max = fit(
+            rays.position[..., :2])
+        if include_direction:
+            model.direction_coefficients, model.direction_residual_rms, model.direction_residual_max = fit(
+                rays.direction[..., :2])
+        return model
+
+    def basis(self, inputs: typ.List[u.Quantity]) -> np.ndarray:
+        """
+        Value of every term of the model.
+
+        :param inputs: Wavelength, field angles and stop position of each sample, which must all have the same shape.
+        :return: Array with the shape of the inputs and an extra axis for the terms.
+        """
+        degree = int(self.exponents.max(initial=0))
+        result = 1
+        for i, (value, value_min, value_max) in enumerate(zip(inputs, self.input_min, self.input_max)):
+            width = value_max - value_min
+            width = np.where(width == 0, 1 * width.unit, width)
+            t = (2 * (value - value_min) / width - 1).to_value(u.dimensionless_unscaled)
+            result = result * numpy.polynomial.chebyshev.chebvander(t, degree)[..., self.exponents[:, i]]
+        return result
+
+    def _evaluate(self, coefficients: u.Quantity, inputs: typ.List[u.Quantity]) -> u.Quantity:
+        inputs = np.broadcast_arrays(*inputs, subok=True)
+        shape = inputs[0].shape
+        inputs = [i.reshape(-1) for i in inputs]
+        num = inputs[0].size
+        config_shape = coefficients.shape[:~1]
+        result = np.empty(config_shape + (num, coefficients.shape[~0]))
+        for start in range(0, num, self.chunk_size):
+            index = slice(start, start + self.chunk_size)
+            basis = self.basis([i[index] for i in inputs])
+            result[..., index, :] = np.einsum('nt,...to->...no', basis, coefficients.value)
+        return result.reshape(config_shape + shape + result.shape[~0:]) << coefficients.unit
+
+    def position(
+            self,
+            wavelength: u.Quantity,
+            field_x: u.Quantity,
+            field_y: u.Quantity,
+            pupil_x: u.Quantity,
+            pupil_y: u.Quantity,
+    ) -> u.Quantity:
+        """
+        Evaluate the model of the position of the rays on the image surface.
+
+        :param wavelength: Wavelength of each sample.
+        :param field_x: Field angle of each sample in the :math:`x` direction.
+        :param field_y: Field angle of each sample in the :math:`y` direction.
+        :param pupil_x: Position of each sample on the stop in the :math:`x` direction.
+        :param pupil_y: Position of each sample on the stop in the :math:`y` direction.
+        :return: The :math:`x` and :math:`y` components of the position of each sample, with the configuration axes
+            of the model first, then the broadcast shape of the inputs.
+        """
+        inputs = [wavelength, field_x, field_y, pupil_x, pupil_y]
+        return self._evaluate(self.position_coefficients, inputs)
+
+    def direction(
+            self,
+            wavelength: u.Quantity,
+            field_x: u.Quantity,
+            field_y: u.Quantity,
+            pupil_x: u.Quantity,
+            pupil_y: u.Quantity,
+    ) -> u.Quantity:
+        """
+        Evaluate the model of the direction of the rays on the image surface, in the same layout as :meth:`position`.
+        """
+        if self.direction_coefficients is None:
+            raise ValueError('The direction of the rays was not fitted, see include_direction')
+        inputs = [wavelength, field_x, field_y, pupil_x, pupil_y]
+        return self._evaluate(self.direction_coefficients, inputs)
+
+    def save(self, path: typ.Union[str, pathlib.Path]) -> typ.NoReturn:
+        """
+        Write the model to an uncompressed :func:`numpy.savez` archive, which can be read without pickle.
+
+        :param path: Path of the new file.
+        """
+        header = dict(format_version=format_version)
+        arrays = dict(header=np.array(json.dumps(header)), exponents=self.exponents)
+
+        def add(name: str, value: u.Quantity):
+            arrays[name] = value.value
+            arrays[name + '.unit'] = np.array(value.unit.to_string())
+
+        for name, value_min, value_max in zip(input_names, self.input_min, self.input_max):
+            add('input_min.' + name, value_min)
+            add('input_max.' + name, value_max)
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, u.Quantity):
+                add(field.name, value)
+
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: typ.Union[str, pathlib.Path, os.PathLike]) -> 'Surrogate':
+        """
+        Read a model written by :meth:`save`.
+
+        :param path: Path of the file.
+        """
+        with np.load(path, allow_pickle=False) as archive:
+            arrays = dict(archive)
+        header = json.loads(str(arrays.pop('header')))
+        if header['format_version'] != format_version:
+            raise ValueError('Unsupported surrogate format version ' + str(header['format_version']))
+
+        def get(name: str) -> u.Quantity:
+            return arrays[name] << u.Unit(str(arrays[name + '.unit']))
+
+        kwargs = dict(
+            exponents=arrays['exponents'],
+            input_min=[get('input_min.' + name) for name in input_names],
+            input_max=[get('input_max.' + name) for name in input_names],
+        )
+        for field in dataclasses.fields(cls):
+            if field.name not in kwargs and field.name in arrays:
+                kwargs[field.name] = get(field.name)
+        return cls(**kwargs)
@@ -1,6 +1,6 @@
 import dataclasses
+import concurrent.futures
 import pathlib
-import pickle
 import numpy as np
 import typing as typ
 import scipy.spatial.transform
@@ -15,7 +15,9 @@ import kgpy.linspace
 from kgpy.vector import x, y, z, ix, iy, iz, xy
 import kgpy.optimization.minimization
 import kgpy.optimization.root_finding
-from .. import ZemaxCompatible, Rays, material, surface, aperture
+from .. import ZemaxCompatible, Rays, unitless, material, surface, aperture
+from . import reducer, paraxial as paraxial_, cache, sampling, diffraction, plan, configurations
+from . import history as history_, vignetting as vignetting_
 
 __all__ = ['System']
 
@@ -39,8 +41,24 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
     field_max: typ.Optional[u.Quantity] = None
     field_samples: typ.Union[int, typ.Tuple[int, int]] = 3
     field_mask_func: typ.Callable[[u.Quantity, u.Quantity], np.ndarray] = default_field_mask_func
+    pupil_sampler: sampling.Sampler = dataclasses.field(default_factory=lambda: sampling.Grid())
+    field_sampler: sampling.Sampler = dataclasses.field(default_factory=lambda: sampling.Grid())
+    unitless_raytrace: bool = False
+    num_workers: int = 1
+    compaction_threshold: float = 0     # Compact the rays when fewer than this fraction are unmasked, 0 to disable.
+    ray_cache: typ.Optional[cache.RayCache] = None
+    history_recorder: history_.Recorder = dataclasses.field(default_factory=lambda: history_.Recorder())
+
+    bytes_per_ray = 512 * u.byte    # Estimated memory used to trace a single ray, including temporary arrays.
 
     def __post_init__(self):
+        self._input_rays = None
+        self._all_rays = None
+        self._fingerprints = None
+        self._cache_key = None
+        self._history = None
+        self._parent = None
+        self._config_rays = None
         self.update()
 
     def to_zemax(self) -> 'System':
@@ -112,8 +130,99 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
         return occ_shapes
 
     def update(self) -> typ.NoReturn:
-        self._input_rays = None
-        self._all_rays = None
+        """
+        Notify the system that it, or any of its surfaces, has been modified.
+        The cached rays are not discarded immediately.
+        Instead, the next time they are accessed, only the rays at and after the first surface that has changed are
+        retraced, and ray aiming is only repeated if a surface it depends on has changed.
+        """
+        self._is_cache_stale = True
+        self._surfaces_unitless = None
+        self._plan = None
+        self._history = None
+        self._global_transforms = None
+        self._paraxial = None
+
+    @property
+    def _settings_fingerprint(self) -> str:
+        settings = (
+            self.wavelengths, self.pupil_samples, self.pupil_margin,
+            self.field_min, self.field_max, self.field_samples, self.unitless_raytrace, self.compaction_threshold,
+            self.field_mask_func, self.pupil_sampler, self.field_sampler,
+            None if self.stop_surface is None else self.stop_surface.index(self),
+        )
+        return cache.fingerprint(settings)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Content hash of every parameter of the system and its surfaces that affects the traced rays, stable across
+        processes and sessions.
+        Used as the key of :attr:`ray_cache`.
+        """
+        return cache.fingerprint((self._settings_fingerprint, [cache.fingerprint(surf) for surf in self]))
+
+    def _validate_cache(self) -> typ.NoReturn:
+        """
+        Compare the current state of the system to the state when :meth:`update` was last processed, and discard the
+        cached rays that depend on anything that has changed.
+        Surfaces are compared using their fingerprint, see :func:`kgpy.optics.system.cache.fingerprint`.
+        If the rays are still incomplete afterwards, they are loaded from :attr:`ray_cache` if possible.
+        """
+        if not self._is_cache_stale:
+            return
+        self._is_cache_stale = False
+
+        surfaces = list(self)
+        try:
+            fingerprints = self._settings_fingerprint, [cache.fingerprint(surf) for surf in surfaces]
+        except TypeError:
+            fingerprints = None
+        fingerprints_old = self._fingerprints
+        self._fingerprints = fingerprints
+
+        if fingerprints is None or fingerprints_old is None:
+            changed = 0
+        else:
+            settings, surface_fingerprints = fingerprints
+            settings_old, surface_fingerprints_old = fingerprints_old
+            if settings != settings_old:
+                changed = 0
+            elif len(surface_fingerprints) != len(surface_fingerprints_old):
+                changed = 0
+            else:
+                changed = len(surfaces)
+                for i, (f, f_old) in enumerate(zip(surface_fingerprints, surface_fingerprints_old)):
+                    if f != f_old:
+                        changed = i
+                        break
+
+        aim_index = 0
+        for surf in self.test_stop_surfaces:
+            aim_index = surfaces.index(surf)
+            if surf is self.stop_surface:
+                break
+
+        if changed <= aim_index:
+            self._input_rays = None
+            self._all_rays = None
+        elif self._all_rays is not None and changed < len(self._all_rays):
+            self._all_rays = self._all_rays[:changed]
+
+        if self.ray_cache is None or fingerprints is None:
+            self._cache_key = None
+        else:
+            self._cache_key = cache.fingerprint(fingerprints)
+            if self._all_rays is None or len(self._all_rays) < len(surfaces):
+                rays = self.ray_cache.load(self._cache_key)
+                if rays is not None:
+                    self._input_rays = rays[0]
+                    self._all_rays = rays
+
+    def _save_cached_rays(self) -> typ.NoReturn:
+        if self._cache_key is not None:
+            rays = self._all_rays if self._all_rays is not None else [self._input_rays]
+            self.ray_cache.save(self._cache_key, rays)
 
     @property
     def standard_surfaces(self) -> typ.Iterator[surface.Standard]:
@@ -167,84 +276,275 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
         yield from self.object_surface
         yield from self.surfaces
 
+    def __getitem__(self, index: typ.Union[int, slice, configurations.Index]) -> 'System':
+        """
+        Copy of this system with only a subset of its configurations, so that ray aiming and tracing are only done for
+        those configurations.
+        The surfaces are copied using :func:`kgpy.optics.system.configurations.index_object`, so modifying the copy
+        does not modify this system.
+        If this system has already traced its rays, the copy starts with views into those rays instead of tracing its
+        own.
+        Otherwise the rays traced by the copy are merged back into this system, see :meth:`_merge_into_parent`, so that
+        tracing every configuration one copy at a time also completes the rays of this system.
+
+        :param index: An integer or a slice along each configuration axis.
+        :return: A new system with the selected configurations.
+        """
+        index = configurations.normalize(index)
+        memo = {}
+        other = dataclasses.replace(
+            self,
+            object_surface=configurations.index_object(self.object_surface, index, memo),
+            surfaces=configurations.index_object(self.surfaces, index, memo),
+            stop_surface=memo.get(id(self.stop_surface), self.stop_surface),
+        )
+
+        self._validate_cache()
+        other._validate_cache()
+
+        def config_slice(rays: Rays) -> Rays:
+            num_config_axes = len(rays.grid_shape) - rays.axis.ndim
+            return rays.config_slice(configurations.index_axes(rays.grid_shape[:num_config_axes], index))
+
+        if self._input_rays is not None and other._input_rays is None:
+            other._input_rays = config_slice(self._input_rays)
+            if self._all_rays is not None:
+                other._all_rays = [config_slice(r) for r in self._all_rays]
+        if self._fingerprints is not None and other._fingerprints is not None:
+            other._parent = self, index, self._fingerprints, other._fingerprints
+        return other
+
+    def _merge_into_parent(self) -> typ.NoReturn:
+        """
+        Copy the rays of a system returned by :meth:`__getitem__` into the system it was taken from, at the selected
+        configurations.
+        Nothing is merged if either system has been modified since the copy was made.
+        Once every configuration of the parent has been merged, the merged rays become the rays of the parent, so it
+        does not trace them again.
+        """
+        if self._parent is None:
+            return
+        parent, index, parent_fingerprints, fingerprints = self._parent
+        parent._validate_cache()
+        if parent._fingerprints != parent_fingerprints or self._fingerprints != fingerprints:
+            return
+        if parent._all_rays is not None and len(parent._all_rays) == len(list(parent)):
+            return
+
+        if parent._config_rays is None or parent._config_rays[0] != parent_fingerprints:
+            config_shape = configurations.shape([parent.object_surface, parent.surfaces])
+            parent._config_rays = parent_fingerprints, [None] * len(self._all_rays), np.zeros(config_shape, dtype=bool)
+        _, all_rays, is_traced = parent._config_rays
+
+        try:
+            config_index = configurations.index_axes(is_traced.shape, index)
+            grid_index = config_index + (slice(None), ) * Rays.axis.ndim
+            for i, rays in enumerate(self._all_rays):
+                if all_rays[i] is None:
+                    grid_shape = rays.grid_shape[len(rays.grid_shape) - Rays.axis.ndim:]
+                    all_rays[i] = rays.grid_empty(is_traced.shape + grid_shape)
+                all_rays[i].grid_assign(grid_index, rays)
+        except ValueError:
+            parent._config_rays = None
+            return
+        is_traced[config_index] = True
+
+        if np.all(is_traced):
+            parent._input_rays = all_rays[0]
+            parent._all_rays = all_rays
+            parent._config_rays = None
+            parent._save_cached_rays()
+
     @property
-    def field_x(self) -> u.Quantity:
-        return kgpy.linspace(self.field_min[x], self.field_max[x], self.field_samples_normalized[ix], axis=~0)
+    def grid_shape(self) -> typ.Tuple[int, ...]:
+        """
+        Number of samples along each axis of the ray grid, in the order wavelength, field x, field y, pupil x, pupil y.
+        """
+        return self.wavelengths.shape[~0:] + self.field_samples_normalized + self.pupil_samples_normalized
 
     @property
-    def field_y(self) -> u.Quantity:
-        return kgpy.linspace(self.field_min[y], self.field_max[y], self.field_samples_normalized[iy], axis=~0)
+    def surfaces_unitless(self) -> typ.List[surface.Surface]:
+        """
+        Copies of every surface in the system with all parameters converted to float64 in canonical units.
+        The raytrace kernel uses the equivalent :attr:`kgpy.optics.system.plan.TracePlan.stages` of :meth:`compile`.
+        """
+        if self._surfaces_unitless is None:
+            self._surfaces_unitless = unitless.to_value(list(self))
+        return self._surfaces_unitless
+
+    def compile(self) -> plan.TracePlan:
+        """
+        Immutable snapshot of the surfaces of this system that the raytrace kernel executes, with every coordinate
+        transform precomputed.
+        Cached until :meth:`update` is called, or until :attr:`unitless_raytrace` is changed.
+        """
+        if self._plan is None or self._plan.is_unitless != self.unitless_raytrace:
+            self._plan = plan.TracePlan.from_system(self)
+        return self._plan
+
+    @staticmethod
+    def _affine(func: typ.Callable[[u.Quantity], u.Quantity]) -> typ.Tuple[np.ndarray, u.Quantity]:
+        """
+        Find the rotation matrix and translation vector of an affine transformation by evaluating it at the origin and
+        at the end of each unit vector.
+        """
+        unit = u.mm
+        translation = func(kgpy.vector.from_components() << unit)
+        columns = [func(kgpy.vector.from_components(*np.eye(3)[i]) << unit) - translation for i in range(3)]
+        rotation = np.stack(np.broadcast_arrays(*columns, subok=True), axis=~0) / unit
+        return rotation.to_value(u.dimensionless_unscaled), translation
 
     @property
-    def pupil_x(self) -> u.Quantity:
-        aper = self.stop_surface.aperture
-        return kgpy.linspace(
-            start=aper.min[x] + self.pupil_margin,
-            stop=aper.max[x] - self.pupil_margin,
-            num=self.pupil_samples_normalized[ix],
-            axis=~0,
-        )
+    def global_transforms(self) -> typ.Dict[int, typ.Tuple[np.ndarray, u.Quantity]]:
+        """
+        Rotation matrix and translation vector of the composite transformation from the local coordinates of each
+        surface to global coordinates, for every configuration, keyed by the :func:`id` of the surface.
+        Computed once by accumulating the transformations of each surface in order, and cached until :meth:`update` is
+        called.
+        """
+        if self._global_transforms is None:
+            self._global_transforms = {}
+            rotation, translation = np.identity(3), kgpy.vector.from_components() << u.mm
+            for surf in self:
+                pre_rotation, pre_translation = self._affine(lambda a: surf.apply_pre_transforms(a))
+                self._global_transforms[id(surf)] = (
+                    rotation @ pre_rotation,
+                    kgpy.vector.matmul(rotation, pre_translation) + translation,
+                )
+                surf_rotation, surf_translation = self._affine(
+                    lambda a: surf.apply_post_transforms(surf.apply_pre_transforms(a))
+                )
+                translation = kgpy.vector.matmul(rotation, surf_translation) + translation
+                rotation = rotation @ surf_rotation
+        return self._global_transforms
 
     @property
-    def pupil_y(self) -> u.Quantity:
-        aper = self.stop_surface.aperture
-        return kgpy.linspace(
-            start=aper.min[y] + self.pupil_margin,
-            stop=aper.max[y] - self.pupil_margin,
-            num=self.pupil_samples_normalized[iy],
-            axis=~0,
-        )
+    def paraxial(self) -> paraxial_.Paraxial:
+        """
+        First-order model of this system, such as its focal length and pupils, computed without tracing any rays.
+        Cached until :meth:`update` is called.
+        """
+        if self._paraxial is None:
+            self._paraxial = paraxial_.Paraxial.from_system(self)
+        return self._paraxial
+
+    @property
+    def field_x(self) -> typ.Optional[u.Quantity]:
+        """
+        Field angles along the field :math:`x` axis of the ray grid, or :code:`None` if :attr:`field_sampler` does not
+        sample the field on a rectangular grid.
+        """
+        if self.field_sampler.is_separable:
+            return self.field_points[x][..., :, 0]
+
+    @property
+    def field_y(self) -> typ.Optional[u.Quantity]:
+        if self.field_sampler.is_separable:
+            return self.field_points[y][..., 0, :]
+
+    @property
+    def field_points(self) -> u.Quantity:
+        """
+        Field angles of every point on the field axes of the ray grid, a vector with the field :math:`x` and field
+        :math:`y` axes of the grid before the component axis.
+        """
+        fx, fy = self.field_sampler.sample(self.field_min, self.field_max, self.field_samples_normalized)
+        return kgpy.vector.from_components(fx, fy)
+
+    @property
+    def pupil_x(self) -> typ.Optional[u.Quantity]:
+        """
+        Positions on the stop along the pupil :math:`x` axis of the ray grid, or :code:`None` if :attr:`pupil_sampler`
+        does not sample the stop on a rectangular grid.
+        """
+        if self.pupil_sampler.is_separable:
+            return self.pupil_points(self.stop_surface)[0][..., :, 0]
+
+    @property
+    def pupil_y(self) -> typ.Optional[u.Quantity]:
+        if self.pupil_sampler.is_separable:
+            return self.pupil_points(self.stop_surface)[1][..., 0, :]
+
+    def pupil_points(self, surf: surface.Standard) -> typ.Tuple[u.Quantity, u.Quantity, np.ndarray]:
+        """
+        Target positions of the rays on a test stop, from :meth:`kgpy.optics.system.sampling.Sampler.sample_aperture`.
+
+        :param surf: A surface whose aperture is sampled.
+        :return: The :math:`x` and :math:`y` coordinates and the weight of every point on the pupil axes of the ray
+            grid.
+        """
+        return self.pupil_sampler.sample_aperture(surf.aperture, self.pupil_samples_normalized, self.pupil_margin)
 
     @property
     def input_rays(self):
+        self._validate_cache()
         if self._input_rays is None:
             self._input_rays = self._calc_input_rays()
+            self._save_cached_rays()
         return self._input_rays
 
     @property
     def all_rays(self):
+        self._validate_cache()
         if self._all_rays is None:
-            self._all_rays = self._calc_all_rays()
+            self._all_rays = [self.input_rays]
+        if len(self._all_rays) < len(list(self)):
+            self._all_rays = self._calc_all_rays(self._all_rays)
+            self._save_cached_rays()
+            self._merge_into_parent()
         return self._all_rays
 
-    def _calc_input_rays(self):
+    def _calc_input_rays(self, index: typ.Optional[typ.Tuple[slice, ...]] = None) -> Rays:
 
-        x_hat = np.array([1, 0])
-        y_hat = np.array([0, 1])
+        if index is None:
+            index = (slice(None), ) * len(self.grid_shape)
+        iw, ifx, ify, ipx, ipy = [(..., i) for i in index]
+
+        wavelengths = self.wavelengths[iw]
+        field_points = self.field_points[(..., ) + index[1:3] + (slice(None), )]
+        field_x, field_y = field_points[x], field_points[y]
+        input_grids = [self.wavelengths, self.field_x, self.field_y, self.pupil_x, self.pupil_y]
+        input_grids = [None if grid is None else grid[i] for grid, i in zip(input_grids, [iw, ifx, ify, ipx, ipy])]
 
         if np.isinf(self.object_surface.thickness).all():
 
-            position_guess = kgpy.vector.from_components(use_z=False) << u.mm
+            # The cached paraxial model gives the initial guess for ray aiming at each surface.
+            model = self.paraxial.wavelength_slice(index[Rays.axis.wavelength])
+            direction = Rays.from_field_samples(
+                wavelength_grid=wavelengths,
+                position=kgpy.vector.from_components() << u.mm,
+                field_x=field_x,
+                field_y=field_y,
+                field_mask_func=self.field_mask_func,
+            ).direction
+            slope = direction[xy] / direction[z][..., np.newaxis]
 
-            margin = self.pupil_margin
-            step_size = 1 * u.nm
-            step = step_size * x_hat + step_size * y_hat
+            num_grid_axes = self.pupil_sampler.num_grid_axes
+            pupil_index = (..., ) + index[len(index) - num_grid_axes:]
 
             for surf in self.test_stop_surfaces:
-                aper = surf.aperture
-                amin, amax = aper.min, aper.max
-                px = kgpy.linspace(amin[x] + margin, amax[x] - margin, self.pupil_samples_normalized[ix], axis=~0)
-                py = kgpy.linspace(amin[y] + margin, amax[y] - margin, self.pupil_samples_normalized[iy], axis=~0)
-                target_position = kgpy.vector.from_components(np.expand_dims(px, ~0), py)
+                px, py, weight = self.pupil_points(surf)
+                target_position = kgpy.vector.from_components(px[pupil_index], py[pupil_index])
 
-                def position_error(pos: u.Quantity) -> u.Quantity:
+                def position_error(pos: u.Quantity) -> typ.Tuple[u.Quantity, u.Quantity]:
                     position = kgpy.vector.to_3d(pos)
-                    rays = Rays.from_field_angles(
-                        wavelength_grid=self.wavelengths,
+                    rays = Rays.from_field_samples(
+                        wavelength_grid=wavelengths,
                         position=position,
-                        field_grid_x=self.field_x,
-                        field_grid_y=self.field_y,
+                        field_x=field_x,
+                        field_y=field_y,
                         field_mask_func=self.field_mask_func,
-                        pupil_grid_x=self.pupil_x,
-                        pupil_grid_y=self.pupil_y,
+                        input_grids=input_grids,
                     )
-                    rays = self.raytrace_subsystem(rays, final_surface=surf)
-                    return (rays.position - target_position)[xy]
+                    rays = self.raytrace_subsystem(rays.init_jacobians(), final_surface=surf)
+                    return (rays.position - target_position)[xy], rays.position_jacobian[..., :iz, :]
 
-                position_guess = kgpy.optimization.root_finding.secant(
+                position_guess = model.launch_position(target_position[xy], slope, surf)
+                position_guess = np.where(np.isfinite(position_guess), position_guess, 0 * u.mm)
+
+                position_guess = kgpy.optimization.root_finding.newton(
                     func=position_error,
                     root_guess=position_guess,
-                    step_size=step,
                     max_abs_error=1 * u.nm,
                     max_iterations=100,
                 )
@@ -252,15 +552,18 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
                 if surf == self.stop_surface:
                     break
 
-            return Rays.from_field_angles(
-                wavelength_grid=self.wavelengths,
+            rays = Rays.from_field_samples(
+                wavelength_grid=wavelengths,
                 position=kgpy.vector.to_3d(position_guess),
-                field_grid_x=self.field_x,
-                field_grid_y=self.field_y,
+                field_x=field_x,
+                field_y=field_y,
                 field_mask_func=self.field_mask_func,
-                pupil_grid_x=self.pupil_x,
-                pupil_grid_y=self.pupil_y,
+                input_grids=input_grids,
             )
+            # The weight of each ray is the relative area of its sample on the stop.
+            weight = np.expand_dims(weight[pupil_index], tuple(range(~4, ~(num_grid_axes - 1))))
+            rays.weight = np.broadcast_to(weight, rays.grid_shape).copy()
+            return rays
 
         else:
             raise NotImplementedError
@@ -271,39 +574,445 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
             start_surface: typ.Optional[surface.Standard] = None,
             final_surface: typ.Optional[surface.Standard] = None,
     ) -> Rays:
-
-        surfaces = list(self)
+        """
+        Trace rays from one surface to another.
+        Since the rays at the intermediate surfaces are not returned, the coordinate breaks, inactive surfaces and dummy
+        planes between them are fused into single transforms, see :meth:`kgpy.optics.system.plan.TracePlan.fused`.
+
+        :param rays: Rays in the coordinates of `start_surface`, which are not modified.
+        :param start_surface: Surface to start from, the object surface if :code:`None`.
+        :param final_surface: Surface to trace the rays to, the image surface if :code:`None`.
+        :return: The rays at `final_surface`.
+        """
+        trace_plan = self.compile()
 
         if start_surface is None:
             start_surface_index = 0
         else:
-            start_surface_index = surfaces.index(start_surface)
+            start_surface_index = trace_plan.index(start_surface)
 
         if final_surface is None:
-            final_surface_index = len(surfaces) - 1
+            final_surface_index = len(trace_plan) - 1
         else:
-            final_surface_index = surfaces.index(final_surface)
+            final_surface_index = trace_plan.index(final_surface)
 
-        rays = surfaces[start_surface_index].propagate_rays(rays, is_first_surface=True)
-        for s in range(start_surface_index + 1, final_surface_index):
-            rays = surfaces[s].propagate_rays(rays)
-        rays = surfaces[final_surface_index].propagate_rays(rays, is_final_surface=True)
+        kernels = trace_plan.fused(start_surface_index, final_surface_index)
+        rays_traced, = self._raytrace_threaded(lambda r, _: self._raytrace(r, kernels), trace_plan.to_value(rays))
+        return trace_plan.to_quantity(rays_traced, rays)
 
-        return rays
+    def _raytrace(
+            self,
+            rays: Rays,
+            kernels: typ.Sequence[plan.Kernel],
+            keep_all: bool = False,
+            record: typ.Optional[typ.Callable[[int, Rays], typ.NoReturn]] = None,
+            compact: bool = True,
+    ) -> typ.List[Rays]:
+        """
+        Trace rays from the first to the last of a sequence of surfaces, using the
+        :attr:`kgpy.optics.system.plan.TracePlan.kernels` of each surface.
+
+        If the fraction of unmasked rays in the grid falls below :attr:`compaction_threshold`, the unmasked rays are
+        gathered into a dense grid using :meth:`kgpy.optics.Rays.grid_compact` before the next surface, so that the
+        work done by the remaining surfaces scales with the number of rays that are still alive.
+        The results are scattered back into the full grid, where the fields of the masked rays are NaN.
+        Differential rays are never compacted, since ray aiming needs the Jacobians of every ray.
+
+        :param rays: Rays in the coordinates of the first surface, which are not modified.
+        :param kernels: The kernel of each surface to trace through.
+        :param keep_all: If :code:`True`, return the rays at every surface after the first, otherwise only the rays at
+            the last surface.
+        :param record: Called with the index of each surface after the first within `kernels` and the rays at that
+            surface, which are only valid until it returns.
+        :param compact: If :code:`False`, never compact the rays, so that the fields of the masked rays are still
+            traced.
+        :return: List of rays in the local coordinates of each returned surface.
+        """
+        result = []
+        compaction = None
+        rays = kernels[0](rays.copy(), is_first_surface=True)
+        for s, kernel in enumerate(kernels[1:], start=1):
+            is_final_surface = s == len(kernels) - 1
+
+            if compact and self.compaction_threshold > 0 and not rays.is_differential:
+                mask = np.broadcast_to(rays.mask, rays.grid_shape)
+                if np.count_nonzero(mask) < self.compaction_threshold * mask.size:
+                    if compaction is not None:
+                        rays = rays.grid_uncompact(*compaction)
+                    rays_compact, index = rays.grid_compact()
+                    compaction = index, rays
+                    rays = rays_compact
+
+            rays = kernel(rays, is_final_surface=True)
+
+            if keep_all or is_final_surface or record is not None:
+                rays_full = rays if compaction is None else rays.grid_uncompact(*compaction)
+                if record is not None:
+                    record(s, rays_full)
+                if keep_all or is_final_surface:
+                    if compaction is not None or is_final_surface:
+                        result.append(rays_full)
+                    else:
+                        result.append(rays.copy())
+
+            if not is_final_surface:
+                rays = kernel(rays, is_first_surface=True)
+
+        return result
+
+    def _grid_chunks(self, rays: Rays) -> typ.List[typ.Tuple[slice, ...]]:
+        shape = rays.grid_shape[~(rays.axis.ndim - 1):]
+        axis = int(np.argmax(shape))
+        chunks = []
+        for c in np.array_split(np.arange(shape[axis]), min(self.num_workers, shape[axis])):
+            index = [slice(None)] * len(shape)
+            index[axis] = slice(c[0], c[~0] + 1)
+            chunks.append(tuple(index))
+        return chunks
+
+    def _raytrace_threaded(
+            self,
+            func: typ.Callable[[Rays, typ.Tuple[slice, ...]], typ.List[Rays]],
+            rays: Rays,
+    ) -> typ.List[Rays]:
+        """
+        Split the ray grid along its longest axis into :attr:`num_workers` chunks and apply `func` to each chunk on a
+        thread pool.
+        The results of each chunk are copied into preallocated rays as soon as they are available.
+
+        :param func: Traces a chunk of rays and returns the rays at one or more surfaces, given the chunk and its index
+            within the trailing axes of the ray grid.
+        :param rays: The complete grid of rays to trace.
+        :return: The complete grid of rays at each surface returned by `func`.
+        """
+        if self.num_workers <= 1:
+            return func(rays, (slice(None), ) * rays.axis.ndim)
+
+        grid_shape = rays.grid_shape[~(rays.axis.ndim - 1):]
+        result = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = {executor.submit(func, rays.grid_slice(index), index): index for index in self._grid_chunks(rays)}
+            for future in concurrent.futures.as_completed(futures):
+                chunk = future.result()
+                if result is None:
+                    result = [r.grid_empty(r.shape + grid_shape) for r in chunk]
+                for r, r_chunk in zip(result, chunk):
+                    r.grid_assign(futures[future], r_chunk)
+
+        for r in result:
+            r.input_grids = rays.input_grids.copy()
+        return result
 
     @property
     def image_rays(self) -> Rays:
         return self.all_rays[~0]
 
-    def _calc_all_rays(self) -> typ.List[Rays]:
+    @property
+    def history(self) -> history_.RayHistory:
+        """
+        The fields of the rays selected by :attr:`history_recorder` at every surface, see :meth:`record_history`.
+        """
+        self._validate_cache()
+        if self._history is None or self._history[0] != self.history_recorder:
+            recorder = dataclasses.replace(self.history_recorder)
+            self._history = recorder, self.record_history(recorder)
+        return self._history[1]
 
-        rays = [self.input_rays]
+    @property
+    def _position_history(self) -> history_.RayHistory:
+        """
+        The position of the rays at every surface, for plotting.
+        This is :attr:`history` if :attr:`history_recorder` records it, otherwise the positions are recorded into a
+        separate history in memory.
+        """
+        recorder = self.history_recorder
+        if 'position' in recorder.fields and not recorder.image_only:
+            return self.history
+        return self.record_history(history_.Recorder(fields=('position', ), dtype=recorder.dtype))
+
+    def record_history(self, recorder: typ.Optional[history_.Recorder] = None) -> history_.RayHistory:
+        """
+        Record selected fields of the rays at every surface into a single preallocated array.
+        If :attr:`all_rays` has already been computed the fields are copied from it, otherwise the rays are traced
+        again, without keeping a complete :class:`kgpy.optics.Rays` object for each surface.
+
+        :param recorder: Which fields to record and how to store them, :attr:`history_recorder` if :code:`None`.
+        :return: A new history.
+        """
+        if recorder is None:
+            recorder = self.history_recorder
+
+        trace_plan = self.compile()
+        num_surfaces = len(trace_plan)
+        if recorder.image_only:
+            surface_indices = [num_surfaces - 1]
+        else:
+            surface_indices = list(range(num_surfaces))
+
+        self._validate_cache()
+        if self._all_rays is not None and len(self._all_rays) == num_surfaces:
+            image_rays = self._all_rays[~0]
+            result = recorder.allocate(surface_indices, image_rays.grid_shape, image_rays)
+            for i, s in enumerate(surface_indices):
+                result.record(i, self._all_rays[s])
+            return result
+
+        input_rays = self.input_rays
+        probe_index = (slice(0, 1), ) * input_rays.axis.ndim
+        probe = self.raytrace_subsystem(input_rays.grid_slice(probe_index))
+        grid_shape = probe.shape + input_rays.grid_shape[len(input_rays.shape):]
+        result = recorder.allocate(surface_indices, grid_shape, input_rays)
+
+        kernels = trace_plan.kernels
+        if recorder.image_only:
+            def trace(r: Rays, index: typ.Tuple[slice, ...]) -> typ.List[Rays]:
+                rays_final, = self._raytrace(r, kernels)
+                result.record(0, rays_final, index)
+                return []
+        else:
+            result.record(0, input_rays)
+
+            def trace(r: Rays, index: typ.Tuple[slice, ...]) -> typ.List[Rays]:
+                self._raytrace(r, kernels, record=lambda s, rays: result.record(s, rays, index))
+                return []
+
+        self._raytrace_threaded(trace, trace_plan.to_value(input_rays))
+        return result
+
+    def _grid_blocks(self, max_rays: int) -> typ.Iterator[typ.Tuple[slice, ...]]:
+        shape = self.grid_shape
+        for axis in range(len(shape)):
+            if np.prod(shape[axis + 1:]) <= max_rays:
+                break
+        block_size = max(max_rays // int(np.prod(shape[axis + 1:])), 1)
+        for outer_index in np.ndindex(*shape[:axis]):
+            for start in range(0, shape[axis], block_size):
+                index = tuple(slice(i, i + 1) for i in outer_index)
+                index += (slice(start, min(start + block_size, shape[axis])), )
+                index += (slice(None), ) * (len(shape) - axis - 1)
+                yield index
+
+    def raytrace_blocks(
+            self,
+            max_memory: u.Quantity = 1 * u.GB,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> typ.Iterator[typ.Tuple[typ.Tuple[slice, ...], Rays]]:
+        """
+        Trace the ray grid through the system in blocks, so that the memory used by each block is about `max_memory`.
+        The rays are aimed once, using the cached :attr:`input_rays`, and each block of the input rays is traced
+        independently, so the rays at the intermediate surfaces are never stored for the full ray grid.
+
+        :param max_memory: Approximate memory budget of each block.
+        :param final_surface: Surface to trace the rays to, the image surface if :code:`None`.
+        :return: An iterator of the index of each block within :attr:`grid_shape` and the rays at `final_surface`.
+        """
+        input_rays = self.input_rays
+
+        # A single sample of each configuration is enough to find the configuration axes added by the surfaces.
+        probe_index = (slice(0, 1), ) * len(self.grid_shape)
+        probe = self.raytrace_subsystem(input_rays.grid_slice(probe_index), final_surface=final_surface)
+        rays_per_sample = int(np.prod(probe.grid_shape))
+        max_rays = int((max_memory / (self.bytes_per_ray * rays_per_sample)).to(u.dimensionless_unscaled))
+
+        for index in self._grid_blocks(max_rays):
+            rays = self.raytrace_subsystem(input_rays.grid_slice(index), final_surface=final_surface)
+            yield index, rays
+
+    def raytrace_reduce(
+            self,
+            reducers: typ.Sequence[reducer.Reducer],
+            max_memory: u.Quantity = 1 * u.GB,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> typ.NoReturn:
+        """
+        Feed every block of rays from :meth:`raytrace_blocks` to each of the given reducers.
+
+        :param reducers: Reductions to compute, see :mod:`kgpy.optics.system.reducer`.
+        :param max_memory: Approximate memory budget of each block.
+        :param final_surface: Surface to trace the rays to, the image surface if :code:`None`.
+        """
+        for index, rays in self.raytrace_blocks(max_memory=max_memory, final_surface=final_surface):
+            for r in reducers:
+                r.reduce(rays, index, rays.shape + self.grid_shape)
+
+    def transfer_matrix(
+            self,
+            bins: typ.Union[int, typ.Tuple[int, int]],
+            limits: typ.Tuple[typ.Tuple[u.Quantity, u.Quantity], typ.Tuple[u.Quantity, u.Quantity]],
+            use_vignetted: bool = False,
+            max_memory: u.Quantity = 1 * u.GB,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> reducer.TransferMatrix:
+        """
+        Trace the pupil of every wavelength and field position once and bin the rays into the pixels of a detector,
+        see :class:`kgpy.optics.system.reducer.TransferMatrix`.
 
-        surfaces = list(self)
-        for s1, s2 in zip(surfaces[:~0], surfaces[1:]):
-            rays.append(self.raytrace_subsystem(rays[~0], s1, s2))
+        :param bins: Number of pixels along the :math:`x` and :math:`y` axes of the detector.
+        :param limits: Lower and upper edges of the detector along the :math:`x` and :math:`y` axes.
+        :param use_vignetted: Include the vignetted rays.
+        :param max_memory: Approximate memory budget of each block of rays.
+        :param final_surface: Surface of the detector, the image surface if :code:`None`.
+        :return: The accumulated reduction, whose :attr:`kgpy.optics.system.reducer.TransferMatrix.matrix` maps spectral
+            cubes to detector images.
+        """
+        result = reducer.TransferMatrix(bins=bins, limits=limits, use_vignetted=use_vignetted)
+        self.raytrace_reduce([result], max_memory=max_memory, final_surface=final_surface)
+        return result
+
+    def _calc_all_rays(self, rays_cached: typ.List[Rays]) -> typ.List[Rays]:
+
+        start_rays = rays_cached[~0]
+        start = len(rays_cached) - 1
+
+        trace_plan = self.compile()
+        kernels = trace_plan.kernels[start:]
+
+        def trace(r: Rays, index: typ.Tuple[slice, ...]) -> typ.List[Rays]:
+            return self._raytrace(r, kernels, keep_all=True)
+
+        rays = self._raytrace_threaded(trace, trace_plan.to_value(start_rays))
+        rays = [trace_plan.to_quantity(r, start_rays) for r in rays]
+
+        return rays_cached + rays
+
+    def raytrace_adaptive(
+            self,
+            num_levels: int = 2,
+            refinement: int = 4,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> typ.List[Rays]:
+        """
+        Trace extra rays near the edges of the beam, where the rays on the pupil grid change from unvignetted to
+        vignetted.
+
+        Starting from :attr:`all_rays`, every cell of the pupil grid whose corners do not all have the same mask is
+        split into :math:`n \\times n` subcells, and a ray is traced through the center of each one.
+        Subcells whose mask differs from a neighbour, in the same cell or in another, are split again at the next level,
+        so the cost of each level scales with the length of the edge of the beam rather than the area of the pupil.
+        The cells are different for every configuration, wavelength and field angle.
+
+        The :attr:`kgpy.optics.Rays.weight` of each ray is the area of the pupil it represents, relative to the area of
+        a cell of the pupil grid, or zero if the ray was superseded by a finer level, so weighted sums over every level
+        estimate integrals over the pupil.
+        Without refinement, the weights of the pupil grid are those of the trapezoidal rule.
+
+        :param num_levels: Number of levels of refinement.
+        :param refinement: Number of subcells along each side of a refined cell.
+        :param final_surface: Surface where the mask is evaluated, the image surface if :code:`None`.
+        :return: The rays at `final_surface` for the pupil grid and for each level of refinement that had cells to
+            refine.
+            The pupil axes of the refined rays are the index of the cell and the index of the subcell.
+        """
+        if not isinstance(self.pupil_sampler, sampling.Grid):
+            raise ValueError('Adaptive refinement requires a Grid pupil sampler')
+        num_x, num_y = self.pupil_samples_normalized
+        if num_x < 2 or num_y < 2:
+            raise ValueError('Adaptive refinement requires at least two pupil samples along each axis')
+
+        if final_surface is None:
+            final_surface = self.image_surface
+
+        # The areas are fractions of the unit square, which contains (num_x - 1) * (num_y - 1) cells of the pupil grid.
+        num_cells = (num_x - 1) * (num_y - 1)
+
+        rays = self.all_rays[list(self).index(final_surface)].copy()
+        mask = np.broadcast_to(rays.mask, rays.grid_shape)
+        if num_levels == 0:
+            mask = np.ones_like(mask)   # No cell is refined, so every cell contributes to the area of its corners.
+        cells, area = sampling.Cells.from_grid(mask)
+        rays.weight = rays.weight * area * num_cells
+        result = [rays]
+
+        for level in range(num_levels):
+            if cells.is_active.shape[~0] == 0:
+                break
+            unit_x, unit_y, area = cells.subdivide(refinement)
+            system = dataclasses.replace(
+                self,
+                pupil_sampler=sampling.Points(
+                    conform=self.pupil_sampler.conform,
+                    unit_x=unit_x,
+                    unit_y=unit_y,
+                    weight=area * num_cells,
+                ),
+                pupil_samples=unit_x.shape[~1:],
+            )
+            rays = system.raytrace_subsystem(system.input_rays, final_surface=final_surface)
+            # The subcells are only superseded if there is another level to refine them, otherwise their area is lost.
+            if level < num_levels - 1:
+                cells, is_refined = cells.refine(np.broadcast_to(rays.mask, rays.grid_shape), refinement)
+                rays.weight = np.where(is_refined, 0, np.broadcast_to(rays.weight, rays.grid_shape))
+            result.append(rays)
+
+        return result
+
+    def unvignetted_fraction(
+            self,
+            num_levels: int = 2,
+            refinement: int = 4,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> np.ndarray:
+        """
+        Fraction of the sampled area of the stop whose rays reach a surface unvignetted, estimated using
+        :meth:`raytrace_adaptive`.
+
+        :param num_levels: Number of levels of refinement.
+        :param refinement: Number of subcells along each side of a refined cell.
+        :param final_surface: Surface where the mask is evaluated, the image surface if :code:`None`.
+        :return: The unvignetted fraction for every configuration, wavelength and field angle.
+        """
+        total, unvignetted = 0, 0
+        for rays in self.raytrace_adaptive(num_levels=num_levels, refinement=refinement, final_surface=final_surface):
+            weight = np.broadcast_to(rays.weight, rays.grid_shape)
+            mask = np.broadcast_to(rays.mask, rays.grid_shape)
+            pupil_axes = rays.axis.pupil_x, rays.axis.pupil_y
+            total = total + weight.sum(axis=pupil_axes)
+            unvignetted = unvignetted + (weight * mask).sum(axis=pupil_axes)
+        return unvignetted / total
+
+    def vignetting(self, final_surface: typ.Optional[surface.Surface] = None) -> vignetting_.Vignetting:
+        """
+        Find which apertures clip each ray, see :class:`kgpy.optics.system.vignetting.Vignetting`.
+        Every active aperture is evaluated for every ray, including the rays clipped by an earlier aperture, so the
+        contribution of each aperture to the vignetting budget is found from a single raytrace.
+
+        :param final_surface: Last surface whose aperture is evaluated, the image surface if :code:`None`.
+        :return: The apertures that clip each ray, and the masks and weight of the rays on `final_surface`.
+        """
+        trace_plan = self.compile()
+        if final_surface is None:
+            final_surface_index = len(trace_plan) - 1
+        else:
+            final_surface_index = trace_plan.index(final_surface)
 
-        return rays
+        surface_indices = []
+        for s in range(1, final_surface_index + 1):
+            if not isinstance(trace_plan.kernels[s], plan.Transfer):
+                aperture_s = getattr(trace_plan.stages[s], 'aperture', None)
+                if aperture_s is not None and aperture_s.is_active:
+                    surface_indices.append(s)
+        bit = {s: k for k, s in enumerate(surface_indices)}
+
+        input_rays = self.input_rays
+        probe_index = (slice(0, 1), ) * input_rays.axis.ndim
+        probe = self.raytrace_subsystem(input_rays.grid_slice(probe_index), final_surface=final_surface)
+        grid_shape = probe.shape + input_rays.grid_shape[len(input_rays.shape):]
+        result = vignetting_.Vignetting.empty(surface_indices, grid_shape)
+
+        kernels = trace_plan.kernels[:final_surface_index + 1]
+
+        def trace(r: Rays, index: typ.Tuple[slice, ...]) -> typ.List[Rays]:
+
+            def record(s: int, rays: Rays):
+                if s in bit:
+                    result.record(bit[s], trace_plan.stages[s].aperture.is_unvignetted(rays.position), index)
+
+            rays_final, = self._raytrace(r, kernels, record=record, compact=False)
+            result.record_final(rays_final, index)
+            return []
+
+        self._raytrace_threaded(trace, trace_plan.to_value(input_rays))
+        return result
 
     def psf(
             self,
@@ -319,6 +1028,20 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
             relative_to_centroid=relative_to_centroid,
         )
 
+    def wavefront(
+            self,
+            pupil_samples: typ.Union[int, typ.Tuple[int, int]] = 64,
+            final_surface: typ.Optional[surface.Surface] = None,
+    ) -> diffraction.Wavefront:
+        """
+        Wavefront error of every field point, for computing diffraction PSFs and MTFs with
+        :meth:`kgpy.optics.system.diffraction.Wavefront.psf` and :meth:`kgpy.optics.system.diffraction.Wavefront.mtf`.
+
+        :param pupil_samples: Number of rays across the pupil, along each axis.
+        :param final_surface: Surface to evaluate the wavefront on, the image surface if :code:`None`.
+        """
+        return diffraction.Wavefront.from_system(self, pupil_samples=pupil_samples, final_surface=final_surface)
+
     def print_surfaces(self) -> typ.NoReturn:
         for surf in self:
             print(surf)
@@ -337,7 +1060,7 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
         if surf is None:
             surf = self.image_surface
 
-        rays = self.all_rays[list(self).index(surf)]
+        rays = self._position_history.rays(list(self).index(surf))
 
         rays.plot_position(ax=ax, color_axis=color_axis, plot_vignetted=plot_vignetted)
 
@@ -408,15 +1131,15 @@ class System(ZemaxCompatible, kgpy.mixin.Broadcastable, kgpy.mixin.Named, typ.Ge
         end_surface_index = surfaces.index(final_surface)
 
         intercepts = []
-        i = slice(start_surface_index, end_surface_index + 1)
-        all_rays = self.all_rays
-        for surf, rays in zip(surfaces[i], all_rays[i]):
+        history = self._position_history
+        for s in range(start_surface_index, end_surface_index + 1):
+            surf = surfaces[s]
             surf.plot_2d(ax, components, self)
-            intercept = surf.transform_to_global(rays.position, self, num_extra_dims=5)
+            intercept = surf.transform_to_global(history.get('position', s), self, num_extra_dims=5)
             intercepts.append(intercept)
         intercepts = u.Quantity(intercepts)
 
-        img_rays = all_rays[~0]
+        img_rays = history.rays(len(surfaces) - 1)
 
         color_axis = (color_axis % img_rays.axis.ndim) - img_rays.axis.ndim
 
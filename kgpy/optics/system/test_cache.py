@@ -0,0 +1,85 @@
+import os
+import pathlib
+import subprocess
+import sys
+import numpy as np
+import astropy.units as u
+import kgpy
+from kgpy.optics import System
+from . import cache
+from .test_system import grating_system
+
+
+class TestFingerprint:
+
+    def test_fingerprint(self):
+        assert cache.fingerprint(grating_system()) == cache.fingerprint(grating_system())
+        assert cache.fingerprint(1 * u.mm) != cache.fingerprint(1 * u.m)
+        assert cache.fingerprint([1, 2]) != cache.fingerprint((1, 2))
+        assert cache.fingerprint(lambda a: a + 1) != cache.fingerprint(lambda a: a + 2)
+        assert cache.fingerprint(dict(a=1, b=2)) == cache.fingerprint(dict(b=2, a=1))
+
+    def test_fingerprint_stable(self):
+        code = 'from kgpy.optics.system.test_system import grating_system; print(grating_system().fingerprint)'
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([str(pathlib.Path(kgpy.__file__).parent.parent), env.get('PYTHONPATH', '')])
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True, env=env)
+        assert output.stdout.strip() == grating_system().fingerprint
+
+    def test_fingerprint_changed(self):
+        system = grating_system()
+        fingerprint = system.fingerprint
+        system.surfaces[1].aperture.radius = 61 * u.mm
+        assert system.fingerprint != fingerprint
+        system.surfaces[1].aperture.radius = 60 * u.mm
+        assert system.fingerprint == fingerprint
+        system.surfaces[2].transform_before.tilt.x = system.surfaces[2].transform_before.tilt.x + 1 * u.deg
+        assert system.fingerprint != fingerprint
+        system = grating_system(stop_surface=system.surfaces[1])
+        assert system.fingerprint != fingerprint
+
+
+class TestRayCache:
+
+    def test_load(self, tmp_path, monkeypatch):
+        ray_cache = cache.RayCache(directory=tmp_path)
+        rays = grating_system(ray_cache=ray_cache).all_rays
+        assert len(ray_cache.paths) == 1
+
+        def calc_rays(self, *args, **kwargs):
+            raise AssertionError('rays should have been loaded from the cache')
+
+        monkeypatch.setattr(System, '_calc_input_rays', calc_rays)
+        monkeypatch.setattr(System, '_calc_all_rays', calc_rays)
+        rays_loaded = grating_system(ray_cache=ray_cache).all_rays
+        assert len(rays_loaded) == len(rays)
+        for r, r_loaded in zip(rays, rays_loaded):
+            assert r_loaded.position.unit == r.position.unit
+            assert np.allclose(r_loaded.position, r.position, rtol=0, atol=0, equal_nan=True)
+            assert np.allclose(r_loaded.direction, r.direction, rtol=0, atol=0, equal_nan=True)
+            assert np.array_equal(r_loaded.wavelength, r.wavelength)
+            assert (r_loaded.mask == r.mask).all()
+            assert r_loaded.propagation_signum == r.propagation_signum
+            for grid, grid_loaded in zip(r.input_grids, r_loaded.input_grids):
+                assert np.array_equal(grid_loaded, grid)
+
+    def test_evict(self, tmp_path):
+        ray_cache = cache.RayCache(directory=tmp_path)
+        keys = []
+        for wavelength in [60, 61, 62]:
+            system = grating_system(wavelengths=[wavelength] * u.nm, ray_cache=ray_cache)
+            system.input_rays
+            keys.append(system.fingerprint)
+            os.utime(ray_cache.path(keys[~0]), (len(keys), len(keys)))
+        assert all(key in ray_cache for key in keys)
+
+        ray_cache.load(keys[0])
+        ray_cache.max_size = ray_cache.size - 1 * u.byte
+        ray_cache.evict()
+        assert keys[0] in ray_cache
+        assert keys[1] not in ray_cache
+        assert keys[2] in ray_cache
+        assert ray_cache.size <= ray_cache.max_size
+
+        ray_cache.clear()
+        assert ray_cache.size == 0
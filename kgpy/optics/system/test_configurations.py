@@ -0,0 +1,29 @@
+import numpy as np
+import astropy.units as u
+from kgpy.optics import surface, aperture, coordinate
+from . import configurations
+
+
+def test_index_object():
+    vertices = [[-1, -1, 0], [1, -1, 0], [0, 1, 0]] * u.mm
+    polygon = aperture.GeneralPolygon(vertices=vertices)
+    surf = surface.Standard(
+        radius=[-100, -200, -300] * u.mm,
+        aperture=polygon,
+        transform_before=coordinate.TiltDecenter(tilt=coordinate.Tilt(x=[1, 2, 3] * u.deg)),
+    )
+    index = configurations.normalize((slice(None), 1))
+    surf_indexed = configurations.index_object([surf, surf], index)
+    assert surf_indexed[0] is surf_indexed[1]
+    assert surf_indexed[0].radius == -200 * u.mm
+    assert surf_indexed[0].transform_before.tilt.x == 2 * u.deg
+    assert np.all(surf_indexed[0].aperture.vertices == vertices)
+    assert np.all(surf.radius == [-100, -200, -300] * u.mm)
+
+
+def test_shape():
+    surf = surface.Standard(
+        radius=[[-100], [-200]] * u.mm,
+        transform_before=coordinate.TiltDecenter(tilt=coordinate.Tilt(x=[1, 2, 3] * u.deg)),
+    )
+    assert configurations.shape([surf, surf]) == (2, 3)
@@ -0,0 +1,95 @@
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy
+import kgpy.vector
+from kgpy.optics import System, surface, aperture, material
+from . import diffraction
+
+focal_length = 1000 * u.mm
+diameter = 100 * u.mm
+wavelength = 100 * u.nm
+
+
+@pytest.fixture
+def system() -> System:
+    stop = surface.Standard(
+        name=kgpy.Name('stop'),
+        thickness=1500 * u.mm,
+        aperture=aperture.Circular(radius=diameter / 2),
+    )
+    primary = surface.Standard(
+        name=kgpy.Name('primary'),
+        radius=-2 * focal_length,
+        conic=-1,
+        thickness=-focal_length,
+        material=material.Mirror(),
+        aperture=aperture.Circular(radius=60 * u.mm, is_test_stop=False),
+    )
+    detector = surface.Standard(name=kgpy.Name('detector'))
+    return System(
+        object_surface=surface.ObjectSurface(thickness=np.inf * u.mm),
+        surfaces=[stop, primary, detector],
+        stop_surface=stop,
+        wavelengths=[wavelength.value] * wavelength.unit,
+        pupil_samples=5,
+        field_min=kgpy.vector.from_components(-0.01 * u.deg, -0.01 * u.deg),
+        field_max=kgpy.vector.from_components(0.01 * u.deg, 0.01 * u.deg),
+        field_samples=3,
+    )
+
+
+class TestWavefront:
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_from_system(self, system: System, unitless_raytrace: bool):
+        system.unitless_raytrace = unitless_raytrace
+        wavefront = system.wavefront(pupil_samples=64)
+        assert wavefront.opd.shape[~1:] == (64, 64)
+        assert wavefront.rms[..., 0, 1, 1] < wavelength / 100
+        assert (wavefront.rms < wavelength / 20).all()
+
+    def test_psf(self, system: System):
+        wavefront = system.wavefront(pupil_samples=64)
+        psf, position = wavefront.psf(padding=8)
+        assert psf.shape[~1:] == position.shape[~2:~0] == (512, 512)
+        assert np.allclose(psf.sum(axis=(~1, ~0)), 1)
+        psf_0 = psf[..., 0, 1, 1, :, :]
+        assert np.unravel_index(np.argmax(psf_0), psf_0.shape) == (256, 256)
+        assert np.allclose(position[..., 0, 1, 1, 256, 256, :], wavefront.reference[..., 0, 1, 1, :2])
+
+        # The first zero of the Airy pattern is at a radius of 1.22 lambda F#.
+        radius = 1.22 * wavelength * focal_length / diameter
+        r = np.sqrt(np.sum(np.square(position[..., 0, 1, 1, :, :, :] - position[..., 0, 1, 1, 256, 256, :]), axis=~0))
+        assert np.isclose(psf_0[r < radius].sum(), 0.84, atol=0.03)
+
+        # An off-axis field point is still diffraction limited, so its PSF is centered on the reference point.
+        psf_1 = psf[..., 0, 0, 2, :, :]
+        assert np.unravel_index(np.argmax(psf_1), psf_1.shape) == (256, 256)
+        r = np.sqrt(np.sum(np.square(position[..., 0, 0, 2, :, :, :] - position[..., 0, 0, 2, 256, 256, :]), axis=~0))
+        assert np.isclose(psf_1[r < radius].sum(), 0.84, atol=0.03)
+
+    def test_mtf(self, system: System):
+        wavefront = system.wavefront(pupil_samples=64)
+        mtf, frequency = wavefront.mtf()
+        mtf_0 = mtf[..., 0, 1, 1, :, :]
+        center = tuple(n // 2 for n in mtf_0.shape)
+        assert mtf_0[center] == 1
+        cutoff = diameter / (wavelength * focal_length)
+        v = frequency[..., 0, 1, 1, :, center[1], 0] / cutoff
+        v = v.to(u.dimensionless_unscaled).value
+        expected = 2 / np.pi * (np.arccos(np.minimum(np.abs(v), 1)) - np.abs(v) * np.sqrt(1 - np.minimum(v * v, 1)))
+        assert np.allclose(mtf_0[..., center[1]], expected, atol=0.05)
+
+        mtf_1 = mtf[..., 0, 0, 2, :, :]
+        v = frequency[..., 0, 0, 2, :, center[1], 0] / cutoff
+        v = v.to(u.dimensionless_unscaled).value
+        expected = 2 / np.pi * (np.arccos(np.minimum(np.abs(v), 1)) - np.abs(v) * np.sqrt(1 - np.minimum(v * v, 1)))
+        assert np.allclose(mtf_1[..., center[1]], expected, atol=0.05)
+
+
+def test_diffraction_grating_phase():
+    grating = surface.DiffractionGrating(groove_density=500 / u.mm)
+    sx, sy = np.linspace(-1, 1, 5) * u.mm, np.linspace(-1, 1, 5) * u.mm
+    phase = grating.groove_phase(sx, sy)
+    assert np.allclose(np.gradient(phase, sy), grating.groove_normal(sx, sy)[kgpy.vector.y])
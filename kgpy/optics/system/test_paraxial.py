@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy
+import kgpy.vector
+from kgpy.vector import z, xy
+from kgpy.optics import System, surface, aperture, material
+from . import paraxial
+
+focal_length = 1000 * u.mm
+
+
+@pytest.fixture
+def system() -> System:
+    stop = surface.Standard(
+        name=kgpy.Name('stop'),
+        thickness=1500 * u.mm,
+        aperture=aperture.Circular(radius=50 * u.mm),
+    )
+    primary = surface.Standard(
+        name=kgpy.Name('primary'),
+        radius=-2 * focal_length,
+        conic=-1,
+        thickness=-focal_length,
+        material=material.Mirror(),
+        aperture=aperture.Circular(radius=60 * u.mm, is_test_stop=False),
+    )
+    detector = surface.Standard(name=kgpy.Name('detector'))
+    return System(
+        object_surface=surface.ObjectSurface(thickness=np.inf * u.mm),
+        surfaces=[stop, primary, detector],
+        stop_surface=stop,
+        wavelengths=[100] * u.nm,
+        pupil_samples=5,
+        field_min=kgpy.vector.from_components(-0.01 * u.deg, -0.01 * u.deg),
+        field_max=kgpy.vector.from_components(0.01 * u.deg, 0.01 * u.deg),
+        field_samples=3,
+    )
+
+
+class TestParaxial:
+
+    def test_first_order_properties(self, system: System):
+        model = system.paraxial
+        assert np.allclose(model.effective_focal_length, focal_length)
+        assert np.allclose(model.focus_position, 0 * u.mm, atol=1 * u.nm)
+        assert np.allclose(model.entrance_pupil_position, 0 * u.mm)
+        assert np.allclose(model.entrance_pupil_semi_aperture, 50 * u.mm)
+        assert np.allclose(model.exit_pupil_position, -2 * focal_length)
+        assert np.allclose(model.exit_pupil_semi_aperture, 100 * u.mm)
+        assert np.allclose(model.pupil_magnification, 2)
+
+    def test_plate_scale(self, system: System):
+        input_rays = system.input_rays
+        slope = input_rays.direction[xy] / input_rays.direction[z][..., np.newaxis]
+        chief_ray_position = system.image_rays.position[..., 2, 2, :2]
+        expected = system.paraxial.plate_scale * slope[..., 2, 2, :]
+        assert np.allclose(chief_ray_position, expected, rtol=1e-2)
+
+    def test_launch_position(self, system: System):
+        primary = system.surfaces[1]
+        primary.aperture.is_test_stop = True
+        system.stop_surface = primary
+        system.update()
+        rays = system.input_rays
+        slope = rays.direction[xy] / rays.direction[z][..., np.newaxis]
+        rays_primary = system.raytrace_subsystem(rays, final_surface=primary)
+        launch_position = system.paraxial.launch_position(rays_primary.position[xy], slope, primary)
+        assert np.allclose(launch_position, rays.position[xy], rtol=0, atol=1 * u.um)
+
+    def test_curvature(self):
+        surf = surface.Toroidal(radius=500 * u.mm, radius_of_rotation=400 * u.mm)
+        assert np.allclose(paraxial.Paraxial.curvature(surf), [1 / 400, 1 / 500] / u.mm)
+
+    def test_wavelength_slice(self, system: System):
+        system.wavelengths = [100, 200, 300] * u.nm
+        system.update()
+        model = system.paraxial.wavelength_slice(slice(1, 3))
+        expected = paraxial.Paraxial.from_system(system, wavelengths=system.wavelengths[1:3])
+        assert np.all(model.wavelength == expected.wavelength)
+        for surf in expected.surfaces:
+            for m, m_expected in zip(model.matrix(surf, exiting=True), expected.matrix(surf, exiting=True)):
+                assert np.allclose(m, m_expected)
@@ -0,0 +1,114 @@
+import dataclasses
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from kgpy.vector import x, y
+from kgpy.optics import aperture
+from . import sampling
+
+num = (8, 16)
+
+
+@pytest.mark.parametrize(
+    argnames='sampler',
+    argvalues=[
+        sampling.Grid(),
+        sampling.Random(),
+        sampling.Stratified(),
+        sampling.Halton(),
+        sampling.Halton(seed=1),
+        sampling.Sobol(),
+        sampling.Sobol(seed=1),
+    ]
+)
+class TestSampler:
+
+    def test_unit_square(self, sampler: sampling.Sampler):
+        ux, uy = np.broadcast_arrays(*sampler.unit_square(num))
+        assert ux.shape == num
+        assert ((0 <= ux) & (ux <= 1)).all()
+        assert ((0 <= uy) & (uy <= 1)).all()
+        assert len(np.unique(np.stack([ux, uy], axis=~0).reshape(-1, 2), axis=0)) == ux.size
+
+    def test_sample(self, sampler: sampling.Sampler):
+        start = kgpy.vector.from_components(-1 * u.deg, 2 * u.deg)
+        stop = kgpy.vector.from_components(1 * u.deg, 3 * u.deg)
+        sx, sy = sampler.sample(start, stop, num)
+        assert sx.shape == num
+        assert ((start[x] <= sx) & (sx <= stop[x])).all()
+        assert ((start[y] <= sy) & (sy <= stop[y])).all()
+
+    def test_sample_aperture(self, sampler: sampling.Sampler):
+        aper = aperture.Circular(radius=10 * u.mm)
+        sampler = dataclasses.replace(sampler, conform=True)
+        px, py, weight = sampler.sample_aperture(aper, num, margin=1 * u.mm)
+        assert px.shape == weight.shape == num
+        assert (np.sqrt(np.square(px) + np.square(py)) <= 9 * u.mm + 1 * u.nm).all()
+        assert np.allclose(weight, np.pi / 4)
+
+
+def test_stratified():
+    ux, uy = sampling.Stratified().unit_square(num)
+    assert (np.floor(ux * num[0]) == np.arange(num[0])[:, np.newaxis]).all()
+    assert (np.floor(uy * num[1]) == np.arange(num[1])).all()
+
+
+def test_sobol():
+    ux, uy = sampling.Sobol().unit_square((4, 4))
+    # Each of the first 16 points of a Sobol sequence lies in a different cell of a 4x4 grid.
+    cells = np.floor(ux * 4) * 4 + np.floor(uy * 4)
+    assert len(np.unique(cells)) == 16
+
+
+@pytest.mark.parametrize('sampler', [sampling.Stratified(), sampling.Halton(), sampling.Sobol()])
+def test_disk_moments(sampler: sampling.Sampler):
+    aper = aperture.Circular(radius=1 * u.mm)
+    sampler = dataclasses.replace(sampler, conform=True)
+    px, py, weight = sampler.sample_aperture(aper, (32, 32))
+    assert np.abs(np.average(px, weights=weight)) < 0.01 * u.mm
+    assert np.abs(np.average(np.square(px) + np.square(py), weights=weight) - 0.5 * u.mm ** 2) < 0.01 * u.mm ** 2
+
+
+def test_cells():
+    mask = np.zeros((5, 5), dtype=bool)
+    mask[:3, :3] = True
+    cells, area = sampling.Cells.from_grid(mask)
+    assert cells.is_active.all()
+    assert cells.is_active.shape == (5, )
+    assert np.isclose(area.sum() + cells.width_x @ cells.width_y, 1)
+
+    ux, uy, subarea = cells.subdivide(4)
+    assert ux.shape == (5, 16)
+    assert np.isclose(subarea.sum() + area.sum(), 1)
+
+    subcells, is_refined = cells.refine((ux < 0.6) & (uy < 0.6), 4)
+    assert is_refined.shape == ux.shape
+    assert is_refined.any()
+    assert subcells.is_active.sum() == is_refined.sum()
+    assert np.allclose(subcells.width_x, 1 / 16)
+
+
+def test_points_configurations():
+    shape = (1, 1, 1, 2, 3)
+    sampler = sampling.Points(unit_x=np.full(shape, 0.75), unit_y=np.full(shape, 0.25))
+    aper = aperture.Rectangular(half_width_x=[1, 2] * u.mm, half_width_y=[1, 2] * u.mm)
+    px, py, weight = sampler.sample_aperture(aper, shape[~1:])
+    assert px.shape == (2, ) + shape
+    assert np.allclose(px[0], 0.5 * u.mm)
+    assert np.allclose(px[1], 1 * u.mm)
+    assert np.allclose(py[1], -1 * u.mm)
+
+
+def test_cells_refine_neighbours():
+    cells = sampling.Cells(
+        x=np.array([0, 0.5]),
+        y=np.array([0, 0]),
+        width_x=np.array([0.5, 0.5]),
+        width_y=np.array([1, 1]),
+        is_active=np.array([True, True]),
+    )
+    ux, uy, _ = cells.subdivide(2)
+    _, is_refined = cells.refine(ux < 0.5, 2)
+    assert is_refined[0].all()
+    assert (is_refined[1] == [True, True, False, False]).all()
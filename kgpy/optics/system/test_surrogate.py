@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy
+import kgpy.vector
+from kgpy.vector import x, y
+from kgpy.optics import System, surface, aperture, material
+from . import surrogate
+
+
+def system(**kwargs) -> System:
+    stop = surface.Standard(
+        name=kgpy.Name('stop'),
+        thickness=1500 * u.mm,
+        aperture=aperture.Circular(radius=50 * u.mm),
+    )
+    primary = surface.Standard(
+        name=kgpy.Name('primary'),
+        radius=-2000 * u.mm,
+        conic=-1,
+        thickness=-1010 * u.mm,
+        material=material.Mirror(),
+        aperture=aperture.Circular(radius=60 * u.mm, is_test_stop=False),
+    )
+    detector = surface.Standard(name=kgpy.Name('detector'))
+    args = dict(
+        object_surface=surface.ObjectSurface(thickness=np.inf * u.mm),
+        surfaces=[stop, primary, detector],
+        stop_surface=stop,
+        wavelengths=[100, 200] * u.nm,
+        pupil_samples=7,
+        field_min=kgpy.vector.from_components(-0.5 * u.deg, -0.5 * u.deg),
+        field_max=kgpy.vector.from_components(0.5 * u.deg, 0.5 * u.deg),
+        field_samples=5,
+    )
+    args.update(kwargs)
+    return System(**args)
+
+
+def test_calc_exponents():
+    exponents = surrogate.Surrogate.calc_exponents(3, [True, False, False, False, False])
+    assert (exponents[:, 0] == 0).all()
+    assert (exponents.sum(~0) <= 3).all()
+    assert len(exponents) == 35
+    assert len(np.unique(exponents, axis=0)) == len(exponents)
+
+
+class TestSurrogate:
+
+    @pytest.mark.parametrize('include_direction', [False, True])
+    def test_from_system(self, include_direction: bool):
+        model = surrogate.Surrogate.from_system(system(), degree=4, include_direction=include_direction)
+        assert (model.exponents[:, 0] > 0).any()
+        assert (model.position_residual_rms < 1 * u.um).all()
+        assert (model.position_residual_max >= model.position_residual_rms).all()
+        assert (model.direction_coefficients is not None) == include_direction
+
+        test_system = system(pupil_samples=6, field_samples=4)
+        rays = test_system.image_rays
+        pupil_x, pupil_y, _ = test_system.pupil_points(test_system.stop_surface)
+        field = test_system.field_points
+        position = model.position(
+            wavelength=test_system.wavelengths[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis],
+            field_x=field[x][..., np.newaxis, np.newaxis],
+            field_y=field[y][..., np.newaxis, np.newaxis],
+            pupil_x=pupil_x,
+            pupil_y=pupil_y,
+        )
+        mask = np.broadcast_to(rays.mask, rays.grid_shape)
+        expected = np.broadcast_to(rays.position[..., :2], rays.grid_shape + (2, ), subok=True)
+        assert np.allclose(position[mask], expected[mask], rtol=0, atol=2 * u.um)
+        if include_direction:
+            assert model.direction(100 * u.nm, 0 * u.deg, 0 * u.deg, 0 * u.mm, 0 * u.mm).shape == (2, )
+
+    def test_from_system_monochromatic(self):
+        model = surrogate.Surrogate.from_system(system(wavelengths=[100] * u.nm), degree=4)
+        assert (model.exponents[:, 0] == 0).all()
+        assert (model.position_residual_rms < 1 * u.um).all()
+
+    def test_chunks(self, monkeypatch):
+        model = surrogate.Surrogate.from_system(system(), degree=2)
+        field_x = np.linspace(-0.5, 0.5, 11) * u.deg
+        pupil_y = np.linspace(-40, 40, 7)[:, np.newaxis] * u.mm
+        args = 100 * u.nm, field_x, 0 * u.deg, 0 * u.mm, pupil_y
+        position = model.position(*args)
+        monkeypatch.setattr(surrogate.Surrogate, 'chunk_size', 5)
+        assert position.shape == (7, 11, 2)
+        assert np.allclose(model.position(*args), position)
+
+    def test_save_load(self, tmp_path):
+        model = surrogate.Surrogate.from_system(system(), degree=3, include_direction=True)
+        path = tmp_path / 'model.npz'
+        model.save(path)
+        model_loaded = surrogate.Surrogate.load(path)
+        assert (model_loaded.exponents == model.exponents).all()
+        assert np.all(model_loaded.position_coefficients == model.position_coefficients)
+        assert np.all(model_loaded.direction_residual_max == model.direction_residual_max)
+        args = 150 * u.nm, 0.1 * u.deg, -0.2 * u.deg, 10 * u.mm, -20 * u.mm
+        assert np.all(model_loaded.position(*args) == model.position(*args))
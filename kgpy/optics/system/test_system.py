@@ -0,0 +1,511 @@
+import os
+import pathlib
+import timeit
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy
+import kgpy.vector
+from kgpy.vector import x, y, z
+from kgpy.optics import System, surface, aperture, material, coordinate, unitless
+from . import reducer, sampling, plan, history
+
+num_configurations = 3
+
+
+def grating_system(**kwargs) -> System:
+    config_shape = (num_configurations, 1, 1, 1, 1, 1)
+    stop = surface.Standard(
+        name=kgpy.Name('stop'),
+        thickness=1000 * u.mm,
+        aperture=aperture.Circular(radius=50 * u.mm),
+        transform_before=coordinate.TiltDecenter(),
+        transform_after=coordinate.TiltDecenter(),
+    )
+    primary = surface.Standard(
+        name=kgpy.Name('primary'),
+        radius=-2000 * u.mm,
+        conic=-1,
+        thickness=-900 * u.mm,
+        material=material.Mirror(),
+        aperture=aperture.Circular(radius=60 * u.mm, is_test_stop=False),
+        transform_before=coordinate.TiltDecenter(),
+        transform_after=coordinate.TiltDecenter(),
+    )
+    grating = surface.DiffractionGrating(
+        name=kgpy.Name('grating'),
+        radius=np.linspace(500, 550, num_configurations).reshape(config_shape) * u.mm,
+        thickness=300 * u.mm,
+        material=material.Mirror(),
+        groove_density=500 / u.mm,
+        aperture=aperture.Rectangular(half_width_x=20 * u.mm, half_width_y=20 * u.mm, is_test_stop=False),
+        transform_before=coordinate.TiltDecenter(tilt=coordinate.Tilt(x=np.linspace(1, 3, num_configurations) * u.deg)),
+        transform_after=coordinate.TiltDecenter(),
+    )
+    detector = surface.Standard(
+        name=kgpy.Name('detector'),
+        aperture=aperture.Rectangular(half_width_x=20 * u.mm, half_width_y=20 * u.mm, is_test_stop=False),
+        transform_before=coordinate.TiltDecenter(),
+        transform_after=coordinate.TiltDecenter(),
+    )
+    args = dict(
+        object_surface=surface.ObjectSurface(thickness=np.inf * u.mm),
+        surfaces=[stop, primary, grating, detector],
+        stop_surface=stop,
+        wavelengths=[60, 63] * u.nm,
+        pupil_samples=5,
+        field_min=kgpy.vector.from_components(-0.1 * u.deg, -0.1 * u.deg),
+        field_max=kgpy.vector.from_components(0.1 * u.deg, 0.1 * u.deg),
+        field_samples=3,
+    )
+    args.update(kwargs)
+    return System(**args)
+
+
+def baffled_grating_system(**kwargs) -> System:
+    system = grating_system(**kwargs)
+    system.surfaces[1].aperture.radius = 35 * u.mm
+    system.update()
+    return system
+
+
+def half_field_mask(fx: u.Quantity, fy: u.Quantity) -> np.ndarray:
+    return fx + fy < 0.05 * u.deg
+
+
+class TestSystem:
+
+    def test_unitless_raytrace(self):
+        rays = grating_system().all_rays
+        rays_unitless = grating_system(unitless_raytrace=True).all_rays
+        assert len(rays) == len(rays_unitless)
+        for r, r_unitless in zip(rays, rays_unitless):
+            assert r_unitless.position.unit == r.position.unit
+            assert np.allclose(r_unitless.position, r.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+            assert np.allclose(r_unitless.direction, r.direction, rtol=0, atol=1e-12, equal_nan=True)
+            assert (r_unitless.mask == r.mask).all()
+
+    @pytest.mark.skipif('KGPY_BENCHMARK' not in os.environ, reason='Benchmark, set KGPY_BENCHMARK to run')
+    @pytest.mark.parametrize('pupil_samples', [5, 21])
+    def test_unitless_raytrace_benchmark(self, pupil_samples: int):
+        timings = {}
+        for unitless_raytrace in [False, True]:
+            system = grating_system(pupil_samples=pupil_samples, unitless_raytrace=unitless_raytrace)
+            system.input_rays
+
+            def trace():
+                system._all_rays = None
+                return system.all_rays
+
+            timings[unitless_raytrace] = min(timeit.repeat(trace, number=1, repeat=3))
+        print()
+        print('pupil_samples =', pupil_samples)
+        print('quantity raytrace:', timings[False], 's')
+        print('unitless raytrace:', timings[True], 's')
+        print('speedup:', timings[False] / timings[True])
+
+    def test_raytrace_blocks(self, monkeypatch):
+        image_rays = grating_system(pupil_samples=7).image_rays
+        calls = []
+        calc_input_rays = System._calc_input_rays
+
+        def calc_input_rays_counted(self, *args, **kwargs):
+            calls.append(None)
+            return calc_input_rays(self, *args, **kwargs)
+
+        monkeypatch.setattr(System, '_calc_input_rays', calc_input_rays_counted)
+        system = grating_system(pupil_samples=7)
+        num_blocks = 0
+        for index, rays in system.raytrace_blocks(max_memory=100 * system.bytes_per_ray * num_configurations):
+            i = (..., ) + index
+            assert np.allclose(rays.position, image_rays.position[i + (slice(None), )], rtol=0, atol=1 * u.nm)
+            assert (rays.mask == image_rays.mask[i]).all()
+            num_blocks += 1
+        assert num_blocks > 1
+        assert len(calls) == 1
+
+    def test_raytrace_reduce(self):
+        system = grating_system(pupil_samples=7)
+        limits = ((-20 * u.mm, 20 * u.mm), (-20 * u.mm, 20 * u.mm))
+        centroid = reducer.Centroid()
+        bounds = reducer.Bounds()
+        histogram = reducer.PupilHistogram(bins=8, limits=limits)
+        system.raytrace_reduce([centroid, bounds, histogram], max_memory=100 * system.bytes_per_ray * num_configurations)
+
+        image_rays = system.image_rays
+        mask = np.broadcast_to(image_rays.mask, image_rays.grid_shape)
+        position = np.where(mask[..., np.newaxis], image_rays.position, np.nan)
+        assert np.allclose(centroid.result, np.nanmean(position, axis=(~2, ~1)), equal_nan=True)
+        assert np.allclose(bounds.result[0], np.nanmin(position, axis=(~5, ~4, ~3, ~2, ~1)))
+        assert np.allclose(bounds.result[1], np.nanmax(position, axis=(~5, ~4, ~3, ~2, ~1)))
+
+        limits = tuple((lmin.to_value(u.mm), lmax.to_value(u.mm)) for lmin, lmax in limits)
+        hist, _, _ = image_rays.pupil_hist2d(bins=8, limits=limits)
+        assert (histogram.result[0] == hist).all()
+
+    def test_transfer_matrix(self):
+        system = grating_system(pupil_samples=7, field_mask_func=half_field_mask)
+        bins = 16, 12
+        limits = ((-20 * u.mm, 20 * u.mm), (-20 * u.mm, 20 * u.mm))
+        transfer = system.transfer_matrix(
+            bins=bins,
+            limits=limits,
+            max_memory=100 * system.bytes_per_ray * num_configurations,
+        )
+        matrix, edges_x, edges_y = transfer.result
+        num_voxels = int(np.prod(system.grid_shape[:~1]))
+        assert matrix.shape == (num_configurations * bins[0] * bins[1], num_voxels)
+        assert np.allclose(edges_x, np.linspace(-20, 20, bins[0] + 1) * u.mm)
+
+        image_rays = system.image_rays
+        limits = tuple((lmin.to_value(u.mm), lmax.to_value(u.mm)) for lmin, lmax in limits)
+        hist, _, _ = image_rays.pupil_hist2d(bins=bins, limits=limits)
+        total = np.sum(image_rays.weight * image_rays.field_mask, axis=(~1, ~0))
+        total = np.broadcast_to(total, hist.shape[:~1])
+        with np.errstate(invalid='ignore'):
+            expected = np.nan_to_num(hist / total[..., np.newaxis, np.newaxis])
+        expected = np.moveaxis(expected.reshape(num_configurations, num_voxels, bins[0], bins[1]), 1, ~0)
+        assert np.allclose(matrix.toarray().reshape(expected.shape), expected)
+        matrix_dense = matrix.toarray().reshape(num_configurations, bins[0] * bins[1], num_voxels)
+        assert (matrix_dense.sum(axis=1) <= 1 + 1e-12).all()
+
+        cube = np.random.default_rng(0).random((2, ) + system.grid_shape[:~1])
+        image = transfer.forward(cube, matrix)
+        assert image.shape == (2, num_configurations) + bins
+        assert np.allclose(image, np.einsum('cpqv,nv->ncpq', expected, cube.reshape(2, -1)))
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_raytrace_threaded(self, unitless_raytrace: bool):
+        rays = grating_system(unitless_raytrace=unitless_raytrace).all_rays
+        rays_threaded = grating_system(unitless_raytrace=unitless_raytrace, num_workers=4).all_rays
+        assert len(rays) == len(rays_threaded)
+        for r, r_threaded in zip(rays, rays_threaded):
+            assert r_threaded.position.shape == np.broadcast(r.position, r_threaded.position).shape
+            assert np.allclose(r_threaded.position, r.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+            assert np.allclose(r_threaded.direction, r.direction, rtol=0, atol=1e-12, equal_nan=True)
+            assert (r_threaded.mask == r.mask).all()
+
+    def test_raytrace_threaded_identical(self):
+        system = grating_system(unitless_raytrace=True)
+        system_threaded = grating_system(unitless_raytrace=True, num_workers=4)
+        for r, r_threaded in zip(system.all_rays, system_threaded.all_rays):
+            for name in ['position', 'direction']:
+                a, a_threaded = getattr(r, name).value, getattr(r_threaded, name).value
+                np.testing.assert_array_equal(a_threaded, np.broadcast_to(a, a_threaded.shape))
+            assert (r_threaded.mask == r.mask).all()
+
+    @pytest.mark.skipif('KGPY_BENCHMARK' not in os.environ, reason='Benchmark, set KGPY_BENCHMARK to run')
+    def test_raytrace_threaded_benchmark(self):
+        timings = {}
+        for num_workers in [1, 2, 4, 8, 16]:
+            system = grating_system(pupil_samples=21, field_samples=16, unitless_raytrace=True, num_workers=num_workers)
+            system.input_rays
+
+            def trace():
+                system._all_rays = None
+                return system.all_rays
+
+            timings[num_workers] = min(timeit.repeat(trace, number=1, repeat=3))
+        print()
+        for num_workers, t in timings.items():
+            print('num_workers =', num_workers, ':', t, 's, speedup:', timings[1] / t)
+
+    def test_global_transforms(self):
+        system = grating_system()
+        position = system.image_rays.position
+        surfaces = list(system)
+        for index, surf in enumerate(surfaces):
+            expected = surf.apply_pre_transforms(position.copy(), num_extra_dims=5)
+            for s in reversed(surfaces[:index]):
+                expected = s.apply_pre_transforms(expected, num_extra_dims=5)
+                expected = s.apply_post_transforms(expected, num_extra_dims=5)
+            result = surf.transform_to_global(position, system, num_extra_dims=5)
+            assert np.allclose(result, expected, rtol=0, atol=1 * u.pm)
+
+        system.surfaces[0].thickness = 2000 * u.mm
+        global_transforms = system.global_transforms
+        system.update()
+        assert system.global_transforms is not global_transforms
+        origin = kgpy.vector.from_components() << u.mm
+        assert system.surfaces[1].transform_to_global(origin, system)[z] == 2000 * u.mm
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_compile(self, unitless_raytrace: bool):
+        system = grating_system(unitless_raytrace=unitless_raytrace)
+        trace_plan = system.compile()
+        assert system.compile() is trace_plan
+        assert all(s is surf for s, surf in zip(trace_plan.surfaces, system))
+        assert trace_plan.index(system.surfaces[2]) == 3
+        with pytest.raises(ValueError):
+            trace_plan.index(surface.Standard())
+
+        grating = trace_plan.stages[3]
+        assert isinstance(grating.transform_before, coordinate.Affine)
+        point = kgpy.vector.from_components(1 * u.mm, 2 * u.mm, 3 * u.mm)
+        result = (~grating.transform_before)(unitless.to_value(point) if unitless_raytrace else point)
+        result = unitless.to_quantity(result, point)
+        expected = (~system.surfaces[2].transform_before)(point)
+        assert np.allclose(result, expected, rtol=0, atol=1 * u.pm)
+
+        rays = system.all_rays
+        surfaces = list(system)
+        input_rays = unitless.to_value(rays[0]) if unitless_raytrace else rays[0]
+        if unitless_raytrace:
+            surfaces = unitless.to_value(surfaces)
+        rays_expected = system._raytrace(input_rays, [s.propagate_rays for s in surfaces], keep_all=True)
+        for r, r_expected in zip(rays[1:], rays_expected):
+            r_expected = unitless.to_quantity(r_expected, r) if unitless_raytrace else r_expected
+            assert np.allclose(r.position, r_expected.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+            assert (r.mask == r_expected.mask).all()
+
+        system.surfaces[2].radius = system.surfaces[2].radius + 10 * u.mm
+        system.update()
+        assert system.compile() is not trace_plan
+        system.unitless_raytrace = not unitless_raytrace
+        assert system.compile().is_unitless == (not unitless_raytrace)
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_fusion(self, unitless_raytrace: bool):
+        system = grating_system(unitless_raytrace=unitless_raytrace)
+        tilt = 2 * u.deg
+        system.surfaces[2:2] = [
+            surface.CoordinateBreak(transform=coordinate.TiltDecenter(tilt=coordinate.Tilt(x=tilt))),
+            surface.Standard(name=kgpy.Name('dummy')),
+            surface.Standard(
+                name=kgpy.Name('inactive'),
+                radius=100 * u.mm,
+                material=material.Mirror(),
+                is_active=np.array(False),
+            ),
+            surface.CoordinateBreak(transform=coordinate.TiltDecenter(tilt=coordinate.Tilt(x=-tilt))),
+        ]
+        system.update()
+
+        trace_plan = system.compile()
+        kernels = trace_plan.fused(0, len(trace_plan) - 1)
+        assert len(kernels) == len(list(grating_system()))
+        assert trace_plan.is_fusible == (False, False, False, True, True, True, True, False, False)
+        assert isinstance(trace_plan.kernels[5], plan.Transfer)
+
+        all_rays = system.all_rays
+        assert len(all_rays) == len(trace_plan)
+        rays = system.raytrace_subsystem(system.input_rays)
+        rays_expected = grating_system(unitless_raytrace=unitless_raytrace).image_rays
+        for r in [all_rays[~0], rays]:
+            assert np.allclose(r.position, rays_expected.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+            assert np.allclose(r.direction, rays_expected.direction, rtol=0, atol=1e-12, equal_nan=True)
+            assert (r.mask == rays_expected.mask).all()
+
+    def test_incremental_retrace(self):
+        system = grating_system()
+        rays = system.all_rays
+        grating = system.surfaces[2]
+        grating.radius = grating.radius + 10 * u.mm
+        system.update()
+        rays_retraced = system.all_rays
+        assert system.input_rays is rays[0]
+        assert all(r is r_old for r, r_old in zip(rays_retraced[:3], rays[:3]))
+        assert rays_retraced[3] is not rays[3]
+
+        expected = grating_system()
+        expected.surfaces[2].radius = expected.surfaces[2].radius + 10 * u.mm
+        for r, r_expected in zip(rays_retraced, expected.all_rays):
+            assert np.allclose(r.position, r_expected.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+            assert (r.mask == r_expected.mask).all()
+
+        system.update()
+        assert system.all_rays is rays_retraced
+
+        system.surfaces[0].aperture.radius = 40 * u.mm
+        system.update()
+        assert system.input_rays is not rays[0]
+
+        system.wavelengths = [61, 62] * u.nm
+        system.update()
+        assert (system.all_rays[~0].wavelength[..., 0, 0, 0, 0, 0] == [61, 62] * u.nm).all()
+
+    def test_getitem(self):
+        system = grating_system()
+        view = system[1]
+        assert view.stop_surface is view.surfaces[0]
+        assert view.surfaces[2].radius.shape == (1, 1, 1, 1, 1)
+        assert system.surfaces[2].radius.shape == (num_configurations, 1, 1, 1, 1, 1)
+        rays = system.image_rays
+        assert np.allclose(view.image_rays.position, rays.position[1], rtol=0, atol=1 * u.pm, equal_nan=True)
+        assert (view.image_rays.mask == np.broadcast_to(rays.mask, rays.grid_shape)[1]).all()
+
+        view = system[0:2]
+        assert view._all_rays is not None
+        assert view.image_rays.grid_shape == (2, ) + rays.grid_shape[1:]
+        assert np.allclose(view.image_rays.position, rays.position[0:2], equal_nan=True)
+
+    def test_getitem_merge(self):
+        system = grating_system()
+        for i in range(num_configurations):
+            assert system._all_rays is None
+            system[i].image_rays
+        assert len(system._all_rays) == len(list(system))
+        rays = grating_system().image_rays
+        assert np.allclose(system.image_rays.position, rays.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+        assert (system.image_rays.mask == np.broadcast_to(rays.mask, rays.grid_shape)).all()
+
+    @pytest.mark.parametrize('recorder', [
+        history.Recorder(image_only=True),
+        history.Recorder(fields=('direction', )),
+    ])
+    def test_position_history(self, recorder: history.Recorder):
+        system = grating_system(history_recorder=recorder)
+        result = system._position_history
+        assert result.surface_indices == list(range(len(list(system))))
+        for s, rays in enumerate(system.all_rays):
+            assert np.allclose(result.get('position', s), rays.position, rtol=0, atol=1 * u.pm, equal_nan=True)
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    @pytest.mark.parametrize('num_workers', [1, 2])
+    def test_record_history(self, unitless_raytrace: bool, num_workers: int, tmp_path: pathlib.Path):
+        all_rays = grating_system().all_rays
+        system = grating_system(unitless_raytrace=unitless_raytrace, num_workers=num_workers)
+        recorder = history.Recorder(fields=('position', 'direction'))
+        result = system.record_history(recorder)
+        assert system._all_rays is None
+        for s, rays in enumerate(all_rays):
+            mask = np.broadcast_to(rays.mask, result.mask[s].shape)
+            assert (result.mask[s] == mask).all()
+            position = np.broadcast_to(rays.position, result.data['position'][s].shape, subok=True)
+            assert np.allclose(result.get('position', s)[mask], position[mask], rtol=0, atol=1 * u.pm)
+
+        recorder = history.Recorder(dtype=np.float32, directory=tmp_path, image_only=True)
+        result = system.record_history(recorder)
+        assert result.surface_indices == [len(all_rays) - 1]
+        assert isinstance(result.data['position'], np.memmap)
+        assert result.data['position'].dtype == np.float32
+        image_rays = result.rays(len(all_rays) - 1)
+        assert (image_rays.mask == np.broadcast_to(all_rays[~0].mask, image_rays.grid_shape)).all()
+        with pytest.raises(ValueError):
+            result.get('position', 0)
+
+        system = grating_system()
+        system.all_rays
+        assert system.history is system.history
+        assert np.allclose(system.history.get('position', 2), system.all_rays[2].position, equal_nan=True)
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_vignetting(self, unitless_raytrace: bool):
+        system = baffled_grating_system(unitless_raytrace=unitless_raytrace, compaction_threshold=0.9)
+        result = system.vignetting()
+        assert result.surface_indices == [1, 2, 3, 4]
+        assert result.bits.dtype == np.uint8
+
+        image_rays = system.image_rays
+        valid = result.valid_mask
+        mask = np.broadcast_to(image_rays.mask, valid.shape)
+        assert (result.is_unvignetted[valid] == mask[valid]).all()
+        assert result.is_clipped(2).any()
+        first = result.first_clipping_surface
+        assert (first[valid & mask] == -1).all()
+        assert np.isin(first[valid & ~mask], result.surface_indices).all()
+
+        clipped, clipped_first = result.budget()
+        unvignetted = np.sum(result.weight * result.is_unvignetted, axis=(~4, ~3, ~2, ~1, ~0))
+        unvignetted = unvignetted / np.sum(result.weight, axis=(~4, ~3, ~2, ~1, ~0))
+        assert np.allclose(clipped_first.sum(0) + unvignetted, 1)
+        assert (clipped >= clipped_first).all()
+
+        system = baffled_grating_system(unitless_raytrace=unitless_raytrace)
+        system.surfaces[2].aperture.is_active = False
+        system.surfaces[3].aperture.is_active = False
+        system.update()
+        image_rays = system.image_rays
+        mask = np.broadcast_to(image_rays.mask, valid.shape)
+        expected = ~(result.is_clipped(1) | result.is_clipped(2))
+        assert (mask[valid] == expected[valid]).all()
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_jacobians(self, unitless_raytrace: bool):
+        system = grating_system(unitless_raytrace=unitless_raytrace)
+        input_rays = system.input_rays
+        step = 1 * u.um
+
+        def trace(dx: u.Quantity, dy: u.Quantity):
+            rays = input_rays.copy()
+            rays.position = rays.position + kgpy.vector.from_components(dx, dy)
+            return system.raytrace_subsystem(rays.init_jacobians())
+
+        rays = trace(0 * u.mm, 0 * u.mm)
+        for i, (dx, dy) in enumerate([(step, 0 * u.mm), (0 * u.mm, step)]):
+            rays_plus, rays_minus = trace(dx, dy), trace(-dx, -dy)
+            position_jacobian = (rays_plus.position - rays_minus.position) / (2 * step)
+            direction_jacobian = (rays_plus.direction - rays_minus.direction) / (2 * step)
+            assert np.allclose(rays.position_jacobian[..., i], position_jacobian, rtol=0, atol=1e-7, equal_nan=True)
+            assert np.allclose(rays.direction_jacobian[..., i], direction_jacobian, rtol=0, atol=1e-9 / u.mm, equal_nan=True)
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_calc_input_rays(self, unitless_raytrace: bool):
+        system = grating_system(unitless_raytrace=unitless_raytrace)
+        rays = system.raytrace_subsystem(system.input_rays, final_surface=system.stop_surface)
+        aper = system.stop_surface.aperture
+        margin = system.pupil_margin
+        px = np.linspace(aper.min[x] + margin, aper.max[x] - margin, system.pupil_samples)
+        py = np.linspace(aper.min[y] + margin, aper.max[y] - margin, system.pupil_samples)
+        assert np.allclose(rays.position[x], px[:, np.newaxis], rtol=0, atol=1 * u.nm)
+        assert np.allclose(rays.position[y], py, rtol=0, atol=1 * u.nm)
+
+    def test_calc_input_rays_sampler(self):
+        system = grating_system(pupil_sampler=sampling.Sobol(conform=True), field_sampler=sampling.Halton())
+        assert system.pupil_x is None
+        assert system.field_x is None
+        rays = system.raytrace_subsystem(system.input_rays, final_surface=system.stop_surface)
+        px, py, weight = system.pupil_points(system.stop_surface)
+        assert np.allclose(rays.position[x], px, rtol=0, atol=1 * u.nm)
+        assert np.allclose(rays.position[y], py, rtol=0, atol=1 * u.nm)
+        assert rays.mask.all()
+        assert np.allclose(rays.weight, np.pi / 4)
+
+    def test_raytrace_adaptive(self):
+        system = grating_system()
+        stop = system.stop_surface
+        rays = system.raytrace_adaptive(num_levels=3, final_surface=stop)
+        assert len(rays) == 4
+        weight = np.broadcast_to(rays[~0].weight, rays[~0].grid_shape)
+        radius = np.sqrt(np.square(rays[~0].position[x]) + np.square(rays[~0].position[y]))
+        assert np.allclose(radius[weight > 0], stop.aperture.radius, rtol=0.05)
+        num_rays = sum(np.prod(r.grid_shape[~1:]) for r in rays)
+        assert num_rays < (4 * 4 ** 3 + 1) ** 2 / 10
+
+        radius = stop.aperture.radius - system.pupil_margin
+        expected = np.pi * np.square(stop.aperture.radius) / np.square(2 * radius)
+        fraction_coarse = system.unvignetted_fraction(num_levels=0, final_surface=stop)
+        fraction = system.unvignetted_fraction(num_levels=3, final_surface=stop)
+        assert np.allclose(fraction, expected, rtol=0.005)
+        assert (np.abs(fraction - expected) < np.abs(fraction_coarse - expected)).all()
+
+    def test_calc_input_rays_num_traces(self, monkeypatch):
+        calls = []
+        raytrace_subsystem = System.raytrace_subsystem
+
+        def raytrace_subsystem_counted(self, *args, **kwargs):
+            calls.append(None)
+            return raytrace_subsystem(self, *args, **kwargs)
+
+        monkeypatch.setattr(System, 'raytrace_subsystem', raytrace_subsystem_counted)
+        system = grating_system(pupil_samples=21)
+        system.surfaces[2].aperture.is_test_stop = True
+        system.stop_surface = system.surfaces[2]
+        system.update()
+        system._calc_input_rays()
+        # Newton's method from the paraxial guess should converge in a few iterations for each of the two test stops.
+        assert 0 < len(calls) <= 10
+
+    @pytest.mark.parametrize('unitless_raytrace', [False, True])
+    def test_compaction(self, unitless_raytrace: bool):
+        kwargs = dict(field_mask_func=half_field_mask, unitless_raytrace=unitless_raytrace)
+        rays = baffled_grating_system(**kwargs).all_rays
+        rays_compact = baffled_grating_system(compaction_threshold=0.9, **kwargs).all_rays
+        assert len(rays) == len(rays_compact)
+        for r, r_compact in zip(rays, rays_compact):
+            mask = np.broadcast_to(r.mask, r.grid_shape)
+            assert r_compact.grid_shape == r.grid_shape
+            assert (r_compact.mask == mask).all()
+            position = np.broadcast_to(r.position, r.vector_grid_shape, subok=True)
+            assert np.allclose(r_compact.position[mask], position[mask], rtol=0, atol=1 * u.pm)
+        assert np.isnan(rays_compact[~0].position[~np.broadcast_to(rays[2].mask, rays[~0].grid_shape)]).all()
@@ -0,0 +1,126 @@
+"""
+Attribution of the vignetting of each ray to the apertures of a system, so that a vignetting budget can be found from a
+single raytrace instead of retracing the system with each aperture disabled.
+"""
+
+import dataclasses
+import typing as typ
+import numpy as np
+from .. import Rays
+
+__all__ = ['bit_dtype', 'Vignetting']
+
+
+def bit_dtype(num_bits: int) -> np.dtype:
+    """
+    The smallest unsigned integer type with at least `num_bits` bits.
+
+    :raises ValueError: If more than 64 bits are needed.
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if num_bits <= 8 * np.dtype(dtype).itemsize:
+            return np.dtype(dtype)
+    raise ValueError('Cannot pack ' + str(num_bits) + ' apertures into a 64-bit integer')
+
+
+@dataclasses.dataclass
+class Vignetting:
+    """
+    Which apertures clip each ray of a system, packed into a single integer per ray.
+
+    Bit :math:`k` of :attr:`bits` is set if the ray falls outside the aperture of the surface
+    :code:`surface_indices[k]`, whether or not it was already clipped by an earlier aperture, so each aperture is
+    evaluated independently of the others.
+    The apertures are in the order the rays reach them, so the lowest set bit is the first aperture that clips the ray.
+    """
+
+    surface_indices: typ.List[int]  # Index within the system of the surface of each bit.
+    bits: np.ndarray                # Bitfield of the apertures that clip each ray, with the shape of the ray grid.
+    valid_mask: np.ndarray          # Rays that are not masked by an error or the field mask on the final surface.
+    weight: np.ndarray              # Weight of each ray, zero if it is not valid.
+
+    @classmethod
+    def empty(cls, surface_indices: typ.List[int], grid_shape: typ.Tuple[int, ...]) -> 'Vignetting':
+        """
+        Create an attribution where no ray has been clipped yet.
+
+        :param surface_indices: Index within the system of each surface with an active aperture.
+        :param grid_shape: Shape of the complete grid of rays, including the configuration axes.
+        """
+        return cls(
+            surface_indices=list(surface_indices),
+            bits=np.zeros(grid_shape, dtype=bit_dtype(len(surface_indices))),
+            valid_mask=np.zeros(grid_shape, dtype=np.bool),
+            weight=np.zeros(grid_shape),
+        )
+
+    def record(self, k: int, is_unvignetted: np.ndarray, index: typ.Tuple[slice, ...] = ()) -> typ.NoReturn:
+        """
+        Set bit `k` of every ray outside an aperture.
+
+        :param k: Index of the aperture in :attr:`surface_indices`.
+        :param is_unvignetted: Result of :meth:`kgpy.optics.aperture.Aperture.is_unvignetted` for each ray.
+        :param index: Index of the rays within the trailing axes of the ray grid.
+        """
+        bits = self.bits[(..., ) + index]
+        bits |= np.logical_not(is_unvignetted).astype(bits.dtype) << bits.dtype.type(k)
+
+    def record_final(self, rays: Rays, index: typ.Tuple[slice, ...] = ()) -> typ.NoReturn:
+        """
+        Copy the masks and weight of the rays on the final surface.
+
+        :param rays: Rays on the final surface.
+        :param index: Index of the rays within the trailing axes of the ray grid.
+        """
+        index = (..., ) + index
+        self.valid_mask[index] = rays.error_mask & rays.field_mask
+        self.weight[index] = np.where(self.valid_mask[index], rays.weight, 0)
+
+    def is_clipped(self, surface_index: int) -> np.ndarray:
+        """
+        Rays that fall outside the aperture of a surface.
+
+        :param surface_index: Index of the surface within the system.
+        :raises ValueError: If the surface does not have an active aperture.
+        """
+        if surface_index not in self.surface_indices:
+            raise ValueError('Surface ' + str(surface_index) + ' does not have an active aperture')
+        k = self.surface_indices.index(surface_index)
+        return (self.bits >> self.bits.dtype.type(k)) & 1 == 1
+
+    @property
+    def is_unvignetted(self) -> np.ndarray:
+        """
+        Rays that pass through every aperture, equal to :attr:`kgpy.optics.Rays.vignetted_mask` on the final surface.
+        """
+        return self.bits == 0
+
+    @property
+    def first_clipping_surface(self) -> np.ndarray:
+        """
+        Index within the system of the first surface whose aperture clips each ray, or -1 for unvignetted rays.
+        """
+        result = np.full(self.bits.shape, -1)
+        for k in reversed(range(len(self.surface_indices))):
+            result = np.where((self.bits >> self.bits.dtype.type(k)) & 1 == 1, self.surface_indices[k], result)
+        return result
+
+    def budget(self, axis: typ.Optional[typ.Tuple[int, ...]] = None) -> typ.Tuple[np.ndarray, np.ndarray]:
+        """
+        Weighted fraction of the valid rays lost to each aperture.
+
+        :param axis: Axes of the ray grid to sum over, the wavelength, field and pupil axes if :code:`None`.
+        :return: The fraction clipped by each aperture on its own, and the fraction clipped first by each aperture,
+            which together with the unvignetted fraction sums to one.
+            Both have a leading axis for the aperture.
+        """
+        if axis is None:
+            axis = tuple(range(~(Rays.axis.ndim - 1), 0))
+        total = np.sum(self.weight, axis=axis)
+        first = self.first_clipping_surface
+        clipped = []
+        clipped_first = []
+        for surface_index in self.surface_indices:
+            clipped.append(np.sum(self.weight * self.is_clipped(surface_index), axis=axis) / total)
+            clipped_first.append(np.sum(self.weight * (first == surface_index), axis=axis) / total)
+        return np.array(clipped), np.array(clipped_first)
@@ -0,0 +1,124 @@
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+from kgpy.optics import Rays, coordinate, unitless
+
+
+@pytest.fixture
+def rays() -> Rays:
+    return Rays.from_field_angles(
+        wavelength_grid=[100, 200] * u.nm,
+        position=kgpy.vector.from_components(ax=np.linspace(-10, 10, 4) * u.mm),
+        field_grid_x=np.linspace(-1, 1, 3) * u.deg,
+        field_grid_y=np.linspace(-1, 1, 3) * u.deg,
+        field_mask_func=lambda fx, fy: np.ones(np.broadcast(fx, fy).shape, dtype=np.bool),
+    )
+
+
+class TestRays:
+
+    def test_lazy_fields(self, rays: Rays):
+        assert not rays.is_allocated('polarization')
+        assert not rays.is_allocated('vignetted_mask')
+        assert rays.polarization.shape == rays.vector_grid_shape
+        assert (rays.polarization[kgpy.vector.z] == 1).all()
+        assert rays.is_allocated('polarization')
+        assert rays.index_of_refraction.unit == u.dimensionless_unscaled
+        assert rays.vignetted_mask.all()
+
+    def test_lazy_fields_unitless(self, rays: Rays):
+        rays = unitless.to_value(rays)
+        assert not rays.is_allocated('index_of_refraction')
+        assert not isinstance(rays.index_of_refraction, u.Quantity)
+        assert not isinstance(rays.surface_normal, u.Quantity)
+
+    def test_copy(self, rays: Rays):
+        rays.error_mask
+        rays_copy = rays.copy()
+        assert not rays_copy.is_allocated('polarization')
+        rays_copy.position[kgpy.vector.z] -= 1 * u.mm
+        rays_copy.error_mask[...] = False
+        assert (rays.position[kgpy.vector.z] == 0).all()
+        assert rays.error_mask.all()
+
+    def test_tilt_decenter(self, rays: Rays):
+        transform = coordinate.TiltDecenter(decenter=coordinate.Decenter(x=1 * u.mm))
+        rays_transformed = rays.tilt_decenter(transform)
+        assert not rays_transformed.is_allocated('surface_normal')
+        assert np.allclose(rays_transformed.position[kgpy.vector.x], rays.position[kgpy.vector.x] + 1 * u.mm)
+
+    def test_init_jacobians(self, rays: Rays):
+        assert not rays.is_differential
+        rays.init_jacobians()
+        assert rays.is_differential
+        assert rays.position_jacobian.shape == rays.vector_grid_shape + (2, )
+        assert (rays.position_jacobian[..., :kgpy.vector.iz, :] == np.identity(2)).all()
+        assert (rays.direction_jacobian == 0).all()
+
+        transform = coordinate.TiltDecenter(
+            tilt=coordinate.Tilt(z=90 * u.deg),
+            decenter=coordinate.Decenter(x=1 * u.mm),
+        )
+        rays_transformed = rays.tilt_decenter(transform)
+        expected = transform(rays.position_jacobian[..., 0], decenter=False, num_extra_dims=5)
+        assert np.allclose(rays_transformed.position_jacobian[..., 0], expected)
+
+        index = (slice(1), slice(None), slice(None), slice(2), slice(None))
+        rays_slice = rays.grid_slice(index)
+        assert rays_slice.position_jacobian.shape == rays_slice.vector_grid_shape + (2, )
+
+    def test_grid_compact(self, rays: Rays):
+        rays.vignetted_mask[..., 0, 0, :, :] = False
+        rays.vignetted_mask[..., 1, 2, :, 1] = False
+        mask = np.broadcast_to(rays.mask, rays.grid_shape)
+        rays_compact, index = rays.grid_compact()
+        assert rays_compact.grid_shape == (1, 1, 1, 1, np.count_nonzero(mask))
+        assert rays_compact.mask.all()
+        assert (index >= 0).all()
+
+        rays_compact.position[kgpy.vector.z] += 1 * u.mm
+        rays_uncompact = rays_compact.grid_uncompact(index, rays)
+        assert rays_uncompact.grid_shape == rays.grid_shape
+        assert (rays_uncompact.mask == mask).all()
+        assert (rays_uncompact.wavelength == np.broadcast_to(rays.wavelength, rays.scalar_grid_shape, subok=True)).all()
+        position = np.broadcast_to(rays.position, rays.vector_grid_shape, subok=True)
+        assert (rays_uncompact.position[mask] == position[mask] + kgpy.vector.from_components(az=1 * u.mm)).all()
+        assert np.isnan(rays_uncompact.position[~mask]).all()
+
+    def test_grid_compact_configurations(self, rays: Rays):
+        rays.position = np.stack([rays.position, rays.position])
+        rays.vignetted_mask = np.ones(rays.grid_shape, dtype=np.bool)
+        rays.vignetted_mask[0, ..., 0, :] = False
+        rays_compact, index = rays.grid_compact()
+        assert rays_compact.grid_shape == (2, 1, 1, 1, 1, np.prod(rays.grid_shape[1:]))
+        assert (index[0] == -1).any()
+        assert (index[1] >= 0).all()
+        rays_uncompact = rays_compact.grid_uncompact(index, rays)
+        assert (rays_uncompact.mask == rays.mask).all()
+
+    @pytest.mark.parametrize('per_cell_limits', [False, True])
+    def test_pupil_hist2d(self, rays: Rays, per_cell_limits: bool):
+        rng = np.random.default_rng(0)
+        rays.position = kgpy.vector.from_components(
+            ax=rng.normal(size=rays.grid_shape[:rays.axis.pupil_x] + (8, 4)),
+            ay=rng.normal(size=rays.grid_shape[:rays.axis.pupil_x] + (8, 4)),
+        ) << u.mm
+        rays.weight = rng.random(rays.grid_shape)
+        rays.vignetted_mask = rng.random(rays.grid_shape) > 0.2
+        hist, edges_x, edges_y = rays.pupil_hist2d(bins=(5, 4), per_cell_limits=per_cell_limits)
+        assert hist.shape == rays.grid_shape[:rays.axis.pupil_x] + (5, 4)
+
+        mask = rays.mask
+        for index in np.ndindex(*hist.shape[:rays.axis.pupil_x]):
+            hist_expected, edges_x_expected, edges_y_expected = np.histogram2d(
+                x=rays.position[index][kgpy.vector.x].flatten().value,
+                y=rays.position[index][kgpy.vector.y].flatten().value,
+                bins=(5, 4),
+                weights=(mask * rays.weight)[index].flatten(),
+                range=(edges_x[index][[0, ~0]].value, edges_y[index][[0, ~0]].value),
+            )
+            assert np.allclose(hist[index], hist_expected)
+            assert np.allclose(edges_x[index].value, edges_x_expected)
+            assert np.allclose(edges_y[index].value, edges_y_expected)
+        assert np.isclose(hist.sum(), (mask * rays.weight).sum())
@@ -0,0 +1,102 @@
+"""
+Utilities for converting optical models to plain :class:`numpy.ndarray` instances expressed in canonical (SI) units.
+
+Most of the arithmetic in the raytrace kernel is unit-agnostic, so a unit-free copy of a surface can be traced using
+the same code as the original surface, without the overhead of :class:`astropy.units.Quantity` bookkeeping.
+"""
+
+import copy
+import dataclasses
+import typing as typ
+import numpy as np
+import astropy.units as u
+
+__all__ = ['canonical_unit', 'to_value', 'to_quantity', 'like']
+
+T = typ.TypeVar('T')
+
+
+def canonical_unit(unit: u.UnitBase) -> u.UnitBase:
+    """
+    The unscaled SI unit that values with units of `unit` are converted to by :func:`to_value`.
+
+    :param unit: Any :class:`astropy.units.Unit`.
+    :return: `unit` decomposed into SI base units, with the scale factor removed.
+    """
+    unit_si = unit.si
+    return u.CompositeUnit(1, unit_si.bases, unit_si.powers)
+
+
+def to_value(obj: T) -> T:
+    """
+    Recursively convert every :class:`astropy.units.Quantity` in `obj` to a float64 array in canonical units.
+
+    Dataclass instances are shallow-copied before their fields are converted, so `obj` itself is never modified.
+
+    :param obj: A :class:`astropy.units.Quantity`, a dataclass instance, a list or tuple of such, or any other value,
+        which is returned unchanged.
+    :return: A unit-free copy of `obj`.
+    """
+    if isinstance(obj, u.Quantity):
+        return np.asarray(obj.si.value, dtype=float)[()]
+    elif isinstance(obj, list):
+        return [to_value(v) for v in obj]
+    elif isinstance(obj, tuple):
+        return tuple(to_value(v) for v in obj)
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        new_obj = copy.copy(obj)
+        for field in dataclasses.fields(obj):
+            if field.name not in vars(obj):
+                continue    # Lazily-allocated field that has not been allocated yet, see kgpy.optics.rays.LazyField
+            value = getattr(obj, field.name)
+            new_value = to_value(value)
+            if new_value is not value:
+                setattr(new_obj, field.name, new_value)
+        return new_obj
+    else:
+        return obj
+
+
+def to_quantity(obj: T, template: T) -> T:
+    """
+    Inverse of :func:`to_value`, attaching the units of `template` to the unit-free values in `obj`.
+
+    :param obj: The output of :func:`to_value`, or an object with the same structure.
+    :param template: An object with the same structure as `obj` containing :class:`astropy.units.Quantity` instances
+        in the units that the result should be expressed in.
+    :return: A copy of `obj` where every field that is a :class:`astropy.units.Quantity` in `template` has been
+        converted back to a :class:`astropy.units.Quantity`.
+    """
+    if isinstance(template, u.Quantity):
+        if obj is None or isinstance(obj, u.Quantity):
+            return obj
+        return (obj << canonical_unit(template.unit)).to(template.unit)
+    elif isinstance(template, (list, tuple)) and isinstance(obj, (list, tuple)):
+        return type(obj)(to_quantity(v, t) for v, t in zip(obj, template))
+    elif dataclasses.is_dataclass(template) and dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        new_obj = copy.copy(obj)
+        for field in dataclasses.fields(obj):
+            if field.name not in vars(obj):
+                continue
+            value = getattr(obj, field.name)
+            new_value = to_quantity(value, getattr(template, field.name, None))
+            if new_value is not value:
+                setattr(new_obj, field.name, new_value)
+        return new_obj
+    else:
+        return obj
+
+
+def like(value: u.Quantity, reference: np.ndarray) -> np.ndarray:
+    """
+    Express a constant in the same system as `reference`.
+
+    :param value: A constant used by the raytrace kernel, such as a convergence tolerance.
+    :param reference: An array from the current trace.
+    :return: `value` unchanged if `reference` is a :class:`astropy.units.Quantity`, otherwise `value` converted to
+        canonical units by :func:`to_value`.
+    """
+    if isinstance(reference, u.Quantity):
+        return value
+    else:
+        return to_value(value)
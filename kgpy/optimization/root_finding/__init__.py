@@ -1,2 +1,3 @@
 from .secant import secant
+from .newton import newton
 from . import broyden
@@ -0,0 +1,51 @@
+import typing as typ
+import numpy as np
+import kgpy.vector
+
+__all__ = ['newton']
+
+
+def newton(
+        func: typ.Callable[[np.ndarray], typ.Tuple[np.ndarray, np.ndarray]],
+        root_guess: np.ndarray = np.array(0),
+        max_abs_error: float = 1e-9,
+        max_iterations: int = 100,
+):
+    """
+    Newton's method for finding the roots of many independent vector-valued functions at once.
+    Unlike :func:`kgpy.optimization.root_finding.secant`, `func` computes its own Jacobian, so each iteration only
+    evaluates `func` once.
+
+    :param func: Function returning the value of the function at the given point, with the components along the last
+        axis, and the Jacobian of the function, with the derivatives with respect to each component of the point along
+        a new last axis.
+    :param root_guess: Initial guess of the root.
+    :param max_abs_error: The iteration stops once the magnitude of every value of `func` is less than this value.
+    :param max_iterations: Maximum number of iterations before a :class:`ValueError` is raised.
+    :return: The root of `func`.
+    """
+
+    x1 = root_guess
+
+    i = 0
+    while True:
+
+        if i > max_iterations:
+            raise ValueError('Max iterations exceeded')
+        i += 1
+
+        f1, jac = func(x1)
+
+        f1_mag = kgpy.vector.length(f1, keepdims=False)
+        converged = f1_mag < max_abs_error
+        if converged.all():
+            break
+
+        inv_jac = np.zeros_like(jac)
+        det = np.linalg.det(jac)
+        singular = ~np.isfinite(det) | (det == 0)
+        inv_jac[~singular, :, :] = np.linalg.inv(jac[~singular, :, :])
+
+        x1 = x1 - kgpy.vector.matmul(inv_jac, f1)
+
+    return x1
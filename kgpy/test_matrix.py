@@ -0,0 +1,32 @@
+import os
+import timeit
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.matrix
+
+
+def legacy_mul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = np.expand_dims(a, ~0)
+    b = np.swapaxes(b, ~0, ~1)
+    b = np.expand_dims(b, ~2)
+    return np.sum(a * b, axis=~1)
+
+
+def test_mul():
+    a = np.random.random((7, 5, 3, 3)) << u.mm
+    b = np.random.random((5, 3, 3))
+    assert np.allclose(kgpy.matrix.mul(a, b), legacy_mul(a, b))
+    out = np.empty(a.shape) << u.mm
+    assert kgpy.matrix.mul(a, b, out=out) is out
+    assert np.allclose(out, legacy_mul(a, b))
+
+
+@pytest.mark.skipif('KGPY_BENCHMARK' not in os.environ, reason='Benchmark, set KGPY_BENCHMARK to run')
+def test_mul_benchmark():
+    a = np.random.random((3, 2, 9, 9, 21, 21, 3, 3))
+    b = np.random.random((3, 1, 1, 1, 1, 1, 3, 3))
+    t_legacy = min(timeit.repeat(lambda: legacy_mul(a, b), number=3, repeat=3)) / 3
+    t_new = min(timeit.repeat(lambda: kgpy.matrix.mul(a, b), number=3, repeat=3)) / 3
+    print()
+    print('mul : legacy', t_legacy, 's, new', t_new, 's, speedup:', t_legacy / t_new)
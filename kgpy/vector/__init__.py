@@ -5,7 +5,6 @@ Package for easier manipulation of vectors than the usual numpy functions.
 import typing as typ
 import numpy as np
 import astropy.units as u
-from .. import matrix
 
 __all__ = [
     'x', 'y', 'z', 'ix', 'iy', 'iz', 'xy', 'x_hat', 'y_hat', 'z_hat',
@@ -31,32 +30,40 @@ def to_3d(a: np.ndarray) -> np.ndarray:
     return from_components(a[x], a[y])
 
 
-def dot(a: np.ndarray, b: np.ndarray, keepdims: bool = True) -> np.ndarray:
-    return np.sum(a * b, axis=~0, keepdims=keepdims)
+def dot(a: np.ndarray, b: np.ndarray, keepdims: bool = True, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    if out is not None:
+        np.einsum('...i,...i->...', a, b, out=out[..., 0] if keepdims else out)
+        return out
+    result = np.einsum('...i,...i->...', a, b)
+    if keepdims:
+        result = result[..., np.newaxis]
+    return result
 
 
-def outer(a: np.ndarray, b: np.ndarray) -> np.ndarray:
-    a = np.expand_dims(a, ~1)
-    b = np.expand_dims(b, ~0)
-    return a * b
+def outer(a: np.ndarray, b: np.ndarray, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    return np.multiply(a[..., :, np.newaxis], b[..., np.newaxis, :], out=out)
 
 
-def matmul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
-    b = np.expand_dims(b, ~1)
-    return matrix.mul(a, b)[..., 0]
+def matmul(a: np.ndarray, b: np.ndarray, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    if out is not None:
+        np.matmul(a, b[..., np.newaxis], out=out[..., np.newaxis])
+        return out
+    return np.matmul(a, b[..., np.newaxis])[..., 0]
 
 
-def lefmatmul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
-    a = np.expand_dims(a, ~0)
-    return matrix.mul(a, b)[..., 0]
+def lefmatmul(a: np.ndarray, b: np.ndarray, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    if out is not None:
+        np.matmul(a[..., np.newaxis, :], b, out=out[..., np.newaxis, :])
+        return out
+    return np.matmul(a[..., np.newaxis, :], b)[..., 0, :]
 
 
-def length(a: np.ndarray, keepdims: bool = True) -> np.ndarray:
-    return np.sqrt(np.sum(np.square(a), axis=~0, keepdims=keepdims))
+def length(a: np.ndarray, keepdims: bool = True, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    return np.sqrt(dot(a, a, keepdims=keepdims), out=out)
 
 
-def normalize(a: np.ndarray, keepdims: bool = True) -> np.ndarray:
-    return a / length(a, keepdims=keepdims)
+def normalize(a: np.ndarray, keepdims: bool = True, out: typ.Optional[np.ndarray] = None) -> np.ndarray:
+    return np.divide(a, length(a, keepdims=keepdims), out=out)
 
 
 @typ.overload
@@ -81,7 +88,12 @@ def from_components_cylindrical(ar: np.ndarray = 0, ap: np.ndarray = 0, az: np.n
     return from_components(ar * np.cos(ap), ar * np.sin(ap), az)
 
 
-def rotate_x(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np.ndarray:
+def rotate_x(
+        vector: np.ndarray,
+        angle: u.Quantity,
+        inverse: bool = False,
+        out: typ.Optional[np.ndarray] = None,
+) -> np.ndarray:
     if inverse:
         angle = -angle
     r = np.zeros(angle.shape + (3, 3))
@@ -90,10 +102,15 @@ def rotate_x(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np
     r[..., 1, 2] = np.sin(angle)
     r[..., 2, 1] = -np.sin(angle)
     r[..., 2, 2] = np.cos(angle)
-    return matmul(r, vector)
+    return matmul(r, vector, out=out)
 
 
-def rotate_y(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np.ndarray:
+def rotate_y(
+        vector: np.ndarray,
+        angle: u.Quantity,
+        inverse: bool = False,
+        out: typ.Optional[np.ndarray] = None,
+) -> np.ndarray:
     if inverse:
         angle = -angle
     r = np.zeros(angle.shape + (3, 3))
@@ -102,10 +119,15 @@ def rotate_y(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np
     r[..., 1, 1] = 1
     r[..., 2, 0] = np.sin(angle)
     r[..., 2, 2] = np.cos(angle)
-    return matmul(r, vector)
+    return matmul(r, vector, out=out)
 
 
-def rotate_z(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np.ndarray:
+def rotate_z(
+        vector: np.ndarray,
+        angle: u.Quantity,
+        inverse: bool = False,
+        out: typ.Optional[np.ndarray] = None,
+) -> np.ndarray:
     if inverse:
         angle = -angle
     r = np.zeros(angle.shape + (3, 3))
@@ -114,16 +136,21 @@ def rotate_z(vector: np.ndarray, angle: u.Quantity, inverse: bool = False) -> np
     r[..., 1, 0] = -np.sin(angle)
     r[..., 1, 1] = np.cos(angle)
     r[..., 2, 2] = 1
-    return matmul(r, vector)
+    return matmul(r, vector, out=out)
 
 
-def rotate(vector: np.ndarray, angles: u.Quantity, inverse: bool = False) -> np.ndarray:
+def rotate(
+        vector: np.ndarray,
+        angles: u.Quantity,
+        inverse: bool = False,
+        out: typ.Optional[np.ndarray] = None,
+) -> np.ndarray:
     if not inverse:
         vector = rotate_x(vector, angles[x], inverse=inverse)
         vector = rotate_y(vector, angles[y], inverse=inverse)
-        vector = rotate_z(vector, angles[z], inverse=inverse)
+        vector = rotate_z(vector, angles[z], inverse=inverse, out=out)
     else:
         vector = rotate_z(vector, angles[z], inverse=inverse)
         vector = rotate_y(vector, angles[y], inverse=inverse)
-        vector = rotate_x(vector, angles[x], inverse=inverse)
+        vector = rotate_x(vector, angles[x], inverse=inverse, out=out)
     return vector
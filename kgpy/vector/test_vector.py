@@ -0,0 +1,94 @@
+import os
+import timeit
+import typing as typ
+import pytest
+import numpy as np
+import astropy.units as u
+import kgpy.vector
+
+grid_shape = (3, 2, 9, 9, 21, 21)
+
+
+def legacy_mul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = np.expand_dims(a, ~0)
+    b = np.swapaxes(b, ~0, ~1)
+    b = np.expand_dims(b, ~2)
+    return np.sum(a * b, axis=~1)
+
+
+def legacy_matmul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    b = np.expand_dims(b, ~1)
+    return legacy_mul(a, b)[..., 0]
+
+
+def legacy_dot(a: np.ndarray, b: np.ndarray, keepdims: bool = True) -> np.ndarray:
+    return np.sum(a * b, axis=~0, keepdims=keepdims)
+
+
+def legacy_normalize(a: np.ndarray) -> np.ndarray:
+    return a / np.sqrt(np.sum(np.square(a), axis=~0, keepdims=True))
+
+
+@pytest.fixture
+def vectors() -> u.Quantity:
+    return np.random.random(grid_shape + (3, )) << u.mm
+
+
+@pytest.fixture
+def matrices() -> np.ndarray:
+    return np.random.random(grid_shape[:1] + (1, ) * (len(grid_shape) - 1) + (3, 3))
+
+
+def test_dot(vectors: u.Quantity):
+    assert np.allclose(kgpy.vector.dot(vectors, vectors), legacy_dot(vectors, vectors))
+    assert np.allclose(kgpy.vector.dot(vectors, vectors, keepdims=False), legacy_dot(vectors, vectors, False))
+    out = np.empty(grid_shape + (1, )) << u.mm ** 2
+    assert kgpy.vector.dot(vectors, vectors, out=out) is out
+    assert np.allclose(out, legacy_dot(vectors, vectors))
+
+
+def test_matmul(vectors: u.Quantity, matrices: np.ndarray):
+    assert np.allclose(kgpy.vector.matmul(matrices, vectors), legacy_matmul(matrices, vectors))
+    out = np.empty(vectors.shape) << u.mm
+    assert kgpy.vector.matmul(matrices, vectors, out=out) is out
+    assert np.allclose(out, legacy_matmul(matrices, vectors))
+
+
+def test_lefmatmul():
+    a = np.random.random(grid_shape + (3, ))
+    b = np.random.random((3, 3))
+    assert np.allclose(kgpy.vector.lefmatmul(a, b), np.einsum('...i,ij->...j', a, b))
+
+
+def test_normalize(vectors: u.Quantity):
+    out = np.empty(vectors.shape) << u.dimensionless_unscaled
+    assert np.allclose(kgpy.vector.normalize(vectors, out=out), legacy_normalize(vectors))
+    assert np.allclose(out, legacy_normalize(vectors))
+
+
+@pytest.mark.parametrize('rotate', [kgpy.vector.rotate_x, kgpy.vector.rotate_y, kgpy.vector.rotate_z])
+def test_rotate(vectors: u.Quantity, rotate: typ.Callable):
+    angle = 30 * u.deg
+    result = rotate(vectors, angle)
+    assert np.allclose(kgpy.vector.length(result), kgpy.vector.length(vectors))
+    out = np.empty(vectors.shape) << u.mm
+    rotate(vectors, angle, out=out)
+    assert np.allclose(out, result)
+    assert np.allclose(rotate(result, angle, inverse=True), vectors)
+
+
+@pytest.mark.skipif('KGPY_BENCHMARK' not in os.environ, reason='Benchmark, set KGPY_BENCHMARK to run')
+def test_benchmark(vectors: u.Quantity, matrices: np.ndarray):
+    out = np.empty(vectors.shape) << u.mm
+    kernels = {
+        'dot': (lambda: legacy_dot(vectors, vectors), lambda: kgpy.vector.dot(vectors, vectors)),
+        'matmul': (lambda: legacy_matmul(matrices, vectors), lambda: kgpy.vector.matmul(matrices, vectors)),
+        'matmul out': (lambda: legacy_matmul(matrices, vectors), lambda: kgpy.vector.matmul(matrices, vectors, out=out)),
+        'normalize': (lambda: legacy_normalize(vectors), lambda: kgpy.vector.normalize(vectors)),
+    }
+    print()
+    print('grid shape:', grid_shape)
+    for name, (legacy, new) in kernels.items():
+        t_legacy = min(timeit.repeat(legacy, number=3, repeat=3)) / 3
+        t_new = min(timeit.repeat(new, number=3, repeat=3)) / 3
+        print(name, ': legacy', t_legacy, 's, new', t_new, 's, speedup:', t_legacy / t_new)